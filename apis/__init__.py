@@ -2,5 +2,7 @@
 General classes used for REST APIs
 """
 
-from .response import APIResponse, Model, AnyModel
-from .request import APIRequest, APIRequestParameters
+from .response import APIResponse, Model, AnyModel, model
+from .request import APIRequest, APIRequestParameters, CachePolicy
+from .scheduler import Priority, Scheduler, scheduling
+from . import cache, transport
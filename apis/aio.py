@@ -0,0 +1,71 @@
+"""
+Sends `APIRequest`s from asyncio code without blocking the event loop, so many requests
+can be in flight at once on a single thread. Open an `AsyncSession`, then `await send(session, req)`;
+afterwards the request's `response` (and e.g. `success`) can be read without blocking.
+Requests are sent with httpx when using the live transport, otherwise the current transport
+is run on a worker thread so recording and replaying cassettes still works.
+"""
+
+from __future__ import annotations
+import asyncio
+from typing import Any, Optional, TypeVar
+
+import httpx
+
+from .cache import MISSING, cache
+from .request import APIRequest
+from .transport import LiveTransport, Response, transport
+
+# Default maximum number of requests in flight at once in a session
+MAX_CONCURRENT_REQUESTS = 16
+
+# Seconds before giving up on a request
+REQUEST_TIMEOUT = 30
+
+AnyRequest = TypeVar('AnyRequest', bound=APIRequest)
+
+
+class AsyncSession:
+    """An HTTP connection pool with a limit on concurrent requests, use with `async with`"""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS):
+        self.client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __aenter__(self) -> AsyncSession:
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def request(self, method: str, url: str, params: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None) -> Response:
+        """Sends a request, with `params` in the query string of a GET or the form data of a POST"""
+        async with self.semaphore:
+            t = transport()
+            if not isinstance(t, LiveTransport):
+                return await asyncio.to_thread(t.request, method, url, params, headers)
+            if method.upper() == 'GET':
+                return await self.client.get(url, params=params, headers=headers)
+            return await self.client.request(method, url, data=params, headers=headers)
+
+    async def get(self, url: str, params: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None) -> Response:
+        return await self.request('GET', url, params, headers)
+
+    async def post(self, url: str, data: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None) -> Response:
+        return await self.request('POST', url, data, headers)
+
+
+async def send(session: AsyncSession, req: AnyRequest) -> AnyRequest:
+    """Sends a request, after which its `response` is read from the result without blocking"""
+    # Responses kept in the shared cache aren't sent again
+    if req.cached:
+        value = cache().get(req.cache_policy.namespace, req.cache_key) # type: ignore `cached` checks it's set
+        if value is not MISSING:
+            req.__dict__['response'] = value
+            return req
+    # Fill in the request's cached response, so it's never fetched synchronously
+    req.__dict__['_res'] = await session.get(req.url, req.parameters, req.headers)
+    return req
@@ -0,0 +1,337 @@
+"""
+Caches API responses for a while, shared by every worker process of the server, so an athlete,
+their stats, or a GeoDB place fetched by one worker doesn't need fetching again by the others.
+`SQLiteCache` keeps entries in a SQLite database in WAL mode, which any number of processes can
+read at once while one writes, and needs no server. Each entry belongs to a namespace, e.g.
+`strava:stats`, and expires after its own TTL. The least recently used entries are evicted
+once the cache is over its size.
+
+`get_or_compute` makes sure only one process computes a missing entry at a time: the first
+takes a lease on the key, and the others wait for its result rather than sending the same
+request. Hits, misses, and evictions are counted per namespace, see `stats`.
+
+Choose the cache with `use`, or by setting `STRAVACO2_CACHE` to the database's path, or to
+`off` for no caching. `STRAVACO2_CACHE_MB` sets its size.
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import atexit
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+# Seconds a lease is held before another process may compute the entry instead, e.g. if its holder crashed
+LEASE_SECONDS = 30
+
+# Seconds between checks for a leased entry's value
+LEASE_POLL_SECONDS = 0.05
+
+# Seconds between updates of an entry's last use, so that most hits don't write
+TOUCH_SECONDS = 60
+
+# Seconds between writes of each process's counts to the shared statistics
+STATS_FLUSH_SECONDS = 5
+
+# Fraction of the maximum size that eviction frees the cache down to
+EVICT_TO = 0.9
+
+MISSING: Any = object()
+"""Returned by `Cache.get` for keys without an unexpired entry"""
+
+
+@dataclass
+class CacheStats:
+    """Counts for one namespace, across every process"""
+    hits: int = 0
+    misses: int = 0
+    sets: int = 0
+    evictions: int = 0                      # Entries removed for space or because they expired
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+class Cache(ABC):
+    """JSON-serialisable values by namespace and key, each kept for its own TTL"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Any:
+        """The value of a key, or `MISSING` if it has none or it has expired"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        """Keeps a value for `ttl` seconds"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError()
+
+    def get_or_compute(
+        self,
+        namespace: str,
+        key: str,
+        compute: Callable[[], Any],
+        ttl: float,
+        store: Callable[[Any], bool] = lambda _: True,
+    ) -> Any:
+        """
+        The value of a key, computing and keeping it if there is none.
+        :param store: Whether to keep a computed value, e.g. not an error response
+        """
+        value = self.get(namespace, key)
+        if value is not MISSING: return value
+        value = compute()
+        if store(value): self.set(namespace, key, value, ttl)
+        return value
+
+    @abstractmethod
+    def stats(self) -> dict[str, CacheStats]:
+        """Statistics by namespace"""
+        raise NotImplementedError()
+
+
+class NullCache(Cache):
+    """Keeps nothing, so every value is computed"""
+
+    def get(self, namespace, key) -> Any: return MISSING
+    def set(self, namespace, key, value, ttl) -> None: pass
+    def delete(self, namespace, key) -> None: pass
+    def stats(self) -> dict[str, CacheStats]: return {}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS leases (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    until REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    namespace TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    sets INTEGER NOT NULL DEFAULT 0,
+    evictions INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS size (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO size VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+    BEGIN UPDATE size SET bytes = bytes + NEW.size; END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+    BEGIN UPDATE size SET bytes = bytes - OLD.size; END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries
+    BEGIN UPDATE size SET bytes = bytes - OLD.size + NEW.size; END;
+"""
+
+
+class SQLiteCache(Cache):
+    """
+    A cache in a SQLite database file, shared by every process that opens the same file.
+    :param max_bytes: Size of the values kept before the least recently used are evicted
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._counts: dict[str, list[int]] = {}
+        """This process's counts since they were last flushed, as `[hits, misses, sets, evictions]`"""
+        self._counts_lock = threading.Lock()
+        self._counts_pid = os.getpid()
+        self._flushed = time.monotonic()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db.executescript(_SCHEMA)
+        atexit.register(self.flush_stats)
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This thread's connection, opened again after a fork since connections can't be shared"""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction, taking the database's write lock straight away"""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _count(self, namespace: str, i: int, n: int = 1) -> None:
+        with self._counts_lock:
+            # A forked process starts counting afresh, its parent flushes the counts from before the fork
+            if self._counts_pid != os.getpid(): self._counts, self._counts_pid = {}, os.getpid()
+            self._counts.setdefault(namespace, [0, 0, 0, 0])[i] += n
+        if time.monotonic() - self._flushed > STATS_FLUSH_SECONDS: self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Adds this process's counts to the shared statistics"""
+        with self._counts_lock:
+            counts, self._counts = self._counts, {}
+            self._flushed = time.monotonic()
+        if not counts: return
+        with self._transaction() as db:
+            db.executemany(
+                'INSERT INTO stats VALUES (?, ?, ?, ?, ?) ON CONFLICT (namespace) DO UPDATE SET '
+                'hits = hits + excluded.hits, misses = misses + excluded.misses, '
+                'sets = sets + excluded.sets, evictions = evictions + excluded.evictions',
+                [(ns, *c) for ns, c in counts.items()],
+            )
+
+    def get(self, namespace: str, key: str) -> Any:
+        now = time.time()
+        row = self._db.execute('SELECT value, expires, used FROM entries WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        if row is None or row[1] <= now:
+            self._count(namespace, 1)
+            return MISSING
+        value, _, used = row
+        if now - used > TOUCH_SECONDS:
+            self._db.execute('UPDATE entries SET used = ? WHERE namespace = ? AND key = ?', (now, namespace, key))
+        self._count(namespace, 0)
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        data = json.dumps(value, separators=(',', ':')).encode()
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE SET '
+                'value = excluded.value, size = excluded.size, expires = excluded.expires, used = excluded.used',
+                (namespace, key, data, len(data), now + ttl, now),
+            )
+            evicted = self._evict(db, now)
+        self._count(namespace, 2)
+        for ns, n in evicted.items(): self._count(ns, 3, n)
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> dict[str, int]:
+        """
+        Removes expired entries, then the least recently used, once the cache is over its size.
+        Returns the number of entries removed from each namespace.
+        """
+        evicted: dict[str, int] = {}
+        (size,) = db.execute('SELECT bytes FROM size').fetchone()
+        if size <= self.max_bytes: return evicted
+        rows = db.execute('DELETE FROM entries WHERE expires <= ? RETURNING namespace', (now,)).fetchall()
+        (size,) = db.execute('SELECT bytes FROM size').fetchone()
+        if size > self.max_bytes:
+            # The least recently used entries whose sizes add up to the excess
+            rows += db.execute(
+                'DELETE FROM entries WHERE (namespace, key) IN ('
+                'SELECT namespace, key FROM ('
+                'SELECT namespace, key, size, SUM(size) OVER (ORDER BY used, namespace, key) AS total FROM entries'
+                ') WHERE total - size < ?) RETURNING namespace',
+                (size - EVICT_TO * self.max_bytes,),
+            ).fetchall()
+        for (namespace,) in rows: evicted[namespace] = evicted.get(namespace, 0) + 1
+        return evicted
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._transaction() as db:
+            db.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def _lease(self, namespace: str, key: str, owner: str) -> Any:
+        """
+        Takes the lease on a key, returning `MISSING` if it was taken, the key's value if it
+        has one after all, or `None` if another process holds the lease.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute('SELECT value, expires FROM entries WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+            if row is not None and row[1] > now: return json.loads(row[0])
+            lease = db.execute('SELECT owner, until FROM leases WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+            if lease is not None and lease[0] != owner and lease[1] > now: return None
+            db.execute('INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)', (namespace, key, owner, now + LEASE_SECONDS))
+        return MISSING
+
+    def get_or_compute(self, namespace, key, compute, ttl, store=lambda _: True) -> Any:
+        value = self.get(namespace, key)
+        if value is not MISSING: return value
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        while True:
+            value = self._lease(namespace, key, owner)
+            if value is MISSING: break
+            if value is not None: return value
+            # Another process is computing it
+            time.sleep(LEASE_POLL_SECONDS)
+        try:
+            value = compute()
+            if store(value): self.set(namespace, key, value, ttl)
+            return value
+        finally:
+            with self._transaction() as db:
+                db.execute('DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?', (namespace, key, owner))
+
+    def stats(self) -> dict[str, CacheStats]:
+        self.flush_stats()
+        db = self._db
+        stats = {ns: CacheStats(*counts) for ns, *counts in db.execute('SELECT namespace, hits, misses, sets, evictions FROM stats')}
+        for ns, entries, size in db.execute('SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace'):
+            s = stats.setdefault(ns, CacheStats())
+            s.entries, s.bytes = entries, size
+        return stats
+
+
+def from_environment() -> Cache:
+    path = os.environ.get('STRAVACO2_CACHE', os.path.join(os.environ.get('STRAVACO2_DATA', 'data'), 'cache.sqlite'))
+    if path.lower() in ('off', 'none', ''): return NullCache()
+    return SQLiteCache(path, int(float(os.environ.get('STRAVACO2_CACHE_MB', 64)) * 1024 * 1024))
+
+_cache: Optional[Cache] = None
+_cache_lock = threading.Lock()
+
+def cache() -> Cache:
+    """The cache that responses are currently kept in, opened when it's first used"""
+    global _cache
+    with _cache_lock:
+        if _cache is None: _cache = from_environment()
+        return _cache
+
+def use(c: Optional[Cache]) -> Optional[Cache]:
+    """Keeps responses in `c` from now on, or in the cache set by the environment if `None`, returning the previous cache"""
+    global _cache
+    with _cache_lock:
+        previous, _cache = _cache, c
+    return previous
+
+@contextmanager
+def using(c: Cache) -> Iterator[Cache]:
+    """Keeps the responses of requests made inside the block in `c`"""
+    previous = use(c)
+    try:
+        yield c
+    finally:
+        use(previous)
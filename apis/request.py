@@ -1,13 +1,22 @@
 from dataclasses import dataclass
 import dataclasses
 from functools import cached_property
-from typing import Any, TypeVar
+from typing import Any, Iterator, Optional, TypeVar
 
-import requests
+from .cache import cache
 from .response import APIResponse, Model
+from .scheduler import Scheduler, current
+from .streaming import iter_chunks, iter_json_array
+from .transport import Response, request_key, transport
 
 AnyModel = TypeVar('AnyModel', bound=Model)
 
+@dataclass(frozen=True)
+class CachePolicy:
+    """How long to keep the responses of a kind of request, see `apis.cache`"""
+    namespace: str                          # Counted separately in the cache's statistics, e.g. 'strava:stats'
+    ttl: float                              # Seconds
+
 @dataclass(frozen=True)
 class APIRequestParameters:
     def as_dict(self) -> dict[str, Any]:
@@ -22,6 +31,9 @@ class APIRequest:
     path: str
     headers: dict[str, str]
     parameters: dict[str, str]
+    scheduler: Optional[Scheduler] = None   # Shares out requests to this API between athletes, if set
+    stream: bool = False                    # Read the body as it's used rather than all at once, see `iter_items`
+    cache_policy: Optional[CachePolicy] = None  # Share successful responses between requests and processes, if set
 
     def __init__(self, base_url: str, path: str, headers: dict[str, str] = {}, **query_parameters):
         self.base_url = base_url
@@ -37,13 +49,63 @@ class APIRequest:
         """The complete URL of the API request"""
         return self.base_url + self.path
 
-    @cached_property
-    def _res(self) -> requests.Response:
-        return requests.get(self.url, params=self.parameters, headers=self.headers)
+    @property
+    def schedule_key(self) -> Optional[str]:
+        """Who the request is for, when scheduling it, see `apis.scheduler`"""
+        return current().key
 
     @cached_property
-    def response(self) -> APIResponse:
-        """Fetches from the API and converts to a JSON dict"""
+    def _res(self) -> Response:
+        if self.scheduler is None:
+            return transport().get(self.url, self.parameters, self.headers, self.stream)
+        with self.scheduler.slot(self.schedule_key):
+            return transport().get(self.url, self.parameters, self.headers, self.stream)
+
+    @property
+    def cache_key(self) -> str:
+        """Identifies the response in the cache, requests that may get different responses need different keys"""
+        return request_key('GET', self.url, self.parameters)
+
+    @property
+    def cached(self) -> bool:
+        """Whether the response is looked up in the cache before it's fetched"""
+        return self.cache_policy is not None and not self.stream
+
+    def _fetch(self) -> APIResponse:
         self._res.status_code
         print(f"API request to '{self._res.url}'")
         return self._res.json()
+
+    @cached_property
+    def response(self) -> APIResponse:
+        """Fetches from the API, or the cache, and converts to a JSON dict"""
+        if not self.cached: return self._fetch()
+        policy: CachePolicy = self.cache_policy # type: ignore checked by `cached`
+        # Only one process fetches a response that isn't cached, the others wait for it
+        return cache().get_or_compute(
+            policy.namespace, self.cache_key, self._fetch, policy.ttl,
+            store=lambda _: self._res.status_code == 200,
+        )
+
+    @property
+    def status_code(self) -> int:
+        """The HTTP status of the response, which is 200 if it came from the cache"""
+        if self.cached:
+            self.response
+            if '_res' not in self.__dict__: return 200
+        return self._res.status_code
+
+    def iter_items(self) -> Iterator[Any]:
+        """
+        Fetches from the API, yielding each item of the JSON array response as soon as it has
+        arrived. Set `stream` before sending the request so the body isn't read all at once,
+        after which `response` can't be used as the body is only read once.
+        Raises `ValueError` if the response isn't a JSON array.
+        """
+        if 'response' in self.__dict__ or self.cached:
+            if not isinstance(self.response, list): raise ValueError("Expected a JSON array")
+            yield from self.response
+            return
+        self._res.status_code
+        print(f"API request to '{self._res.url}' (streamed)")
+        yield from iter_json_array(iter_chunks(self._res))
@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, fields
+from functools import cache
 from inspect import signature
-from typing import Any, Self, TypeVar, Union, overload
+import sys
+from typing import Any, Callable, Iterable, Iterator, Optional, Self, TypeVar, Union, overload
 
 APIResponse = Union[dict[str, Any], list[dict[str, Any]]]
 
@@ -12,9 +15,13 @@ class Model(ABC):
     class properties with names matching those of the response JSON. Fields
     will be passed to the `parse_field` method, which you must implement to
     correctly parse each field of the response.
+    Decorate the child class with `@model` to make it a frozen dataclass with slots.
     See strava_api/models.py for examples.
     """
 
+    # Lets subclasses made with `@model` leave out `__dict__`
+    __slots__ = ()
+
     @classmethod
     @abstractmethod
     def parse_field(cls, key: str, value: Any) -> Any:
@@ -42,11 +49,64 @@ class Model(ABC):
         (e.g. fields that are a `Model` themselves) before passing the JSON.
         """
         if isinstance(res, dict):
-            # Filter the JSON keys to those defined in the model
-            keys = list(signature(cls.__init__).parameters.keys())[1:]
-            # Set fields not in the JSON to None
-            return cls(**{k: cls.parse_field(k, res[k]) if k in res else None for k in keys})
+            # Filter the JSON keys to those defined in the model,
+            # and set fields not in the JSON to None
+            return cls(**{k: cls.parse_field(k, res[k]) if k in res else None for k in cls._keys()})
         else:
             return [cls.fromResponse(r) for r in res]
 
+    @classmethod
+    @cache
+    def _keys(cls) -> tuple[str, ...]:
+        # Looking up the signature takes longer than making the model, so it's done once per class
+        return tuple(signature(cls.__init__).parameters.keys())[1:]
+
+    @classmethod
+    def fromItems(cls, items: Iterable[dict[str, Any]]) -> Iterator[Self]:
+        """
+        Initialises a model from each item as it's needed, e.g. from `APIRequest.iter_items`
+        so each model is made as soon as its JSON has arrived.
+        """
+        for item in items: yield cls.fromResponse(item)
+
 AnyModel = TypeVar('AnyModel', bound=Model)
+
+@overload
+def model(cls: type[AnyModel], /) -> type[AnyModel]:
+    ...
+@overload
+def model(*, intern: Iterable[str] = ()) -> Callable[[type[AnyModel]], type[AnyModel]]:
+    ...
+def model(cls: Optional[type[AnyModel]] = None, /, *, intern: Iterable[str] = ()):
+    """
+    Makes a `Model` a frozen dataclass with `__slots__`, so each instance holds one pointer per
+    field rather than a `__dict__`. Thousands of activities are kept in memory for each athlete,
+    so this adds up.
+    :param intern: String fields whose values repeat between instances, e.g. sport types, which
+                   are interned so that every instance shares a single copy. Only intern fields
+                   with few distinct values, the interpreter's table of interned strings grows
+                   with every distinct value, e.g. with every activity name.
+    """
+    interned = frozenset(intern)
+
+    def wrap(cls: type[AnyModel]) -> type[AnyModel]:
+        if interned:
+            def __post_init__(self) -> None:
+                for k in interned:
+                    value = getattr(self, k)
+                    if type(value) is str: object.__setattr__(self, k, sys.intern(value))
+            cls.__post_init__ = __post_init__ # type: ignore
+
+        cls = dataclass(frozen=True, slots=True)(cls)
+        names = tuple(f.name for f in fields(cls)) # type: ignore
+
+        def __setstate__(self, state: Union[list[Any], dict[str, Any]]) -> None:
+            # Models pickled before they had slots are restored from their `__dict__`
+            values = [state.get(k) for k in names] if isinstance(state, dict) else state
+            for k, value in zip(names, values):
+                if k in interned and type(value) is str: value = sys.intern(value)
+                object.__setattr__(self, k, value)
+        cls.__setstate__ = __setstate__ # type: ignore
+        return cls
+
+    return wrap if cls is None else wrap(cls)
@@ -0,0 +1,179 @@
+"""
+Shares a limited number of concurrent upstream requests fairly between athletes.
+Requests wait in a queue per athlete and priority. Interactive requests (e.g. the first page
+a user is waiting on) are always sent before bulk ones (e.g. the rest of a history sync),
+and within a priority each athlete gets a share of the slots in proportion to their weight,
+so one athlete with thousands of queued requests can't hold up everyone else.
+The athlete and priority of requests are taken from the context, see `scheduling`.
+"""
+
+from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+# Seconds after an athlete's last request that they're forgotten, along with their stats
+IDLE_TIMEOUT = 600
+
+# Seconds between checks for idle athletes
+PRUNE_INTERVAL = 60
+
+
+class Priority(IntEnum):
+    """Lower values are served first"""
+    INTERACTIVE=0
+    BULK=1
+
+
+@dataclass(frozen=True)
+class SchedulingContext:
+    key: Optional[str]                      # Who the requests are for, usually the athlete ID
+    priority: Priority
+
+_context: ContextVar[SchedulingContext] = ContextVar('scheduling', default=SchedulingContext(None, Priority.INTERACTIVE))
+
+def current() -> SchedulingContext:
+    """The athlete and priority that requests made now are scheduled as"""
+    return _context.get()
+
+@contextmanager
+def scheduling(key: Any = None, priority: Optional[Priority] = None) -> Iterator[None]:
+    """
+    Schedules upstream requests made inside the block as being for `key` with `priority`.
+    Either can be left as `None` to keep the current value.
+    Context isn't passed on to new threads, so set it inside work submitted to a thread pool.
+    """
+    ctx = current()
+    token = _context.set(SchedulingContext(
+        ctx.key if key is None else str(key),
+        ctx.priority if priority is None else priority,
+    ))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@dataclass
+class QueueStats:
+    queued: int = 0                         # Requests waiting now
+    served: int = 0                         # Requests that have been given a slot
+    total_wait: float = 0                   # Seconds spent waiting by the served requests
+    max_wait: float = 0                     # Longest wait of a served request, in seconds
+    last_active: float = 0                  # When a request was last queued or served, from `time.monotonic()`
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            'queued': self.queued,
+            'served': self.served,
+            'mean_wait': self.total_wait / self.served if self.served else 0,
+            'max_wait': self.max_wait,
+        }
+
+
+class Scheduler:
+    """
+    Gives out at most `max_concurrent` slots at once, to the queued request with the highest priority,
+    breaking ties between athletes by stride scheduling: each athlete's pass advances by `1 / weight`
+    every time they're served, and the athlete with the lowest pass goes next.
+    """
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.weights: dict[str, float] = {}
+        self.stats: dict[tuple[str, Priority], QueueStats] = {}
+        self._queues: dict[Priority, dict[str, deque[tuple[threading.Event, float]]]] = {p: {} for p in Priority}
+        self._passes: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._pruned = time.monotonic()
+
+    def set_weight(self, key: Any, weight: float) -> None:
+        """Gives an athlete `weight` times the share of slots of an athlete with the default weight of 1"""
+        with self.lock:
+            self.weights[str(key)] = weight
+
+    @contextmanager
+    def slot(self, key: Optional[str] = None, priority: Optional[Priority] = None) -> Iterator[None]:
+        """Waits for a slot, and holds it for the duration of the block. Defaults to the current context."""
+        ctx = current()
+        self.acquire(key or ctx.key or 'anonymous', ctx.priority if priority is None else priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, key: str, priority: Priority) -> None:
+        ready = threading.Event()
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            stats = self.stats.setdefault((key, priority), QueueStats())
+            stats.queued += 1
+            stats.last_active = now
+            self._queues[priority].setdefault(key, deque()).append((ready, now))
+            self._dispatch()
+        ready.wait()
+
+    def release(self) -> None:
+        with self.lock:
+            self.in_use -= 1
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hands out free slots to waiting requests. Must be called with the lock held."""
+        while self.in_use < self.max_concurrent:
+            priority = next((p for p in Priority if self._queues[p]), None)
+            if priority is None: return
+            queues = self._queues[priority]
+            # Athletes who have been idle start from the current virtual time, so they can't save up a burst
+            key = min(queues, key=lambda k: max(self._passes.get(k, 0), self._virtual_time))
+            self._virtual_time = max(self._passes.get(key, 0), self._virtual_time)
+            self._passes[key] = self._virtual_time + 1 / self.weights.get(key, 1)
+
+            ready, queued_at = queues[key].popleft()
+            if not queues[key]: del queues[key]
+            now = time.monotonic()
+            wait = now - queued_at
+            stats = self.stats[(key, priority)]
+            stats.queued -= 1
+            stats.served += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            stats.last_active = now
+
+            self.in_use += 1
+            ready.set()
+
+    def _prune(self, now: float) -> None:
+        """
+        Forgets athletes with nothing queued and no requests for `IDLE_TIMEOUT`. If they come back they
+        start from the virtual time, as any idle athlete would. Checks at most every `PRUNE_INTERVAL`.
+        Must be called with the lock held.
+        """
+        if now - self._pruned < PRUNE_INTERVAL: return
+        self._pruned = now
+        for k in [k for k, stats in self.stats.items() if not stats.queued and now - stats.last_active > IDLE_TIMEOUT]:
+            del self.stats[k]
+        active = {key for key, _ in self.stats}
+        for key in [key for key in self._passes if key not in active]:
+            del self._passes[key]
+
+    def metrics(self) -> dict[str, Any]:
+        """Queue depth and wait times for each athlete and priority"""
+        with self.lock:
+            return {
+                'in_use': self.in_use,
+                'max_concurrent': self.max_concurrent,
+                'queues': [
+                    {'key': key, 'priority': priority.name.lower()} | stats.as_dict()
+                    for (key, priority), stats in self.stats.items()
+                ],
+            }
@@ -0,0 +1,83 @@
+"""
+Decodes the items of a JSON array as the response body arrives, so they can be turned into
+models one at a time, rather than holding the raw body, the whole decoded list, and the models
+in memory at once. Each item is decoded with `json.JSONDecoder.raw_decode` as soon as its last
+byte has been read, so parsing overlaps with the rest of the body being sent.
+"""
+
+from __future__ import annotations
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator
+
+from .transport import Response
+
+# Bytes read from the network at a time
+CHUNK_SIZE = 64 * 1024
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def iter_chunks(res: Response, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """The body of a response as it arrives, for responses from any transport"""
+    if hasattr(res, 'iter_content'): return res.iter_content(chunk_size) # type: ignore requests
+    if hasattr(res, 'iter_bytes'): return res.iter_bytes(chunk_size) # type: ignore httpx
+    return iter([res.text.encode()]) # type: ignore
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Yields the items of a JSON array, given its encoded text in chunks, each as soon as it's complete.
+    Raises `ValueError` if the text isn't an array or isn't valid JSON.
+    """
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    eof = False
+    started = False
+
+    def more() -> bool:
+        # Appends the next chunk to the buffer, dropping what's already been decoded
+        nonlocal buf, pos, eof
+        if eof: return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf, pos = buf[pos:] + decode(b'', final=True), 0
+        else:
+            buf, pos = buf[pos:] + decode(chunk), 0
+        return True
+
+    def next_char() -> str:
+        # The next character that isn't whitespace, reading more if needed, or '' at the end
+        nonlocal pos
+        while True:
+            pos = _whitespace.match(buf, pos).end() # type: ignore always matches
+            if pos < len(buf): return buf[pos]
+            if not more(): return ''
+
+    if next_char() != '[': raise ValueError("Expected a JSON array")
+    pos += 1
+    while True:
+        c = next_char()
+        if c == ']': return
+        if started:
+            if c != ',': raise ValueError(f"Expected ',' or ']' in JSON array, got {c!r}")
+            pos += 1
+            next_char()
+        # Keep reading until the item decodes. A number cut short by the end of a chunk or of a truncated
+        # body still decodes, e.g. `2.` as 2, so an item is only accepted once the ',' or ']' after it has been read.
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+                after = _whitespace.match(buf, end).end() # type: ignore always matches
+                if after < len(buf) and buf[after] in ',]': break
+                if eof: raise ValueError("Expected ',' or ']' after item in JSON array")
+            except json.JSONDecodeError:
+                if eof: raise
+            more()
+        pos = end
+        started = True
+        yield item
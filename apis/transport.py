@@ -0,0 +1,198 @@
+"""
+Sends the HTTP requests of every API client, so they can be recorded and replayed offline.
+`LiveTransport` goes to the network. `RecordTransport` does too, but also saves each request
+and its response in a cassette, a gzipped JSON file keyed by the normalised method, URL, and
+parameters. `ReplayTransport` answers requests from a cassette without the network, e.g. for
+reproducible benchmarks and load tests.
+
+Choose the transport with `use`, or by setting `STRAVACO2_TRANSPORT` to `record` or `replay`
+and `STRAVACO2_CASSETTE` to the cassette's path.
+Cassettes hold the responses of the OAuth endpoints, i.e. access tokens, so keep them private.
+Secret parameters are only stored as hashes, see `SECRET_PARAMETERS`.
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import atexit
+from contextlib import contextmanager
+from dataclasses import dataclass
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional, Protocol
+import urllib.parse
+
+import requests
+
+# Parameters whose values are hashed before they're used in a cassette key
+SECRET_PARAMETERS = ('client_secret', 'refresh_token', 'code', 'access_token')
+
+CASSETTE_VERSION = 1
+
+# Seconds to wait for a live connection, and then between bytes of its response, before giving
+# up, so a hung upstream server can't hold a request thread or background job forever
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+
+class Response(Protocol):
+    """The parts of `requests.Response` that the API clients use"""
+    status_code: int
+    url: str
+    def json(self) -> Any: ...
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]: ...
+
+
+@dataclass(frozen=True)
+class RecordedResponse:
+    status_code: int
+    url: str
+    text: str
+    elapsed: float                          # Seconds the live request took
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        body = self.text.encode()
+        for i in range(0, len(body), chunk_size): yield body[i:i+chunk_size]
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that isn't in the cassette"""
+
+
+def request_key(method: str, url: str, params: Optional[dict[str, Any]] = None) -> str:
+    """Identifies a request regardless of the order of its parameters or doubled slashes in its path"""
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query)) | {k: str(v) for k, v in (params or {}).items()}
+    for k in SECRET_PARAMETERS:
+        if k in query: query[k] = hashlib.sha256(query[k].encode()).hexdigest()[:16]
+    path = '/' + '/'.join(p for p in parts.path.split('/') if p)
+    key = f"{method.upper()} {parts.scheme}://{parts.netloc.lower()}{path}"
+    return f"{key}?{urllib.parse.urlencode(sorted(query.items()))}" if query else key
+
+
+class Transport(ABC):
+
+    @abstractmethod
+    def request(self, method: str, url: str, params: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None, stream: bool = False) -> Response:
+        """
+        Sends a request, with `params` in the query string of a GET or the form data of a POST.
+        :param stream: Return once the headers have arrived, and read the body as it's used
+        """
+        raise NotImplementedError()
+
+    def get(self, url: str, params: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None, stream: bool = False) -> Response:
+        return self.request('GET', url, params, headers, stream)
+
+    def post(self, url: str, data: Optional[dict[str, Any]] = None, headers: Optional[dict[str, str]] = None) -> Response:
+        return self.request('POST', url, data, headers)
+
+
+class LiveTransport(Transport):
+
+    def request(self, method, url, params=None, headers=None, stream=False) -> Response:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        if method.upper() == 'GET':
+            return requests.get(url, params=params, headers=headers, stream=stream, timeout=timeout)
+        return requests.request(method, url, data=params, headers=headers, stream=stream, timeout=timeout)
+
+
+class Cassette:
+    """Recorded responses by request key"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interactions: dict[str, RecordedResponse] = {}
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            self.interactions = {k: RecordedResponse(**v) for k, v in data.get('interactions', {}).items()}
+
+    def save(self) -> None:
+        with self.lock:
+            data = {'version': CASSETTE_VERSION, 'interactions': {k: vars(r) for k, r in sorted(self.interactions.items())}}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with gzip.open(self.path + '.tmp', 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(self.path + '.tmp', self.path)
+
+
+class RecordTransport(Transport):
+    """Sends requests with another transport, recording every response. Call `save` when done."""
+
+    def __init__(self, path: str, transport: Optional[Transport] = None):
+        self.cassette = Cassette(path)
+        self.transport = transport or LiveTransport()
+
+    def request(self, method, url, params=None, headers=None, stream=False) -> Response:
+        # The whole body is read to record it, so requests are never streamed
+        start = time.perf_counter()
+        res = self.transport.request(method, url, params, headers)
+        recorded = RecordedResponse(res.status_code, res.url, getattr(res, 'text', json.dumps(res.json())), time.perf_counter() - start)
+        with self.cassette.lock:
+            self.cassette.interactions[request_key(method, url, params)] = recorded
+        return res
+
+    def save(self) -> None:
+        self.cassette.save()
+
+
+class ReplayTransport(Transport):
+    """
+    Answers requests from a cassette, raising `CassetteMiss` for any that weren't recorded.
+    :param latency: Seconds to wait before each response
+    :param recorded_latency: Wait as long as each request took when it was recorded instead
+    """
+
+    def __init__(self, path: str, latency: float = 0, recorded_latency: bool = False):
+        self.cassette = Cassette(path)
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+
+    def request(self, method, url, params=None, headers=None, stream=False) -> Response:
+        key = request_key(method, url, params)
+        res = self.cassette.interactions.get(key)
+        if res is None: raise CassetteMiss(key)
+        delay = res.elapsed if self.recorded_latency else self.latency
+        if delay: time.sleep(delay)
+        return res
+
+
+def from_environment() -> Transport:
+    mode = os.environ.get('STRAVACO2_TRANSPORT', 'live').lower()
+    path = os.environ.get('STRAVACO2_CASSETTE', 'cassette.json.gz')
+    if mode == 'record':
+        recorder = RecordTransport(path)
+        atexit.register(recorder.save)
+        return recorder
+    if mode == 'replay':
+        return ReplayTransport(path, float(os.environ.get('STRAVACO2_REPLAY_LATENCY', 0)))
+    return LiveTransport()
+
+_transport: Transport = from_environment()
+
+def transport() -> Transport:
+    """The transport that requests are currently sent with"""
+    return _transport
+
+def use(t: Transport) -> Transport:
+    """Sends every request from now on with `t`, returning the previous transport"""
+    global _transport
+    previous, _transport = _transport, t
+    return previous
+
+@contextmanager
+def using(t: Transport) -> Iterator[Transport]:
+    """Sends requests made inside the block with `t`, saving the cassette afterwards if it's recording"""
+    previous = use(t)
+    try:
+        yield t
+    finally:
+        use(previous)
+        if isinstance(t, RecordTransport): t.save()
@@ -13,3 +13,4 @@ from .endpoints import (
     places_near_place, NearbyPlacesParameters,
     place_distance,
 )
+from .local import CityTable, city_table
@@ -0,0 +1,118 @@
+"""
+Asyncio versions of the endpoints in `endpoints.py`, for fanning out many requests on one thread,
+e.g. the distances to every candidate city at once with `place_distances`.
+Each takes an `apis.aio.AsyncSession` first, which limits how many requests are in flight,
+and returns the same models as its blocking version.
+"""
+
+from __future__ import annotations
+import asyncio
+from typing import Iterable, Optional, Union
+
+from apis.aio import AsyncSession, send
+from apis import AnyModel
+from . import models
+from .local import city_table
+from .endpoints import (
+    GeoDBApiRequest, GeoDBApiRequestPager, parse_page, parse_single,
+    FindPlacesParameters, NearbyPlacesParameters, PlaceDetailsParameters,
+)
+
+
+async def get_models(session: AsyncSession, pager: GeoDBApiRequestPager, type: type[AnyModel], max_results: int) -> list[Union[AnyModel, models.Error]]:
+    """
+    The models of the first `max_results` results. Once the first page gives the total number
+    of results, the rest of the pages are requested at the same time.
+    Ends with an `Error` if any page fails.
+    """
+    first = parse_page((await send(session, pager.page(0))).response)
+    if isinstance(first, models.Error): return [first]
+    assert first.metadata is not None
+    results = list(type.fromResponse(first.data))
+
+    end = min(first.metadata.totalCount, max_results)
+    offsets = range(first.metadata.currentOffset + len(first.data), end, pager.page_size)
+    for req in await asyncio.gather(*(send(session, pager.page(o)) for o in offsets)):
+        res = parse_page(req.response)
+        if isinstance(res, models.Error):
+            results.append(res)
+            break
+        results.extend(type.fromResponse(res.data))
+    return results[:max_results]
+
+
+async def places_near_place(
+    session: AsyncSession,
+    place: models.ID,
+    params: NearbyPlacesParameters,
+    max_results: int,
+) -> list[Union[models.PopulatedPlaceSummary, models.Error]]:
+    """See `endpoints.places_near_place`"""
+    req = GeoDBApiRequest(
+        f'/v1/geo/places/{place}/nearbyPlaces',
+        **params.as_dict() | dict(limit=min(params.limit, max_results))
+    )
+    return await get_models(session, GeoDBApiRequestPager(req), models.PopulatedPlaceSummary, max_results)
+
+
+async def find_places(
+    session: AsyncSession,
+    params: FindPlacesParameters,
+    max_results: int,
+) -> list[Union[models.PopulatedPlaceSummary, models.Error]]:
+    """See `endpoints.find_places`"""
+    req = GeoDBApiRequest(
+        f'/v1/geo/places',
+        **params.as_dict() | dict(limit=min(params.limit, max_results))
+    )
+    return await get_models(session, GeoDBApiRequestPager(req), models.PopulatedPlaceSummary, max_results)
+
+
+async def find_city_by_name(
+    session: AsyncSession,
+    name: str,
+    state: Optional[str] = None,
+    country: Optional[str] = None,
+) -> Union[models.PopulatedPlaceSummary, models.Error]:
+    """See `endpoints.find_city_by_name`"""
+    table = city_table()
+    if table is not None:
+        place = table.find_by_name(name, state, country)
+        if place is not None: return place
+    params = FindPlacesParameters(namePrefix=name, types=[models.PopulatedPlaceType.CITY])
+    return (await find_places(session, params, max_results=1))[0]
+
+
+async def place_details(
+    session: AsyncSession,
+    placeId: models.ID,
+    params: PlaceDetailsParameters = PlaceDetailsParameters(),
+) -> Union[models.PopulatedPlaceDetails, models.Error]:
+    """See `endpoints.place_details`"""
+    req = await send(session, GeoDBApiRequest(f'/v1/geo/places/{placeId}', **params.as_dict()))
+    data = parse_single(req.response)
+    if isinstance(data, models.Error): return data
+    return models.PopulatedPlaceDetails.fromResponse(data)
+
+
+async def place_distance(
+    session: AsyncSession,
+    src: models.ID,
+    dest: models.ID,
+    distanceUnit: models.DistanceUnit = models.DistanceUnit.KM,
+) -> Union[float, models.Error]:
+    """See `endpoints.place_distance`"""
+    req = await send(session, GeoDBApiRequest(f'/v1/geo/places/{src}/distance', toPlaceId=dest, distanceUnit=distanceUnit))
+    data = parse_single(req.response)
+    if isinstance(data, models.Error): return data
+    return float(data) # type: ignore The API returns just a single float
+
+
+async def place_distances(
+    session: AsyncSession,
+    src: models.ID,
+    dests: Iterable[models.ID],
+    distanceUnit: models.DistanceUnit = models.DistanceUnit.KM,
+) -> list[Union[float, models.Error]]:
+    """The distances from one place to each of several others, requested at the same time"""
+    return list(await asyncio.gather(*(place_distance(session, src, d, distanceUnit) for d in dests)))
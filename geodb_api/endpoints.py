@@ -1,11 +1,21 @@
 from dataclasses import dataclass
-from typing import Iterator, Optional, Union
-from apis import APIRequest, APIRequestParameters, AnyModel
+from typing import Any, Iterator, Optional, Union
+from apis import APIRequest, APIRequestParameters, APIResponse, AnyModel, CachePolicy, Scheduler
 
 from . import models
+from .local import city_table
+
+# The free GeoDB service is rate limited, so requests are sent one at a time
+MAX_CONCURRENT_REQUESTS = 1
+
+# Places hardly ever change, so every response is shared between the server's processes for a week
+PLACES_CACHE = CachePolicy('geodb:places', 7 * 24 * 60 * 60)
 
 class GeoDBApiRequest(APIRequest):
     """A request to GeoDB's API"""
+    scheduler = Scheduler('geodb', MAX_CONCURRENT_REQUESTS)
+    cache_policy = PLACES_CACHE
+
     def __init__(self, path: str, **query_parameters):
         super().__init__(
             "http://geodb-free-service.wirefreethought.com/",
@@ -13,58 +23,88 @@ class GeoDBApiRequest(APIRequest):
             **query_parameters
         )
 
+def parse_page(response: APIResponse) -> Union[models.GenericResponse, models.Error]:
+    """Checks that a response is a page of results, returning the first error if not"""
+    res = models.GenericResponse.fromResponse(response)
+
+    # Stop if we don't get a valid response
+    if res is None or isinstance(res, list) or res.metadata is None:
+        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Invalid response")
+        err.warn()
+        return err
+
+    # Stop if the API returns an error
+    if res.errors:
+        res.errors[0].warn()
+        return res.errors[0]
+
+    # Stop if we didn't get a list of models
+    if not isinstance(res.data, list):
+        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Expected array response")
+        err.warn()
+        return err
+
+    if res.metadata.totalCount == 0:
+        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "No items in response")
+        err.warn()
+        return err
+
+    return res
+
+def parse_single(response: APIResponse) -> Union[Any, models.Error]:
+    """The unparsed data of a response holding a single result"""
+    res = models.GenericResponse.fromResponse(response)
+
+    # GeoDB should always return dictionaries rather than lists
+    assert isinstance(res, models.GenericResponse)
+
+    # Check for any errors
+    if res.errors is not None:
+        res.errors[0].warn()
+        return res.errors[0]
+
+    # Make sure the data is a single result
+    if isinstance(res.data, list):
+        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Expected object response, received array")
+        err.warn()
+        return err
+
+    return res.data
+
+
 @dataclass(frozen=True)
 class GeoDBApiRequestPager:
     """Iterate over the pages sent back from a request to GeoDB's API"""
 
     req: GeoDBApiRequest
 
+    @property
+    def page_size(self) -> int:
+        return int(self.req.parameters.get('limit', 10))
+
+    def page(self, offset: int) -> GeoDBApiRequest:
+        """The request for the page starting at `offset`"""
+        return GeoDBApiRequest(self.req.path, **self.req.parameters | dict(limit=self.page_size, offset=offset))
+
     def iter_models(self, type: type[AnyModel]) -> Iterator[Union[AnyModel, models.Error]]:
-        req = self.req
         offset = 0
-        page_size = int(req.parameters.get('limit', 10))
 
         # Iterate pages
         while True:
-            parameters = req.parameters | dict(limit=page_size, offset=offset)
-            res = models.GenericResponse.fromResponse(GeoDBApiRequest(req.path, **parameters).response)
-
-            # Stop if we don't get a valid response
-            if res is None or isinstance(res, list) or res.metadata is None:
-                err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Invalid response")
-                err.warn()
-                yield err
-                raise StopIteration
-
-            # Stop if the API returns an error
-            if res.errors:
-                res.errors[0].warn()
-                yield res.errors[0]
-                raise StopIteration
-
-            # Stop if we didn't get a list of models
-            if not isinstance(res.data, list):
-                err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Expected array response")
-                err.warn()
-                yield err
-                raise StopIteration
-
-            if res.metadata.totalCount == 0:
-                err = models.Error(models.ErrorCode.INVALID_RESPONSE, "No items in response")
-                err.warn()
-                yield err
-                raise StopIteration
+            res = parse_page(self.page(offset).response)
+            if isinstance(res, models.Error):
+                yield res
+                return
 
             # Iterate models in page
             for m in type.fromResponse(res.data):
                 yield m
 
-            # If the response is not page-able
-            if not res.metadata: raise StopIteration
             # If we have exhausted the pages
-            if res.metadata.currentOffset + len(res.data) >= res.metadata.totalCount: raise StopIteration
+            assert res.metadata is not None
+            if res.metadata.currentOffset + len(res.data) >= res.metadata.totalCount: return
 
-            offset += page_size
+            offset += self.page_size
 
 
 @dataclass(frozen=True)
@@ -162,8 +202,20 @@ def find_places(params: FindPlacesParameters, max_results: int) -> list[Union[mo
             break
     return places
 
-def find_city_by_name(name: str) -> Union[models.PopulatedPlaceSummary, models.Error]:
-    """Find the city ID corresponding to a city name"""
+def find_city_by_name(
+    name: str,
+    state: Optional[str] = None,
+    country: Optional[str] = None,
+) -> Union[models.PopulatedPlaceSummary, models.Error]:
+    """
+    Find the city corresponding to a city name, preferring cities in the given state and
+    country. Looked up in the local table of cities if there is one, and only asked of GeoDB
+    if there isn't or the city isn't in it.
+    """
+    table = city_table()
+    if table is not None:
+        place = table.find_by_name(name, state, country)
+        if place is not None: return place
     params = FindPlacesParameters(namePrefix=name, types=[models.PopulatedPlaceType.CITY])
     place = find_places(params, max_results=1)[0]
     if isinstance(place, models.Error): return place
@@ -185,23 +237,9 @@ def place_details(placeId: models.ID, params: PlaceDetailsParameters = PlaceDeta
         f'/v1/geo/places/{placeId}',
         **params.as_dict()
     )
-    res = models.GenericResponse.fromResponse(req.response)
-
-    # GeoDB should always return dictionaries rather than lists
-    assert isinstance(res, models.GenericResponse)
-
-    # Check for any errors
-    if res.errors is not None:
-        res.errors[0].warn()
-        return res.errors[0]
-
-    # Make sure the data is a single result
-    if isinstance(res.data, list):
-        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Expected object response, received array")
-        err.warn()
-        return err
-
-    return models.PopulatedPlaceDetails.fromResponse(res.data)
+    data = parse_single(req.response)
+    if isinstance(data, models.Error): return data
+    return models.PopulatedPlaceDetails.fromResponse(data)
 
 
 def place_distance(src: models.ID, dest: models.ID, distanceUnit: models.DistanceUnit = models.DistanceUnit.KM) -> Union[float, models.Error]:
@@ -209,20 +247,6 @@ def place_distance(src: models.ID, dest: models.ID, distanceUnit: models.Distanc
         f'/v1/geo/places/{src}/distance',
         **dict(toPlaceId=dest, distanceUnit=distanceUnit)
     )
-    res = models.GenericResponse.fromResponse(req.response)
-
-    # GeoDB should always return dictionaries rather than lists
-    assert isinstance(res, models.GenericResponse)
-
-    # Check for any errors
-    if res.errors is not None:
-        res.errors[0].warn()
-        return res.errors[0]
-
-    # Make sure the data is a single result
-    if isinstance(res.data, list):
-        err = models.Error(models.ErrorCode.INVALID_RESPONSE, "Expected object response, received array")
-        err.warn()
-        return err
-
-    return float(res.data) # type: ignore The API returns just a single float
+    data = parse_single(req.response)
+    if isinstance(data, models.Error): return data
+    return float(data) # type: ignore The API returns just a single float
@@ -0,0 +1,271 @@
+"""
+A local table of cities from a GeoNames dump, e.g. `cities15000.txt` from
+https://download.geonames.org/export/dump/, so that many points can be matched to their
+nearest city at once rather than asking GeoDB about each one. Cities are kept as columns
+of arrays, and a batch of points is matched by bucketing the points into coarse cells and
+comparing each cell's points with only the cities around it, in one array operation per cell.
+Country and region names are read from `countryInfo.txt` and `admin1CodesASCII.txt` next to
+the cities, if they're there.
+
+Cities can also be found by name, from a sorted array of names folded to lower case without
+accents, so a name or prefix is a binary search away. Matches in the athlete's region and
+country come first, then the most populous.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+import os
+import threading
+import unicodedata
+from typing import Optional
+
+import numpy as np
+
+from . import models
+
+# The GeoNames cities file, set `STRAVACO2_CITIES` to use another
+CITIES_PATH = os.environ.get('STRAVACO2_CITIES', os.path.join('data', 'cities15000.txt'))
+
+# Mean radius of the Earth in km, as used by GeoDB for distances
+EARTH_RADIUS_KM = 6371.0
+
+# Points further than this many km from every city aren't matched to a city, e.g. at sea
+MAX_CITY_DISTANCE = 100
+
+# Size in degrees of the cells that points are bucketed into before matching
+CELL_DEGREES = 2.0
+
+# Cities up to this many degrees of latitude outside a cell are compared with the cell's points
+MARGIN_DEGREES = 1.5
+
+# GeoNames feature codes of places that aren't cities, e.g. PPLX is a section of a city
+_NOT_CITIES = {'PPLX', 'PPLH', 'PPLQ', 'PPLW', 'PPLCH'}
+
+
+def unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, one row of `[x, y, z]` per latitude and longitude in degrees"""
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def fold(name: str) -> str:
+    """A name in lower case without accents, so that e.g. Zürich and zurich match"""
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+
+def read_countries(path: str) -> dict[str, str]:
+    """Country names by ISO code from a GeoNames `countryInfo.txt`"""
+    countries = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'): continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 4: countries[fields[0]] = fields[4]
+    return countries
+
+
+def read_regions(path: str) -> dict[str, str]:
+    """Region names by `<country code>.<admin1 code>` from a GeoNames `admin1CodesASCII.txt`"""
+    regions = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 1: regions[fields[0]] = fields[1]
+    return regions
+
+
+class CityTable:
+    """Every city in a GeoNames dump, one row per city"""
+
+    ids: np.ndarray                         # GeoNames IDs
+    names: list[str]
+    country_codes: list[str]
+    region_codes: list[str]                 # GeoNames admin1 codes
+    population: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    timezones: list[str]                    # IANA names, e.g. 'Europe/London', or '' if it isn't known
+    countries: dict[str, str]               # Country names by code
+    regions: dict[str, str]                 # Region names by `<country code>.<admin1 code>`
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        names: list[str],
+        country_codes: list[str],
+        region_codes: list[str],
+        population: np.ndarray,
+        latitude: np.ndarray,
+        longitude: np.ndarray,
+        countries: Optional[dict[str, str]] = None,
+        regions: Optional[dict[str, str]] = None,
+        timezones: Optional[list[str]] = None,
+    ):
+        self.ids = np.asarray(ids, np.int64)
+        self.names = names
+        self.country_codes = country_codes
+        self.region_codes = region_codes
+        self.population = np.asarray(population, np.int64)
+        self.latitude = np.asarray(latitude, np.float64)
+        self.longitude = np.asarray(longitude, np.float64)
+        self.countries = countries or {}
+        self.regions = regions or {}
+        self.timezones = timezones or [''] * len(self.ids)
+        self._vectors = unit_vectors(self.latitude, self.longitude)
+        self._names: Optional[tuple[list[str], np.ndarray]] = None
+
+    @classmethod
+    def read(cls, path: str) -> CityTable:
+        """Reads a GeoNames cities file, e.g. `cities15000.txt`"""
+        ids, names, country_codes, region_codes, population, latitude, longitude, timezones = [], [], [], [], [], [], [], []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 15 or fields[6] != 'P' or fields[7] in _NOT_CITIES: continue
+                ids.append(int(fields[0]))
+                names.append(fields[1])
+                latitude.append(float(fields[4]))
+                longitude.append(float(fields[5]))
+                country_codes.append(fields[8])
+                region_codes.append(fields[10])
+                population.append(int(fields[14] or 0))
+                timezones.append(fields[17] if len(fields) > 17 else '')
+        countries_path = os.path.join(os.path.dirname(path), 'countryInfo.txt')
+        countries = read_countries(countries_path) if os.path.exists(countries_path) else {}
+        regions_path = os.path.join(os.path.dirname(path), 'admin1CodesASCII.txt')
+        regions = read_regions(regions_path) if os.path.exists(regions_path) else {}
+        return cls(np.array(ids), names, country_codes, region_codes, np.array(population), np.array(latitude), np.array(longitude), countries, regions, timezones)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def country(self, code: str) -> str:
+        """The name of a country, or its code if the name isn't known"""
+        return self.countries.get(code, code)
+
+    def region(self, row: int) -> str:
+        """The name of a city's region, or '' if it isn't known"""
+        return self.regions.get(f'{self.country_codes[row]}.{self.region_codes[row]}', '')
+
+    def place(self, row: int, distance: Optional[float] = None) -> models.PopulatedPlaceSummary:
+        """A city in the same form as a GeoDB result, with the distance to it in km if given"""
+        return models.PopulatedPlaceSummary(
+            country=self.country(self.country_codes[row]),
+            countryCode=self.country_codes[row],
+            id=models.ID(int(self.ids[row])),
+            latitude=float(self.latitude[row]),
+            longitude=float(self.longitude[row]),
+            name=self.names[row],
+            population=int(self.population[row]),
+            region=self.region(row),
+            regionCode=self.region_codes[row],
+            regionWdId=None,
+            type=models.PopulatedPlaceType.CITY,
+            wikiDataId='',
+            distance=distance,
+        )
+
+    def _nearest_among(self, points: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The nearest of some cities to each of some unit vectors, as rows and distances in km"""
+        if not len(rows): return np.full(len(points), -1), np.full(len(points), np.inf)
+        # The nearest city has the largest dot product with the point
+        dots = points @ self._vectors[rows].T
+        best = dots.argmax(axis=1)
+        angles = np.arccos(np.clip(dots[np.arange(len(points)), best], -1, 1))
+        return rows[best], angles * EARTH_RADIUS_KM
+
+    def nearest(self, latitude: np.ndarray, longitude: np.ndarray, max_distance: float = MAX_CITY_DISTANCE) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The nearest city to each of many points, as the cities' rows in the table and the
+        distances to them in km. Points with no city within `max_distance` km get row -1.
+        """
+        latitude, longitude = np.asarray(latitude, np.float64), np.asarray(longitude, np.float64)
+        rows = np.full(len(latitude), -1)
+        distances = np.full(len(latitude), np.inf)
+        if not len(latitude) or not len(self): return rows, distances
+        points = unit_vectors(latitude, longitude)
+
+        # Every city within the margin of a cell is compared with the cell's points. A city
+        # outside the margin is more than `MARGIN_DEGREES` of latitude or longitude away, so
+        # is at least `safe` km away from points at the latitudes of the cell.
+        cell_lat = np.floor(latitude / CELL_DEGREES).astype(np.int64)
+        cell_lon = np.floor(longitude / CELL_DEGREES).astype(np.int64)
+        cells, cell_of = np.unique(np.column_stack([cell_lat, cell_lon]), axis=0, return_inverse=True)
+        order = np.argsort(cell_of.ravel(), kind='stable')
+        starts = np.searchsorted(cell_of.ravel()[order], np.arange(len(cells) + 1))
+        for c, (i, j) in enumerate(cells):
+            in_cell = order[starts[c]:starts[c + 1]]
+            south, north = i * CELL_DEGREES - MARGIN_DEGREES, (i + 1) * CELL_DEGREES + MARGIN_DEGREES
+            # Longitude margin widens towards the poles so it covers the same ground
+            widest = max(abs(south), abs(north))
+            lon_margin = MARGIN_DEGREES / np.cos(np.radians(widest)) if widest < 89 else 360
+            west, east = j * CELL_DEGREES - lon_margin, (j + 1) * CELL_DEGREES + lon_margin
+            lon = self.longitude
+            in_lon = (lon >= west) & (lon <= east) | (lon >= west + 360) | (lon <= east - 360)
+            near = np.flatnonzero((self.latitude >= south) & (self.latitude <= north) & in_lon)
+            found, d = self._nearest_among(points[in_cell], near)
+            safe = MARGIN_DEGREES * np.pi / 180 * EARTH_RADIUS_KM * np.cos(np.radians(min(widest + MARGIN_DEGREES, 90)))
+            if np.any(d > safe):
+                # A closer city may be outside the margin, so compare those points with every city
+                far = d > safe
+                found[far], d[far] = self._nearest_among(points[in_cell[far]], np.arange(len(self)))
+            rows[in_cell], distances[in_cell] = found, d
+        rows[distances > max_distance] = -1
+        return rows, distances
+
+
+    def _name_index(self) -> tuple[list[str], np.ndarray]:
+        """Every city's folded name in order, and the row of the city with each name"""
+        if self._names is None:
+            self._codes = np.array(self.country_codes)
+            self._region_keys = np.array([f'{c}.{r}' for c, r in zip(self.country_codes, self.region_codes)])
+            self._country_codes = {fold(name): code for code, name in self.countries.items()}
+            self._regions_named: dict[str, list[str]] = {}
+            for key, name in self.regions.items(): self._regions_named.setdefault(fold(name), []).append(key)
+            # Set last, so other threads only see the index once it's complete
+            pairs = sorted((fold(name), row) for row, name in enumerate(self.names))
+            self._names = [name for name, _ in pairs], np.array([row for _, row in pairs], np.int64)
+        return self._names
+
+    def country_code(self, country: str) -> Optional[str]:
+        """The code of a country given its name or code, or `None` if it isn't known"""
+        self._name_index()
+        if len(country) == 2 and country.upper() in self.countries: return country.upper()
+        return self._country_codes.get(fold(country))
+
+    def find_by_name(self, name: str, state: Optional[str] = None, country: Optional[str] = None) -> Optional[models.PopulatedPlaceSummary]:
+        """
+        The city best matching a name, preferring exact matches to names starting with it,
+        then cities in the given state or region and country, then the most populous.
+        Returns `None` if no city's name starts with it.
+        """
+        names, rows = self._name_index()
+        folded = fold(name)
+        if not folded: return None
+        lo, hi = bisect_left(names, folded), bisect_left(names, folded + '\uffff')
+        if lo == hi: return None
+        exact = bisect_left(names, folded + '\0', lo, hi)
+        candidates = rows[lo:exact] if exact > lo else rows[lo:hi]
+
+        # Sorted by the last key first, so the best city is first
+        keys = [-self.population[candidates]]
+        code = self.country_code(country) if country else None
+        if state:
+            region_keys = self._regions_named.get(fold(state), [])
+            keys.append(~np.isin(self._region_keys[candidates], region_keys))
+        if code:
+            keys.append(self._codes[candidates] != code)
+        return self.place(int(candidates[np.lexsort(keys)[0]]))
+
+
+_table: Optional[CityTable] = None
+_table_lock = threading.Lock()
+
+def city_table() -> Optional[CityTable]:
+    """The table of cities in `CITIES_PATH`, read once per process, or `None` if there's no such file"""
+    global _table
+    with _table_lock:
+        if _table is None and os.path.exists(CITIES_PATH):
+            _table = CityTable.read(CITIES_PATH)
+        return _table
@@ -9,7 +9,7 @@ from enum import StrEnum
 import re
 from typing import Any, NewType, Optional
 import warnings
-from apis import Model, APIResponse
+from apis import Model, APIResponse, model
 
 ID = NewType('ID', int)
 null_ID = ID(-1)
@@ -55,7 +55,7 @@ class PopulatedPlaceType(StrEnum):
     ISLAND="ISLAND"
 
 
-@dataclass(frozen=True)
+@model
 class Error(Model):
     """Error returned by the API"""
     code: ErrorCode
@@ -70,7 +70,7 @@ class Error(Model):
     @classmethod
     def parse_field(cls, key: str, value: Any): return str(value)
 
-@dataclass(frozen=True)
+@model
 class Link(Model):
     """Link to another page of results, returned by the API"""
     href: str
@@ -79,7 +79,7 @@ class Link(Model):
     @classmethod
     def parse_field(cls, key: str, value: Any): return str(value)
 
-@dataclass(frozen=True)
+@model
 class Metadata(Model):
     """Metadata about the number of results in the API response"""
     currentOffset: int
@@ -88,7 +88,7 @@ class Metadata(Model):
     @classmethod
     def parse_field(cls, key: str, value: Any): return int(value)
 
-@dataclass(frozen=True)
+@model
 class GenericResponse(Model):
     """
     Response from the API containing `errors`, `links`, `metadata`,
@@ -129,7 +129,7 @@ class LatLong:
             return LatLong(0, 0)
         return LatLong(*matches)
 
-@dataclass(frozen=True)
+@model
 class PopulatedPlaceSummary(Model):
     """
     Summary of a place. Returned by the API for endpoints
@@ -154,7 +154,7 @@ class PopulatedPlaceSummary(Model):
     def parse_field(cls, key: str, value: Any) -> Any:
         return value
 
-@dataclass(frozen=True)
+@model
 class PopulatedPlaceDetails(Model):
     """
     Full populated-place details.
@@ -0,0 +1,28 @@
+"""
+Local views over an athlete's activity history, kept up to date incrementally as
+activities are fetched so that pages don't need to ask Strava for everything again.
+Get an athlete's history with `history_for`, and a view of it with `ActivityHistory.view`.
+Activity streams are stored on disk under `DATA_DIR`, see `stream_store_for`.
+Histories are synced with Strava on a background thread, see `sync_in_background`.
+"""
+
+import os
+
+# Directory that activity data is stored in
+DATA_DIR = os.environ.get('STRAVACO2_DATA', 'data')
+
+from .view import HistoryView
+from .store import ActivityHistory, history_for
+from .heatmap import HeatmapPyramid
+from .spatial import SpatialIndex, Endpoint
+from .streams import StreamStore, stream_store_for
+from .stats import StatsEngine, Period
+from .timeindex import TimeIndex
+from .listing import ActivityFilter, ActivityList, ActivityOrder, ActivityPage
+from .clock import ActivityClock
+from .jobs import Job, JobState, job_status, sync_in_background, sync_key
+from .warmup import WarmAthlete, athlete_for, warm, warm_up
+from .places import PlacesSummary, PlacesVisited, PlaceVisits
+from .clusters import RouteCluster, RouteClusters
+from .co2 import CO2Engine, CO2Ledger, EmissionFactors, TransportMode, co2_saved
+from .leaderboard import ClubLeaderboards, Leaderboard, Metric, club_key, leaderboards_for, refresh_club_in_background
@@ -0,0 +1,271 @@
+"""
+Imports the archive from Strava's "Download your data" (Settings > My Account) into an
+athlete's history, without using any of the API's rate limit.
+The archive holds `activities.csv` and the recorded GPX, TCX, or FIT file of each
+activity, which may be gzipped. Route files are parsed on a process pool as they are
+read from the archive. Rows of `activities.csv` that can't be parsed are skipped and counted.
+
+The archive only has UTC start times. The local time of each activity is found from the
+timezone of the city nearest its start, from the local table of cities (see `geodb_api.local`),
+or else from the timezone given on the command line. Otherwise it's left in UTC.
+
+A running server notices the saved history has changed and adds the imported activities to
+its own copy, see `ActivityHistory.refresh`, so it doesn't need stopping first.
+
+Run with `python -m history.archive <archive.zip> [athlete ID] [timezone, e.g. Europe/London]`.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import csv
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import gzip
+import io
+import os
+import sys
+from typing import Any, Callable, Optional
+import warnings
+from xml.etree import ElementTree
+import zipfile
+from zoneinfo import ZoneInfo
+import numpy as np
+
+from geodb_api.local import CityTable, city_table
+from strava_api import polyline
+from strava_api.models import SportType, SummaryActivity
+from .clock import zone
+from .store import history_for
+
+# Summary polylines are simplified to at most this many points, like Strava's
+MAX_SUMMARY_POINTS = 500
+
+# Parsing jobs submitted to the pool ahead of those completed, per worker
+JOBS_PER_WORKER = 4
+
+Progress = Callable[[int, int], None]
+
+
+@dataclass(frozen=True)
+class ArchiveImport:
+    imported: int                           # Activities added to the history
+    skipped: int                            # Rows of `activities.csv` that couldn't be parsed
+
+
+def parse_route(filename: str, data: bytes) -> np.ndarray:
+    """Parses the `[latitude, longitude]` rows of a GPX, TCX, or FIT file, which may be gzipped"""
+    if filename.endswith('.gz'):
+        data = gzip.decompress(data)
+        filename = filename[:-3]
+
+    if filename.endswith('.fit'):
+        try:
+            import fitparse
+        except ImportError:
+            warnings.warn(f"Install fitparse to import routes from FIT files, skipping {filename}")
+            return np.empty((0, 2))
+        # FIT stores positions in semicircles
+        points = [
+            (m.get_value('position_lat'), m.get_value('position_long'))
+            for m in fitparse.FitFile(io.BytesIO(data)).get_messages('record')
+        ]
+        points = [p for p in points if None not in p]
+        return np.array(points, dtype=np.float64).reshape(-1, 2) * (180 / 2**31)
+
+    points = []
+    # Read the file element by element, discarding each point once it's parsed
+    for _, element in ElementTree.iterparse(io.BytesIO(data.lstrip())):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'trkpt':
+            points.append((float(element.get('lat', 'nan')), float(element.get('lon', 'nan'))))
+            element.clear()
+        elif tag == 'Position':
+            values = {child.tag.rsplit('}', 1)[-1]: child.text for child in element}
+            points.append((float(values.get('LatitudeDegrees') or 'nan'), float(values.get('LongitudeDegrees') or 'nan')))
+            element.clear()
+        elif tag == 'Trackpoint':
+            element.clear()
+    route = np.array(points, dtype=np.float64).reshape(-1, 2)
+    return route[~np.isnan(route).any(axis=1)]
+
+
+def parse_sport_type(s: str) -> SportType:
+    """Matches the activity types in `activities.csv`, e.g. 'Virtual Ride' or 'E-Bike Ride', to a `SportType`"""
+    key = s.replace(' ', '').replace('-', '').lower()
+    for sport in SportType:
+        if sport.lower() == key: return sport
+    return SportType.Workout
+
+
+def to_number(s: Optional[str]) -> Optional[float]:
+    try:
+        return float(s) if s else None
+    except ValueError:
+        return None
+
+
+def parse_row(get: Callable[[str], Optional[str]]) -> dict[str, Any]:
+    """
+    Parses a row of `activities.csv` into a dict in the same shape as an `/athlete/activities`
+    response, raising `ValueError` if it has no valid ID or start date
+    """
+    start_date = datetime.strptime(get('Activity Date') or '', '%b %d, %Y, %I:%M:%S %p').replace(tzinfo=timezone.utc)
+    distance = to_number(get('Distance')) or 0
+    elapsed_time = to_number(get('Elapsed Time')) or 0
+    moving_time = to_number(get('Moving Time')) or elapsed_time
+    return {
+        'id': int(get('Activity ID') or ''),
+        'name': get('Activity Name'),
+        'sport_type': parse_sport_type(get('Activity Type') or ''),
+        'start_date': start_date.isoformat(),
+        # Until the timezone is known, see `localise`
+        'start_date_local': start_date.isoformat(),
+        'distance': distance,
+        'moving_time': int(moving_time),
+        'elapsed_time': int(elapsed_time),
+        'total_elevation_gain': to_number(get('Elevation Gain')) or 0,
+        'elev_high': to_number(get('Elevation High')),
+        'elev_low': to_number(get('Elevation Low')),
+        'average_speed': to_number(get('Average Speed')) or (distance / moving_time if moving_time else 0),
+        'max_speed': to_number(get('Max Speed')),
+        'commute': (get('Commute') or '').lower() in ('true', '1', '1.0'),
+        'gear_id': get('Activity Gear') or None,
+        'filename': get('Filename') or None,
+    }
+
+
+def read_activities(archive: zipfile.ZipFile) -> tuple[list[dict[str, Any]], int]:
+    """
+    Reads `activities.csv`, see `parse_row`, returning the activities and the number of rows skipped.
+    The CSV repeats some column names, e.g. 'Distance' is first in km and later in metres,
+    so the last column with each name is used.
+    """
+    activities, skipped = [], 0
+    with archive.open('activities.csv') as f:
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        header = next(reader)
+        column = {name: i for i, name in enumerate(header)}
+        for row in reader:
+            get = lambda name: row[column[name]] if name in column and column[name] < len(row) else None
+            try:
+                activities.append(parse_row(get))
+            except ValueError:
+                skipped += 1
+    return activities, skipped
+
+
+def strava_timezone(tz: ZoneInfo, at: datetime) -> str:
+    """A timezone in the form the API gives it, e.g. '(GMT+01:00) Europe/London'"""
+    offset = int(at.astimezone(tz).utcoffset().total_seconds()) // 60 # type: ignore a zone always has an offset
+    sign = '+' if offset >= 0 else '-'
+    return f'(GMT{sign}{abs(offset) // 60:02}:{abs(offset) % 60:02}) {tz.key}'
+
+
+def localise(activities: list[dict[str, Any]], routes: list[np.ndarray], table: Optional[CityTable], default: Optional[ZoneInfo] = None) -> None:
+    """
+    Sets the timezone and local start time of activities, from the timezone of the city nearest
+    the start of each route, all at once, or `default` for those with no route or city nearby.
+    Like the API, local times are given as if they were UTC.
+    """
+    zones = [default] * len(activities)
+    starts = [i for i, route in enumerate(routes) if len(route)]
+    if table is not None and starts:
+        points = np.array([routes[i][0] for i in starts])
+        rows, _ = table.nearest(points[:, 0], points[:, 1])
+        for i, row in zip(starts, rows.tolist()):
+            if row >= 0: zones[i] = zone(table.timezones[row]) or default
+    for activity, tz in zip(activities, zones):
+        if tz is None: continue
+        start = datetime.fromisoformat(activity['start_date'])
+        activity['timezone'] = strava_timezone(tz, start)
+        activity['start_date_local'] = start.astimezone(tz).replace(tzinfo=timezone.utc).isoformat()
+
+
+def with_route(activity: dict[str, Any], route: np.ndarray) -> SummaryActivity:
+    """Adds the start, end, and summary polyline of a route to an activity, as the API would return them"""
+    if len(route):
+        keep = np.linspace(0, len(route) - 1, min(len(route), MAX_SUMMARY_POINTS)).round().astype(int)
+        summary = route[np.unique(keep)]
+        activity |= {
+            'start_latlng': route[0].tolist(),
+            'end_latlng': route[-1].tolist(),
+            'map': {'id': f"a{activity['id']}", 'summary_polyline': polyline.encode(summary), 'polyline': None},
+        }
+    return SummaryActivity.fromResponse(activity)
+
+
+def import_archive(
+    path: str,
+    athlete_id: int,
+    workers: Optional[int] = None,
+    progress: Optional[Progress] = None,
+    default_timezone: Optional[str] = None,
+) -> ArchiveImport:
+    """
+    Imports every activity in an archive into an athlete's history, replacing any with the same ID,
+    so importing the same archive again changes nothing.
+    :param workers: Number of processes parsing route files, defaults to the number of CPUs
+    :param progress: Called with the number of activities imported so far and the total
+    :param default_timezone: The timezone of activities whose local time can't be found from their route
+    """
+    history = history_for(athlete_id)
+    workers = workers or os.cpu_count() or 1
+    table = city_table()
+    default = zone(default_timezone)
+    with zipfile.ZipFile(path) as archive, ProcessPoolExecutor(workers) as pool:
+        activities, skipped = read_activities(archive)
+        names = set(archive.namelist())
+        total, done = len(activities), 0
+        pending: dict[Future, dict[str, Any]] = {}
+
+        def add(batch: list[dict[str, Any]], routes: list[np.ndarray]) -> None:
+            nonlocal done
+            localise(batch, routes, table, default)
+            history.add([with_route(a, r) for a, r in zip(batch, routes)])
+            done += len(batch)
+            if progress: progress(done, total)
+
+        def finish(futures) -> None:
+            futures = list(futures)
+            add([pending.pop(f) for f in futures], [f.result() for f in futures])
+
+        for activity in activities:
+            filename = activity.pop('filename')
+            if filename not in names:
+                # Manual activities have no route
+                add([activity], [np.empty((0, 2))])
+                continue
+            # Only read a bounded number of files ahead of the parsers
+            while len(pending) >= JOBS_PER_WORKER * workers:
+                finish(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[pool.submit(parse_route, filename, archive.read(filename))] = activity
+
+        finish(list(pending))
+
+    history.save()
+    return ArchiveImport(total, skipped)
+
+
+def read_athlete_id(path: str) -> Optional[int]:
+    """Reads the athlete's ID from the archive's `profile.csv`"""
+    with zipfile.ZipFile(path) as archive:
+        if 'profile.csv' not in archive.namelist(): return
+        with archive.open('profile.csv') as f:
+            row = next(csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline='')), {})
+    id = row.get('Athlete ID')
+    return int(id) if id else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(f"Usage: python -m history.archive <archive.zip> [athlete ID] [timezone, e.g. Europe/London]")
+    path = sys.argv[1]
+    athlete_id = int(sys.argv[2]) if len(sys.argv) > 2 else read_athlete_id(path)
+    if athlete_id is None:
+        sys.exit("The archive has no profile.csv, give the athlete ID as well")
+    default_timezone = sys.argv[3] if len(sys.argv) > 3 else None
+    if default_timezone and zone(default_timezone) is None:
+        sys.exit(f"Unknown timezone {default_timezone}")
+    result = import_archive(path, athlete_id, progress=lambda done, total: print(f"\rImported {done}/{total} activities", end=''), default_timezone=default_timezone)
+    print(f"\nImported {result.imported} activities for athlete {athlete_id}")
+    if result.skipped: print(f"Skipped {result.skipped} rows of activities.csv that couldn't be read")
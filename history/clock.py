@@ -0,0 +1,108 @@
+"""
+Counts of an athlete's activities by the local hour of day and day of the week they
+started, for each sport and each month, so the activity clock can cover the athlete's
+whole history and be filtered by sport and date without looking at every activity.
+"""
+
+from __future__ import annotations
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+
+from strava_api.models import SummaryActivity
+from .view import HistoryView
+
+
+@lru_cache(maxsize=None)
+def zone(timezone: Optional[str]) -> Optional[ZoneInfo]:
+    """The zone of a Strava timezone such as '(GMT+00:00) Europe/London', or `None` if it isn't known"""
+    if not timezone: return None
+    try:
+        return ZoneInfo(timezone.split()[-1])
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def local_start(activity: SummaryActivity) -> datetime:
+    """
+    The wall clock time an activity started at.
+    Converting the UTC start time with the activity's timezone handles daylight saving properly,
+    otherwise fall back to `start_date_local`, which is already local time if it came from the API.
+    """
+    tz = zone(activity.timezone)
+    if tz is not None and activity.start_date.tzinfo is not None:
+        return activity.start_date.astimezone(tz)
+    return activity.start_date_local
+
+def month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+
+class MonthlyCounts:
+    """Counts of activities by weekday (Monday first) and hour, for a contiguous run of months"""
+
+    def __init__(self, month: int):
+        self.first = month
+        self.counts = np.zeros((1, 7, 24), np.int32)
+
+    def add(self, month: int, weekday: int, hour: int, n: int) -> None:
+        if month < self.first:
+            self.counts = np.concatenate([np.zeros((self.first - month, 7, 24), np.int32), self.counts])
+            self.first = month
+        elif month >= self.first + len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros((month - self.first - len(self.counts) + 1, 7, 24), np.int32)])
+        self.counts[month - self.first, weekday, hour] += n
+
+    def between(self, start: Optional[int], end: Optional[int]) -> np.ndarray:
+        """The counts summed over the months from `start` up to, but not including, `end`"""
+        lo = 0 if start is None else min(max(start - self.first, 0), len(self.counts))
+        hi = len(self.counts) if end is None else min(max(end - self.first, lo), len(self.counts))
+        return self.counts[lo:hi].sum(axis=0)
+
+
+class ActivityClock(HistoryView):
+    """Histograms of when activities start, by sport, month, weekday, and hour"""
+
+    by_sport: dict[str, MonthlyCounts]
+
+    def __init__(self):
+        self.by_sport = {}
+
+    def _update(self, activity: SummaryActivity, n: int) -> None:
+        start = local_start(activity)
+        month = month_index(start)
+        counts = self.by_sport.get(activity.sport_type)
+        if counts is None: counts = self.by_sport[activity.sport_type] = MonthlyCounts(month)
+        counts.add(month, start.weekday(), start.hour, n)
+
+    def add(self, activity: SummaryActivity) -> None:
+        self._update(activity, 1)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        self._update(activity, -1)
+
+    def histogram(
+        self,
+        sports: Optional[Iterable[str]] = None,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> np.ndarray:
+        """
+        The number of activities starting at each weekday (rows, Monday first) and hour (columns).
+        Dates are rounded to whole months, including the months containing `start` and `end`.
+        :param sports: Sports to include, or all sports if `None`
+        :param start: Only activities from the month containing this day onwards
+        :param end: Only activities up to the end of the month containing this day
+        """
+        start_month = None if start is None else month_index(start)
+        end_month = None if end is None else month_index(end) + 1
+        hist = np.zeros((7, 24), np.int64)
+        for sport in (self.by_sport if sports is None else sports):
+            counts = self.by_sport.get(sport)
+            if counts is not None: hist += counts.between(start_month, end_month)
+        return hist
+
+    def hours(self, sports: Optional[Iterable[str]] = None, start: Optional[date] = None, end: Optional[date] = None) -> np.ndarray:
+        """The number of activities starting at each hour of the day"""
+        return self.histogram(sports, start, end).sum(axis=0)
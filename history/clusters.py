@@ -0,0 +1,235 @@
+"""
+Groups an athlete's activities into repeated routes, to find the commutes they didn't mark as commutes.
+Each route is resampled to `ROUTE_POINTS` points evenly spaced along it. An activity joins the
+cluster whose first route it most closely follows, by discrete Fréchet distance, out of the
+clusters starting and ending near it; otherwise it starts a cluster of its own. The clusters'
+endpoints and bounding boxes are kept as columns of arrays, so the clusters that start and end
+near a route, and whose bounding box is close enough to the route's, are found in one array
+operation, and only those are compared by Fréchet distance.
+
+Comparing routes is too slow to do while the history is locked, so added and removed activities
+wait until `update` is called, which the sync job does once a sync has finished. `likely_commutes`
+returns the commutes found by the last update.
+
+A cluster is a likely commute when it's been travelled at least `MIN_COMMUTE_TRIPS` times,
+mostly on weekdays, by a sport that can replace other transport, between two different places.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from math import cos, inf, radians
+import threading
+from typing import Optional
+import numpy as np
+
+from strava_api import polyline
+from strava_api.models import SummaryActivity
+from .co2 import EmissionFactors
+from .spatial import EARTH_RADIUS, distance
+from .view import HistoryView
+
+# Points that each route is resampled to before comparing
+ROUTE_POINTS = 32
+
+# Metres between the starts, and between the ends, of activities on the same route
+ENDPOINT_RADIUS = 300
+
+# Metres by which activities on the same route may stray from each other
+MAX_FRECHET_DISTANCE = 250
+
+# Repeats of a route before it's considered a likely commute
+MIN_COMMUTE_TRIPS = 4
+
+# Fraction of a route's activities that must be on a weekday for it to be a likely commute
+MIN_WEEKDAY_SHARE = 0.75
+
+# Metres between the start and end of a commute, so loops from home aren't commutes
+MIN_COMMUTE_LENGTH = 1000
+
+# Metres per degree of latitude
+METRES_PER_DEGREE = radians(1) * EARTH_RADIUS
+
+
+def resample(points: np.ndarray, n: int = ROUTE_POINTS) -> np.ndarray:
+    """`n` points of a route of `[latitude, longitude]` rows, evenly spaced along it"""
+    if len(points) == 1: return np.repeat(points, n, axis=0)
+    scale = np.array([1, cos(radians(points[0, 0]))]) * METRES_PER_DEGREE
+    steps = np.hypot(*(np.diff(points, axis=0) * scale).T)
+    along = np.concatenate(([0], np.cumsum(steps)))
+    at = np.linspace(0, along[-1], n)
+    return np.column_stack([np.interp(at, along, points[:, 0]), np.interp(at, along, points[:, 1])])
+
+
+def bounding_box(route: np.ndarray) -> np.ndarray:
+    """The `[south, west, north, east]` bounds of a route of `[latitude, longitude]` rows"""
+    return np.concatenate([route.min(axis=0), route.max(axis=0)])
+
+
+def frechet_distance(a: np.ndarray, b: np.ndarray, limit: float = inf) -> float:
+    """
+    The discrete Fréchet distance in metres between two routes of `[latitude, longitude]` rows,
+    or `inf` as soon as it's known to be more than `limit`.
+    """
+    scale = np.array([1, cos(radians(0.5 * (a[0, 0] + b[0, 0])))]) * METRES_PER_DEGREE
+    d = np.hypot(*((a[:, None, :] - b[None, :, :]) * scale).transpose(2, 0, 1))
+    # Every point of each route is coupled with some point of the other, so the distance is
+    # at least the furthest any point is from the other route
+    if max(d.min(axis=1).max(), d.min(axis=0).max()) > limit: return inf
+    d = d.tolist()
+    # ca[j] is the coupling distance of a[:i+1] and b[:j+1], one row of the table at a time
+    ca = [0.0] * len(b)
+    ca[0] = d[0][0]
+    for j in range(1, len(b)): ca[j] = max(ca[j - 1], d[0][j])
+    for i in range(1, len(a)):
+        row = d[i]
+        prev_diag, ca[0] = ca[0], max(ca[0], row[0])
+        for j in range(1, len(b)):
+            best = min(ca[j], prev_diag, ca[j - 1])
+            prev_diag = ca[j]
+            ca[j] = max(best, row[j])
+        # No later row can be less than the least of this one
+        if min(ca) > limit: return inf
+    return ca[-1]
+
+
+@dataclass
+class RouteCluster:
+    id: int
+    route: np.ndarray                       # The resampled route of the activity that started the cluster
+    members: dict[int, SummaryActivity] = field(default_factory=dict)
+    box: np.ndarray = field(init=False)     # The route's bounding box
+
+    def __post_init__(self):
+        self.box = bounding_box(self.route)
+
+    @property
+    def start(self) -> tuple[float, float]: return tuple(self.route[0])  # type: ignore
+    @property
+    def end(self) -> tuple[float, float]: return tuple(self.route[-1])   # type: ignore
+
+    def likely_commute(self, factors: EmissionFactors = EmissionFactors()) -> bool:
+        if len(self.members) < MIN_COMMUTE_TRIPS: return False
+        if distance(self.start, self.end) < MIN_COMMUTE_LENGTH: return False
+        activities = self.members.values()
+        if not any(a.sport_type in factors.replaces for a in activities): return False
+        weekdays = sum(a.start_date_local.weekday() < 5 for a in activities)
+        return weekdays >= MIN_WEEKDAY_SHARE * len(self.members)
+
+
+class RouteClusters(HistoryView):
+    """Activities with a route, grouped into clusters of the same route"""
+
+    clusters: dict[int, RouteCluster]
+    cluster_of: dict[int, int]
+    """The cluster of each activity"""
+
+    def __init__(self):
+        self.clusters = {}
+        self.cluster_of = {}
+        self._next_id = 0
+        self._commutes: frozenset[int] = frozenset()
+        self._pending: dict[int, Optional[SummaryActivity]] = {}
+        """Activities added, or `None` for those removed, since the last update"""
+        self._pending_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._rows: dict[int, int] = {}
+        """Row of each cluster in the columns"""
+        self._ids = np.zeros(64, np.int64)
+        self._endpoints = np.zeros((64, 4))
+        """`[start latitude, start longitude, end latitude, end longitude]` of each cluster's route"""
+        self._boxes = np.zeros((64, 4))
+
+    def match(self, route: np.ndarray) -> Optional[RouteCluster]:
+        """The cluster closest to a resampled route, if any is close enough"""
+        n = len(self._rows)
+        if not n: return None
+        # Distances are small enough to treat the Earth as flat around the route
+        scale = METRES_PER_DEGREE * np.array([1, cos(radians(route[0, 0]))] * 2)
+        apart = (self._endpoints[:n] - np.concatenate([route[0], route[-1]])) * scale
+        near = (np.hypot(apart[:, 0], apart[:, 1]) <= ENDPOINT_RADIUS) & (np.hypot(apart[:, 2], apart[:, 3]) <= ENDPOINT_RADIUS)
+        # A point of one route outside the other's bounding box, widened by the distance,
+        # is further than that from every point of the other route
+        near &= (np.abs(self._boxes[:n] - bounding_box(route)) * scale <= MAX_FRECHET_DISTANCE).all(axis=1)
+
+        # Closest endpoints first, so the distance to beat shrinks quickly
+        rows = np.flatnonzero(near)
+        rows = rows[np.argsort(np.abs(apart[rows]).sum(axis=1))]
+        best, best_distance = None, MAX_FRECHET_DISTANCE
+        for id in self._ids[rows].tolist():
+            cluster = self.clusters[id]
+            d = frechet_distance(cluster.route, route, best_distance)
+            if d <= best_distance: best, best_distance = cluster, d
+        return best
+
+    def add(self, activity: SummaryActivity) -> None:
+        if not (activity.map and activity.map.summary_polyline): return
+        with self._pending_lock: self._pending[activity.id] = activity
+
+    def remove(self, activity: SummaryActivity) -> None:
+        with self._pending_lock: self._pending[activity.id] = None
+
+    def _join(self, activity: SummaryActivity) -> None:
+        points = polyline.decode(activity.map.summary_polyline)
+        if not len(points): return
+        route = resample(points)
+        cluster = self.match(route)
+        if cluster is None:
+            cluster = RouteCluster(self._next_id, route)
+            self._next_id += 1
+            self.clusters[cluster.id] = cluster
+            self._add_row(cluster)
+        cluster.members[activity.id] = activity
+        self.cluster_of[activity.id] = cluster.id
+
+    def _leave(self, activity_id: int) -> None:
+        id = self.cluster_of.pop(activity_id, None)
+        if id is None: return
+        cluster = self.clusters[id]
+        cluster.members.pop(activity_id, None)
+        if not cluster.members:
+            del self.clusters[id]
+            self._remove_row(id)
+
+    def _add_row(self, cluster: RouteCluster) -> None:
+        row = self._rows[cluster.id] = len(self._rows)
+        if row >= len(self._ids):
+            # Double the capacity of every column
+            for name in ('_ids', '_endpoints', '_boxes'):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+        self._ids[row] = cluster.id
+        self._endpoints[row] = np.concatenate([cluster.route[0], cluster.route[-1]])
+        self._boxes[row] = cluster.box
+
+    def _remove_row(self, id: int) -> None:
+        row = self._rows.pop(id)
+        # Move the last row into the gap
+        last = len(self._rows)
+        if row != last:
+            self._rows[int(self._ids[last])] = row
+            for name in ('_ids', '_endpoints', '_boxes'):
+                column = getattr(self, name)
+                column[row] = column[last]
+
+    def update(self) -> None:
+        """
+        Clusters the activities added or removed since the last update, and finds the likely commutes again.
+        Doesn't need the history's lock, and only one update runs at a time.
+        """
+        with self._update_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending: return
+            for id, activity in pending.items():
+                self._leave(id)
+                if activity is not None: self._join(activity)
+            self._commutes = frozenset(
+                id for c in self.clusters.values() if c.likely_commute() for id in c.members
+            )
+
+    def likely_commutes(self) -> frozenset[int]:
+        """
+        IDs of the activities on routes that are likely commutes, whether or not they're marked as
+        commutes, as of the last `update`
+        """
+        return self._commutes
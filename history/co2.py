@@ -0,0 +1,213 @@
+"""
+Estimates the CO2 emissions an athlete has avoided by travelling under their own power
+instead of by car, bus, etc. Savings are computed for a whole history at once from arrays
+of activities, and kept as cumulative sums per day so the savings between any two dates
+are a subtraction.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import date
+from enum import StrEnum
+from typing import Optional
+import numpy as np
+
+from strava_api.models import SportType, SummaryActivity
+from .view import HistoryView
+
+# Every sport, in the order used for sport codes
+SPORTS = list(SportType)
+SPORT_CODES = {s: i for i, s in enumerate(SPORTS)}
+
+
+class TransportMode(StrEnum):
+    """Ways of travelling that an activity could have replaced"""
+    CAR="car"
+    BUS="bus"
+    TRAIN="train"
+    MOTORBIKE="motorbike"
+
+
+@dataclass(frozen=True)
+class EmissionFactors:
+    """
+    How much CO2 an activity avoids, in kg per km travelled.
+    The default emissions per passenger km are the UK government's 2023 conversion factors
+    for an average car, local bus, national rail, and average motorbike.
+    """
+    per_km: dict[TransportMode, float] = field(default_factory=lambda: {
+        TransportMode.CAR: 0.170,
+        TransportMode.BUS: 0.102,
+        TransportMode.TRAIN: 0.035,
+        TransportMode.MOTORBIKE: 0.114,
+    })
+    replaces: dict[SportType, TransportMode] = field(default_factory=lambda: {
+        s: TransportMode.CAR for s in (
+            SportType.Ride, SportType.EBikeRide, SportType.GravelRide, SportType.Run,
+            SportType.Walk, SportType.Hike, SportType.Wheelchair, SportType.Handcycle,
+            SportType.Velomobile, SportType.InlineSkate, SportType.Skateboard,
+        )
+    })
+    """The transport mode each sport replaces, sports not listed save nothing"""
+    emitted: dict[SportType, float] = field(default_factory=lambda: {
+        SportType.EBikeRide: 0.005,
+    })
+    """CO2 emitted by the activity itself, per km, e.g. charging an e-bike"""
+    commute_share: float = 1.0
+    """Fraction of a commute's distance that would otherwise have been driven, etc."""
+    other_share: float = 0.0
+    """Fraction of any other activity's distance that would otherwise have been driven, etc."""
+
+    def table(self) -> np.ndarray:
+        """The kg of CO2 saved per km, indexed by sport code and then whether the activity is a commute"""
+        table = np.zeros((len(SPORTS), 2))
+        for sport, mode in self.replaces.items():
+            saved = self.per_km[mode]
+            emitted = self.emitted.get(sport, 0)
+            table[SPORT_CODES[sport]] = [self.other_share * saved - emitted, self.commute_share * saved - emitted]
+        # Activities that don't replace travel never count as a negative saving
+        return np.maximum(table, 0)
+
+
+def co2_saved(
+    distance: np.ndarray,
+    sport: np.ndarray,
+    commute: np.ndarray,
+    factors: EmissionFactors = EmissionFactors(),
+) -> np.ndarray:
+    """
+    The kg of CO2 saved by each activity.
+    :param distance: Distance of each activity in metres
+    :param sport: Sport code (index into `SPORTS`) of each activity
+    :param commute: Whether each activity is a commute
+    """
+    return np.asarray(distance) / 1000 * factors.table()[np.asarray(sport), np.asarray(commute, dtype=np.intp)]
+
+
+class CO2Ledger:
+    """Cumulative CO2 savings per day, in total and for each sport"""
+
+    def __init__(
+        self,
+        distance: np.ndarray,
+        sport: np.ndarray,
+        commute: np.ndarray,
+        day: np.ndarray,
+        factors: EmissionFactors = EmissionFactors(),
+    ):
+        """
+        :param day: Day of each activity, as `datetime64[D]`
+        """
+        saved = co2_saved(distance, sport, commute, factors)
+        day = np.asarray(day, dtype='datetime64[D]')
+        self.first_day = day.min() if len(day) else np.datetime64('1970-01-01', 'D')
+        n_days = int((day.max() - self.first_day).astype(int)) + 1 if len(day) else 1
+        offset = (day - self.first_day).astype(np.intp)
+
+        # Only sports with activities get a row
+        self.sports, row = np.unique(np.asarray(sport, dtype=np.intp), return_inverse=True)
+        per_day = np.bincount(row * n_days + offset, weights=saved, minlength=len(self.sports) * n_days)
+
+        # Prefixed with a zero so that cumulative[i] is the savings before day i
+        self.by_sport = np.zeros((len(self.sports), n_days + 1))
+        self.by_sport[:, 1:] = np.cumsum(per_day.reshape(len(self.sports), n_days), axis=1)
+        self.cumulative = self.by_sport.sum(axis=0)
+
+    def _index(self, day: date) -> int:
+        """The position in the cumulative arrays of the start of a day"""
+        i = int((np.datetime64(day, 'D') - self.first_day).astype(int))
+        return min(max(i, 0), len(self.cumulative) - 1)
+
+    def between(self, start: date, end: date, sport: Optional[SportType] = None) -> float:
+        """kg of CO2 saved from the start of `start` up to (not including) `end`"""
+        if sport is None:
+            cumulative = self.cumulative
+        else:
+            row = np.searchsorted(self.sports, SPORT_CODES[sport])
+            if row >= len(self.sports) or self.sports[row] != SPORT_CODES[sport]: return 0.0
+            cumulative = self.by_sport[row]
+        return float(cumulative[self._index(end)] - cumulative[self._index(start)])
+
+    def year(self, year: int, sport: Optional[SportType] = None) -> float:
+        """kg of CO2 saved in a calendar year"""
+        return self.between(date(year, 1, 1), date(year + 1, 1, 1), sport)
+
+    def total(self, sport: Optional[SportType] = None) -> float:
+        """kg of CO2 saved over the whole history"""
+        if sport is None: return float(self.cumulative[-1])
+        return self.between(date.min, date.max, sport)
+
+
+class CO2Engine(HistoryView):
+    """
+    The CO2 savings of an athlete's history. Activities are kept as columns of arrays,
+    and the ledger is rebuilt from them in one pass the next time it's needed after a change.
+    """
+
+    def __init__(self, factors: EmissionFactors = EmissionFactors()):
+        self._factors = factors
+        self._ledger: Optional[CO2Ledger] = None
+        self._inferred_commutes: frozenset[int] = frozenset()
+        self._rows: dict[int, int] = {}
+        """Row of each activity in the columns"""
+        self.id = np.zeros(64, np.int64)
+        self.distance = np.zeros(64)
+        self.sport = np.zeros(64, np.intp)
+        self.commute = np.zeros(64, np.bool_)
+        self.day = np.zeros(64, 'datetime64[D]')
+
+    @property
+    def factors(self) -> EmissionFactors:
+        return self._factors
+
+    @factors.setter
+    def factors(self, factors: EmissionFactors) -> None:
+        self._factors = factors
+        self._ledger = None
+
+    @property
+    def inferred_commutes(self) -> frozenset[int]:
+        """IDs of activities counted as commutes even though they aren't marked as commutes, see `RouteClusters`"""
+        return self._inferred_commutes
+
+    @inferred_commutes.setter
+    def inferred_commutes(self, ids: frozenset[int]) -> None:
+        if ids == self._inferred_commutes: return
+        self._inferred_commutes = ids
+        self._ledger = None
+
+    def add(self, activity: SummaryActivity) -> None:
+        row = self._rows.setdefault(activity.id, len(self._rows))
+        if row >= len(self.distance):
+            # Double the capacity of every column
+            for name in ('id', 'distance', 'sport', 'commute', 'day'):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+        self.id[row] = activity.id
+        self.distance[row] = activity.distance or 0
+        self.sport[row] = SPORT_CODES.get(activity.sport_type, SPORT_CODES[SportType.Workout])
+        self.commute[row] = bool(activity.commute)
+        self.day[row] = activity.start_date_local.date()
+        self._ledger = None
+
+    def remove(self, activity: SummaryActivity) -> None:
+        row = self._rows.pop(activity.id, None)
+        if row is None: return
+        # Move the last row into the gap
+        last = len(self._rows)
+        if row != last:
+            self._rows[int(self.id[last])] = row
+            for name in ('id', 'distance', 'sport', 'commute', 'day'):
+                column = getattr(self, name)
+                column[row] = column[last]
+        self._ledger = None
+
+    @property
+    def ledger(self) -> CO2Ledger:
+        if self._ledger is None:
+            n = len(self._rows)
+            commute = self.commute[:n]
+            if self._inferred_commutes:
+                commute = commute | np.isin(self.id[:n], np.fromiter(self._inferred_commutes, np.int64))
+            self._ledger = CO2Ledger(self.distance[:n], self.sport[:n], commute, self.day[:n], self._factors)
+        return self._ledger
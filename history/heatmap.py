@@ -0,0 +1,156 @@
+"""
+A pyramid of route heatmap tiles, in the same tiling as web maps: at zoom `z` the
+Web Mercator world is split into 2^z x 2^z tiles of 256 x 256 cells, and each cell
+counts the activities whose route passes through it.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Iterator, Optional
+import numpy as np
+
+from strava_api import polyline
+from strava_api.models import SummaryActivity
+from .spatial import EARTH_RADIUS
+from .view import HistoryView
+
+# Deepest zoom level binned, each cell is ~10 m across at the equator
+MAX_ZOOM = 14
+TILE_BITS = 8
+TILE_SIZE = 1 << TILE_BITS
+
+# Segments of a route longer than this many metres are GPS jumps, e.g. when a recording is
+# paused on a train, so only their ends are counted rather than every cell in between
+MAX_SEGMENT_LENGTH = 5000
+
+TileKey = tuple[int, int, int]
+
+
+def mercator(latlng: np.ndarray) -> np.ndarray:
+    """Projects `[latitude, longitude]` rows onto Web Mercator `[x, y]`, each in [0, 1)"""
+    lat = np.radians(np.clip(latlng[:, 0], -85.0511, 85.0511))
+    x = (latlng[:, 1] + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+    return np.stack([x, y], axis=1)
+
+def inverse_mercator(xy: np.ndarray) -> np.ndarray:
+    """Converts Web Mercator `[x, y]` rows back to `[latitude, longitude]`"""
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * xy[:, 1]))))
+    return np.stack([lat, xy[:, 0] * 360 - 180], axis=1)
+
+def to_pixels(latlng: np.ndarray, zoom: int = MAX_ZOOM) -> np.ndarray:
+    """The integer Web Mercator cells containing `[latitude, longitude]` rows at a zoom level"""
+    scale = float(1 << (zoom + TILE_BITS))
+    return np.clip(mercator(latlng) * scale, 0, scale - 1).astype(np.int64)
+
+def to_latlng(pixels: np.ndarray, zoom: int) -> np.ndarray:
+    """The `[latitude, longitude]` of the centre of Web Mercator cells at a zoom level"""
+    return inverse_mercator((pixels + 0.5) / float(1 << (zoom + TILE_BITS)))
+
+def viewport(lat: float, lon: float, zoom: float, width: int, height: int) -> tuple[float, float, float, float]:
+    """
+    The `(west, south, east, north)` bounds of a map of the given size in pixels,
+    centred on a point at a (possibly fractional) zoom level of 256 pixel tiles.
+    """
+    scale = 2 ** zoom * TILE_SIZE
+    x, y = mercator(np.array([[lat, lon]]))[0]
+    corners = np.array([[x - width / 2 / scale, y - height / 2 / scale], [x + width / 2 / scale, y + height / 2 / scale]])
+    (north, west), (south, east) = inverse_mercator(np.clip(corners, 0, 1))
+    return west, south, east, north
+
+def segment_lengths(latlng: np.ndarray) -> np.ndarray:
+    """The length in metres of each segment between consecutive `[latitude, longitude]` rows"""
+    lat = np.radians(latlng[:, 0])
+    dlat = np.diff(lat)
+    dlon = np.radians((np.diff(latlng[:, 1]) + 180) % 360 - 180) * np.cos(0.5 * (lat[1:] + lat[:-1]))
+    return np.hypot(dlat, dlon) * EARTH_RADIUS
+
+def rasterise(pixels: np.ndarray, fill: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Fills in the cells between consecutive route points so each segment is drawn as a line.
+    :param fill: Whether to fill in each segment, otherwise only its ends are kept
+    """
+    if len(pixels) < 2: return pixels
+    delta = np.diff(pixels, axis=0)
+    steps = np.maximum(np.abs(delta).max(axis=1), 1)
+    if fill is not None: steps = np.where(fill, steps, 1)
+    # Fraction of the way along its segment for every interpolated point
+    segment = np.repeat(np.arange(len(delta)), steps)
+    t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    line = pixels[segment] + np.rint(delta[segment] * t[:, None]).astype(np.int64)
+    return np.concatenate([line, pixels[-1:]])
+
+
+@dataclass
+class Tile:
+    """The non-zero cells of a tile, as a sparse array sorted by cell index (`y * 256 + x`)"""
+    index: np.ndarray
+    count: np.ndarray
+
+    def merge(self, index: np.ndarray, count: np.ndarray) -> None:
+        """Adds (or with negative counts, subtracts) counts to the tile's cells"""
+        cells, inverse = np.unique(np.concatenate([self.index, index]), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate([self.count, count]), minlength=len(cells))
+        keep = totals > 0
+        self.index = cells[keep].astype(np.uint16)
+        self.count = totals[keep].astype(np.int64)
+
+
+class HeatmapPyramid(HistoryView):
+    """Counts of activities passing through each cell, for every zoom level up to `MAX_ZOOM`"""
+
+    tiles: dict[TileKey, Tile]
+
+    def __init__(self):
+        self.tiles = {}
+
+    def add(self, activity: SummaryActivity) -> None:
+        self._update(activity, 1)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        self._update(activity, -1)
+
+    def _update(self, activity: SummaryActivity, sign: int) -> None:
+        if not activity.map or not activity.map.summary_polyline: return
+        points = polyline.decode(activity.map.summary_polyline)
+        pixels = rasterise(to_pixels(points), segment_lengths(points) <= MAX_SEGMENT_LENGTH)
+
+        for zoom in range(MAX_ZOOM, -1, -1):
+            if zoom < MAX_ZOOM: pixels = pixels >> 1
+            # Each activity counts once per cell, however many times it passes through
+            pixels = np.unique(pixels, axis=0)
+            tiles = pixels >> TILE_BITS
+            cells = (pixels[:, 1] & (TILE_SIZE - 1)) * TILE_SIZE + (pixels[:, 0] & (TILE_SIZE - 1))
+
+            # Group the cells by tile, sorted by cell index within each tile
+            tile_ids = tiles[:, 0] << 32 | tiles[:, 1]
+            order = np.lexsort((cells, tile_ids))
+            tile_ids, tiles, cells = tile_ids[order], tiles[order], cells[order]
+            starts = np.flatnonzero(np.concatenate(([True], tile_ids[1:] != tile_ids[:-1])))
+            for start, end in zip(starts, np.append(starts[1:], len(tile_ids))):
+                key = (zoom, int(tiles[start, 0]), int(tiles[start, 1]))
+                tile = self.tiles.setdefault(key, Tile(np.empty(0, np.uint16), np.empty(0, np.int64)))
+                tile.merge(cells[start:end], np.full(end - start, sign))
+                if not len(tile.index): del self.tiles[key]
+
+    def tiles_in(self, zoom: int, west: float, south: float, east: float, north: float) -> Iterator[tuple[TileKey, Tile]]:
+        """Iterates the non-empty tiles at a zoom level that overlap a bounding box"""
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        corners = to_pixels(np.array([[north, west], [south, east]]), zoom) >> TILE_BITS
+        (x0, y0), (x1, y1) = corners
+        # The box may cross the antimeridian
+        xs = range(x0, x1 + 1) if x0 <= x1 else [*range(x0, 1 << zoom), *range(0, x1 + 1)]
+        for x in xs:
+            for y in range(y0, y1 + 1):
+                tile = self.tiles.get((zoom, x, y))
+                if tile is not None: yield (zoom, x, y), tile
+
+    def cells_in(self, zoom: int, west: float, south: float, east: float, north: float) -> tuple[np.ndarray, np.ndarray]:
+        """The `[latitude, longitude]` and count of every non-empty cell in the tiles overlapping a bounding box"""
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        pixels, counts = [np.empty((0, 2), np.int64)], [np.empty(0, np.int64)]
+        for (_, x, y), tile in self.tiles_in(zoom, west, south, east, north):
+            index = tile.index.astype(np.int64)
+            pixels.append(np.stack([x * TILE_SIZE + index % TILE_SIZE, y * TILE_SIZE + index // TILE_SIZE], axis=1))
+            counts.append(tile.count)
+        return to_latlng(np.concatenate(pixels), zoom), np.concatenate(counts)
@@ -0,0 +1,174 @@
+"""
+Runs long fetches, like syncing an athlete's whole history, on a background thread pool
+so request threads never wait for them. Each job's state and progress are kept in a SQLite
+table under `DATA_DIR`, which every worker process can read, and which records jobs that
+were cut short when the server stopped.
+Pages start a job with e.g. `sync_in_background`, show whatever has been fetched so far,
+and poll `job_status` until the job has finished.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import StrEnum
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+import strava_api as api
+from . import DATA_DIR
+from .clusters import RouteClusters
+from .store import history_for
+
+# Maximum number of jobs running at once in each process
+MAX_RUNNING_JOBS = 4
+
+Progress = Callable[[int], None]
+JobFunction = Callable[[Progress], Optional[api.models.Fault]]
+
+
+class JobState(StrEnum):
+    QUEUED="queued"
+    RUNNING="running"
+    DONE="done"
+    FAILED="failed"
+
+
+@dataclass(frozen=True)
+class Job:
+    key: str                                # Identifies the job, only one job runs per key
+    state: JobState
+    progress: int                           # E.g. the number of activities fetched so far
+    error: Optional[str]                    # Why the job failed
+    updated: float                          # When the job last changed, in seconds since the epoch
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JobState.DONE, JobState.FAILED)
+
+
+def alive(pid: int) -> bool:
+    """Whether a process is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JobQueue:
+    """A thread pool running jobs, recording each job's state in a SQLite database"""
+
+    def __init__(self, path: str, max_workers: int = MAX_RUNNING_JOBS):
+        self.path = path
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.lock = threading.Lock()
+        self._running: dict[str, Future] = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated REAL NOT NULL
+                )
+            """)
+            # Jobs left unfinished by processes that have since stopped will never finish
+            unfinished = db.execute('SELECT key FROM jobs WHERE state IN (?, ?)', (JobState.QUEUED, JobState.RUNNING)).fetchall()
+            for (key,) in unfinished:
+                if not alive(int(key.rsplit('@', 1)[-1])):
+                    db.execute(
+                        "UPDATE jobs SET state = ?, error = 'interrupted', updated = ? WHERE key = ?",
+                        (JobState.FAILED, time.time(), key),
+                    )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self, key: str) -> str:
+        # Each process runs its own jobs, since each keeps its own copy of the histories
+        return f'{key}@{os.getpid()}'
+
+    def _set(self, key: str, state: JobState, progress: int = 0, error: Optional[str] = None) -> None:
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO jobs (key, state, progress, error, updated) VALUES (?, ?, ?, ?, ?)',
+                (self._key(key), state, progress, error, time.time()),
+            )
+
+    def get(self, key: str) -> Optional[Job]:
+        """The latest state of a job, or `None` if it has never been submitted"""
+        with self._connect() as db:
+            row = db.execute('SELECT state, progress, error, updated FROM jobs WHERE key = ?', (self._key(key),)).fetchone()
+        if row is None: return None
+        return Job(key, JobState(row[0]), row[1], row[2], row[3])
+
+    def submit(self, key: str, function: JobFunction) -> Job:
+        """
+        Runs a job in the background, unless a job with the same key is already queued or running.
+        The function is passed a callback to report its progress, and returns a `Fault` if it fails.
+        """
+        with self.lock:
+            if key not in self._running:
+                self._set(key, JobState.QUEUED)
+                self._running[key] = self.pool.submit(self._run, key, function)
+        return self.get(key) or Job(key, JobState.QUEUED, 0, None, time.time())
+
+    def _run(self, key: str, function: JobFunction) -> None:
+        progress = 0
+        def report(n: int) -> None:
+            nonlocal progress
+            progress = n
+            self._set(key, JobState.RUNNING, n)
+
+        self._set(key, JobState.RUNNING)
+        try:
+            fault = function(report)
+            if fault is None:
+                self._set(key, JobState.DONE, progress)
+            else:
+                self._set(key, JobState.FAILED, progress, fault.message)
+        except Exception as e:
+            self._set(key, JobState.FAILED, progress, repr(e))
+            raise
+        finally:
+            with self.lock:
+                self._running.pop(key, None)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+def job_queue() -> JobQueue:
+    """Returns the job queue shared by every request in this process"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(os.path.join(DATA_DIR, 'jobs.sqlite'))
+        return _queue
+
+
+def sync_key(athlete_id: int) -> str:
+    return f'sync:{athlete_id}'
+
+def sync_in_background(client: api.Client, athlete_id: int) -> Job:
+    """
+    Starts fetching an athlete's new activities into their history, see `ActivityHistory.sync`,
+    then clusters their routes, which is too slow to do while a page waits
+    """
+    activity_history = history_for(athlete_id)
+    def sync(progress: Progress) -> Optional[api.models.Fault]:
+        fault = activity_history.sync(client, progress)
+        activity_history.view(RouteClusters).update()
+        return fault
+    return job_queue().submit(sync_key(athlete_id), sync)
+
+def job_status(key: str) -> Optional[Job]:
+    return job_queue().get(key)
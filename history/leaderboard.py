@@ -0,0 +1,209 @@
+"""
+Leaderboards of the members of a club by distance and CO2 saved, for every week, month, and year,
+and for all time. Each member's totals are updated as new club activities are fetched, and each
+leaderboard keeps a sorted ranking which is only sorted again the first time it's asked for after
+a change, so a large club's leaderboard is served straight from the ranking.
+
+Strava doesn't say when club activities took place or give their IDs, so activities count towards
+the periods in which they were first fetched, and a refresh stops at the first activity that the
+previous refresh saw. Activities fetched without reaching one the previous refresh saw, i.e. the
+club's backlog on its first refresh or after a gap, could be from any time, so they only count
+towards the all time leaderboards.
+Strava only gives members' first names and last initials, so members with the same name are
+counted as one, which the clubs page says.
+"""
+
+from __future__ import annotations
+from datetime import date
+from enum import StrEnum
+import os
+import pickle
+import threading
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+import strava_api as api
+from strava_api.models import ClubActivity, SportType
+from . import DATA_DIR
+from .co2 import EmissionFactors, SPORT_CODES, co2_saved
+from .jobs import Job, job_queue
+from .stats import Period, period_key
+
+# The newest activities remembered from each refresh, to find where the next refresh's new activities end
+REMEMBERED_ACTIVITIES = 50
+
+# Club activities fetched from Strava at a time
+CLUB_PAGE_SIZE = 200
+
+
+class Metric(StrEnum):
+    """What members are ranked by"""
+    DISTANCE="distance"     # Metres
+    CO2="co2"               # kg of CO2 saved
+
+Fingerprint = tuple
+"""Tells club activities apart, since they have no ID"""
+
+def member_name(activity: ClubActivity) -> str:
+    """
+    Identifies the member of a club activity, which Strava only gives as a first name and last
+    initial, so this is the same for every member with the same name
+    """
+    return f'{activity.athlete.firstname} {activity.athlete.lastname}'
+
+def fingerprint(activity: ClubActivity) -> Fingerprint:
+    return (member_name(activity), activity.name, activity.sport_type, activity.distance, activity.moving_time, activity.elapsed_time)
+
+
+class Leaderboard:
+    """The totals of each member for one metric over one period, e.g. the distance of one week"""
+
+    def __init__(self):
+        self.totals: dict[str, float] = {}
+        self._ranking: Optional[list[tuple[str, float]]] = None
+        self._positions: dict[str, int] = {}
+
+    def add(self, member: str, value: float) -> None:
+        self.totals[member] = self.totals.get(member, 0) + value
+        self._ranking = None
+
+    def ranking(self) -> list[tuple[str, float]]:
+        """Every member and their total, highest first"""
+        if self._ranking is None:
+            self._ranking = sorted(self.totals.items(), key=lambda t: (-t[1], t[0]))
+            self._positions = {member: i for i, (member, _) in enumerate(self._ranking)}
+        return self._ranking
+
+    def top(self, k: int) -> list[tuple[str, float]]:
+        """The `k` members with the highest totals and their totals, highest first"""
+        return self.ranking()[:k]
+
+    def rank(self, member: str) -> Optional[int]:
+        """A member's position in the leaderboard counting from 1, or `None` if they have no total"""
+        self.ranking()
+        i = self._positions.get(member)
+        return None if i is None else i + 1
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+
+class ClubLeaderboards:
+    """Every leaderboard of one club, keyed by metric, period, and the period's key"""
+
+    club_id: int
+    boards: dict[tuple[Metric, Period, tuple[int, ...]], Leaderboard]
+    recent: list[Fingerprint]
+    """The newest activities seen by the last refresh, newest first"""
+
+    def __init__(self, club_id: int, factors: EmissionFactors = EmissionFactors()):
+        self.club_id = club_id
+        self.boards = {}
+        self.recent = []
+        self.factors = factors
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def add(self, activities: list[ClubActivity], day: date, periods: Iterable[Period] = Period) -> None:
+        """Adds activities to the totals of the periods containing a day, of every kind of period unless given"""
+        if not activities: return
+        # Club activities don't say whether they're commutes, so go by their names
+        saved = co2_saved(
+            np.array([a.distance or 0 for a in activities]),
+            np.array([SPORT_CODES.get(a.sport_type, SPORT_CODES[SportType.Workout]) for a in activities]),
+            np.array(['commut' in (a.name or '').casefold() for a in activities]),
+            self.factors,
+        )
+        with self.lock:
+            for period in periods:
+                key = period_key(period, day)
+                distance = self.boards.setdefault((Metric.DISTANCE, period, key), Leaderboard())
+                co2 = self.boards.setdefault((Metric.CO2, period, key), Leaderboard())
+                for activity, kg in zip(activities, saved):
+                    member = member_name(activity)
+                    distance.add(member, activity.distance or 0)
+                    co2.add(member, float(kg))
+
+    def board(self, metric: Metric, period: Period = Period.ALL, day: Optional[date] = None) -> Leaderboard:
+        """The leaderboard of the period containing a day, which defaults to today"""
+        with self.lock:
+            board = self.boards.get((metric, period, period_key(period, day or date.today())))
+            return Leaderboard() if board is None else board
+
+    def top(self, metric: Metric, period: Period = Period.ALL, k: int = 10, day: Optional[date] = None) -> list[tuple[str, float]]:
+        with self.lock:
+            return self.board(metric, period, day).top(k)
+
+    def refresh(self, client: api.Client, progress: Optional[Callable[[int], None]] = None) -> Optional[api.models.Fault]:
+        """
+        Fetches the club's activities that are newer than those seen by the last refresh,
+        adding them to today's leaderboards. If none of the activities seen by the last refresh are
+        reached, e.g. on the first refresh, the activities are a backlog from any time, so are only
+        added to the all time leaderboards.
+        :param progress: Called with the number of new activities fetched so far after each page
+        """
+        with self.lock:
+            seen = set(self.recent)
+        new: list[ClubActivity] = []
+        caught_up = False
+        for activity in api.iter_club_activities(client, self.club_id, per_page=CLUB_PAGE_SIZE):
+            if isinstance(activity, api.models.Fault): return activity
+            if fingerprint(activity) in seen:
+                caught_up = True
+                break
+            new.append(activity)
+            if progress and len(new) % CLUB_PAGE_SIZE == 0: progress(len(new))
+        with self.lock:
+            self.add(new, date.today(), Period if caught_up else (Period.ALL,))
+            self.recent = ([fingerprint(a) for a in new] + self.recent)[:REMEMBERED_ACTIVITIES]
+            self.save()
+        if progress: progress(len(new))
+
+    @property
+    def path(self) -> str:
+        return os.path.join(DATA_DIR, 'clubs', f'{self.club_id}.pickle')
+
+    def save(self) -> None:
+        """Saves the leaderboards to disk, so they are kept when the server restarts"""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self, f)
+            os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, club_id: int) -> ClubLeaderboards:
+        """Loads a club's saved leaderboards, or returns empty leaderboards if none are saved"""
+        path = cls(club_id).path
+        if not os.path.exists(path): return cls(club_id)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+_leaderboards: dict[int, ClubLeaderboards] = {}
+_leaderboards_lock = threading.Lock()
+
+def leaderboards_for(club_id: int) -> ClubLeaderboards:
+    """Returns the leaderboards of the given club, shared by every request in this process"""
+    with _leaderboards_lock:
+        if club_id not in _leaderboards:
+            _leaderboards[club_id] = ClubLeaderboards.load(club_id)
+        return _leaderboards[club_id]
+
+def club_key(club_id: int) -> str:
+    return f'club:{club_id}'
+
+def refresh_club_in_background(client: api.Client, club_id: int) -> Job:
+    """Starts fetching a club's new activities into its leaderboards, see `ClubLeaderboards.refresh`"""
+    leaderboards = leaderboards_for(club_id)
+    return job_queue().submit(club_key(club_id), lambda progress: leaderboards.refresh(client, progress))
@@ -0,0 +1,156 @@
+"""
+An athlete's activities kept sorted by date, distance, and duration, to list them a page at a time.
+Pages are found by keyset (cursor) pagination: a cursor holds the sort key and ID of the
+last activity on the previous page, and the next page starts from a binary search for it,
+so a page deep into a long history costs the same as the first.
+Activities are also kept sorted by sport and by whether they're commutes, like `TimeIndex`, so
+listing one sport or only commutes never passes over the others. Only the text filter is checked
+activity by activity.
+"""
+
+from __future__ import annotations
+import base64
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import datetime
+from enum import StrEnum
+from typing import Callable, Iterator, Optional
+
+from strava_api.models import SummaryActivity
+from .view import HistoryView
+
+# Activities on a page unless asked for otherwise
+PAGE_SIZE = 50
+
+Key = tuple[float, int]
+"""An activity's sort key followed by its ID, so that activities with the same key have an order"""
+
+Bucket = tuple[Optional[str], Optional[bool]]
+"""A sport type in lower case and whether activities are commutes, `None` for any"""
+
+
+class ActivityOrder(StrEnum):
+    """What activities can be listed in order of"""
+    DATE="date"
+    DISTANCE="distance"
+    DURATION="duration"
+
+SORT_KEYS: dict[ActivityOrder, Callable[[SummaryActivity], float]] = {
+    ActivityOrder.DATE: lambda a: a.start_date.timestamp(),
+    ActivityOrder.DISTANCE: lambda a: a.distance or 0,
+    ActivityOrder.DURATION: lambda a: a.moving_time or 0,
+}
+
+
+def encode_cursor(key: Key) -> str:
+    return base64.urlsafe_b64encode(f'{key[0]!r}:{key[1]}'.encode()).decode()
+
+def decode_cursor(cursor: str) -> Optional[Key]:
+    """The key in a cursor, or `None` if it isn't a valid cursor"""
+    try:
+        value, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return float(value), int(id)
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class ActivityFilter:
+    """Which activities to list, every activity matches the default filter"""
+    sport: Optional[str] = None             # Only activities of this sport type (case insensitive)
+    after: Optional[datetime] = None        # Only activities starting at or after this time
+    before: Optional[datetime] = None       # Only activities starting before this time
+    commute: Optional[bool] = None          # Only commutes, or only activities that aren't commutes
+    text: Optional[str] = None              # Only activities whose names contain this (case insensitive)
+
+    @property
+    def bucket(self) -> Bucket:
+        """The activities that the sport and commute filters pick out"""
+        return (self.sport.lower() if self.sport else None, self.commute)
+
+    def matches(self, activity: SummaryActivity) -> bool:
+        if self.sport and activity.sport_type.lower() != self.sport.lower(): return False
+        if self.after and activity.start_date < self.after: return False
+        if self.before and activity.start_date >= self.before: return False
+        if self.commute is not None and bool(activity.commute) != self.commute: return False
+        if self.text and self.text.casefold() not in (activity.name or '').casefold(): return False
+        return True
+
+
+@dataclass(frozen=True)
+class ActivityPage:
+    activities: list[SummaryActivity]
+    next: Optional[str]                     # The cursor of the following page, or `None` if this is the last page
+
+
+def buckets(activity: SummaryActivity) -> tuple[Bucket, ...]:
+    """Every bucket an activity is listed in"""
+    sport, commute = activity.sport_type.lower(), bool(activity.commute)
+    return ((None, None), (sport, None), (None, commute), (sport, commute))
+
+
+class ActivityList(HistoryView):
+    """The keys of the activities in each bucket in each order, sorted ascending"""
+
+    keys: dict[ActivityOrder, dict[Bucket, list[Key]]]
+    activities: dict[int, SummaryActivity]
+
+    def __init__(self):
+        self.keys = {order: {} for order in ActivityOrder}
+        self.activities = {}
+
+    def add(self, activity: SummaryActivity) -> None:
+        self.activities[activity.id] = activity
+        for order, by_bucket in self.keys.items():
+            key = (SORT_KEYS[order](activity), activity.id)
+            for bucket in buckets(activity):
+                insort(by_bucket.setdefault(bucket, []), key)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        self.activities.pop(activity.id, None)
+        for order, by_bucket in self.keys.items():
+            key = (SORT_KEYS[order](activity), activity.id)
+            for bucket in buckets(activity):
+                keys = by_bucket.get(bucket, [])
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key: del keys[i]
+                if not keys: by_bucket.pop(bucket, None)
+
+    def _scan(self, order: ActivityOrder, filter: ActivityFilter, descending: bool, start: Optional[Key]) -> Iterator[Key]:
+        """The keys of activities in the filter's bucket in order, starting after `start` if given"""
+        keys = self.keys[order].get(filter.bucket, [])
+        lo, hi = 0, len(keys)
+        # When listing by date, a date range is a slice of the keys
+        if order == ActivityOrder.DATE:
+            if filter.after: lo = bisect_left(keys, (filter.after.timestamp(), -1))
+            if filter.before: hi = bisect_left(keys, (filter.before.timestamp(), -1))
+        if start is not None:
+            if descending: hi = min(hi, bisect_left(keys, start))
+            else: lo = max(lo, bisect_right(keys, start))
+        indices = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        for i in indices: yield keys[i]
+
+    def page(
+        self,
+        filter: ActivityFilter = ActivityFilter(),
+        order: ActivityOrder = ActivityOrder.DATE,
+        descending: bool = True,
+        cursor: Optional[str] = None,
+        limit: int = PAGE_SIZE,
+    ) -> ActivityPage:
+        """
+        A page of the activities matching a filter, e.g. the most recent first.
+        :param cursor: The `next` cursor of the previous page, or `None` for the first page
+        """
+        start = decode_cursor(cursor) if cursor else None
+        activities: list[SummaryActivity] = []
+        last: Optional[Key] = None
+        for key in self._scan(order, filter, descending, start):
+            activity = self.activities[key[1]]
+            if not filter.matches(activity): continue
+            if len(activities) == limit:
+                # There's at least one more, so the page has a next page
+                return ActivityPage(activities, encode_cursor(last)) # type: ignore last is set
+            activities.append(activity)
+            last = key
+        return ActivityPage(activities, None)
@@ -0,0 +1,95 @@
+"""
+The cities and countries an athlete has started activities in, found from a local table of
+cities (see `geodb_api.local`) rather than by asking GeoDB about each activity. New activities
+wait until the places are next asked for, and are then matched to cities together in one batch.
+The city of each activity is kept, so each activity is only ever matched once.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from geodb_api.local import CityTable
+from strava_api.models import SummaryActivity
+from .view import HistoryView
+
+
+@dataclass(frozen=True)
+class PlaceVisits:
+    """The activities started in a city or country"""
+    name: str
+    country: str                            # The country's name, the same as `name` for a country
+    activities: int
+    distance: float                         # Metres
+
+
+@dataclass(frozen=True)
+class PlacesSummary:
+    cities: list[PlaceVisits]               # Most activities first
+    countries: list[PlaceVisits]            # Most activities first
+    unknown: int                            # Activities that didn't start near any city
+
+
+class PlacesVisited(HistoryView):
+    """The city that each activity with a start location started in"""
+
+    city_of: dict[int, int]
+    """Row in the city table of each activity's city, or -1 if it's not near a city"""
+
+    def __init__(self):
+        self.city_of = {}
+        self.activities: dict[int, SummaryActivity] = {}
+        self._pending: dict[int, SummaryActivity] = {}
+        self._table: Optional[CityTable] = None
+
+    def add(self, activity: SummaryActivity) -> None:
+        if not activity.start_latlng: return
+        self.activities[activity.id] = activity
+        self.city_of.pop(activity.id, None)
+        self._pending[activity.id] = activity
+
+    def remove(self, activity: SummaryActivity) -> None:
+        self.activities.pop(activity.id, None)
+        self.city_of.pop(activity.id, None)
+        self._pending.pop(activity.id, None)
+
+    def resolve(self, table: CityTable) -> None:
+        """Matches every activity that hasn't been matched to a city yet, all at once"""
+        if table is not self._table:
+            # Rows of another table mean nothing in this one
+            self._table = table
+            self.city_of.clear()
+            self._pending = dict(self.activities)
+        if not self._pending: return
+        ids = list(self._pending)
+        points = np.array([self._pending[id].start_latlng for id in ids], np.float64)
+        rows, _ = table.nearest(points[:, 0], points[:, 1])
+        self.city_of.update(zip(ids, rows.tolist()))
+        self._pending.clear()
+
+    def summary(self, table: CityTable) -> PlacesSummary:
+        """The activities and distance in each city and country, using a table of cities"""
+        self.resolve(table)
+        ids = list(self.city_of)
+        rows = np.fromiter((self.city_of[id] for id in ids), np.int64, len(ids))
+        distance = np.fromiter((self.activities[id].distance or 0 for id in ids), np.float64, len(ids))
+        known = rows >= 0
+
+        cities, city_rows = np.unique(rows[known], return_inverse=True)
+        city_counts = np.bincount(city_rows, minlength=len(cities))
+        city_distance = np.bincount(city_rows, weights=distance[known], minlength=len(cities))
+        city_visits = [
+            PlaceVisits(table.names[row], table.country(table.country_codes[row]), int(n), float(d))
+            for row, n, d in zip(cities.tolist(), city_counts, city_distance)
+        ]
+
+        by_country: dict[str, tuple[int, float]] = {}
+        for row, n, d in zip(cities.tolist(), city_counts, city_distance):
+            count, total = by_country.get(table.country_codes[row], (0, 0.0))
+            by_country[table.country_codes[row]] = (count + int(n), total + float(d))
+        country_visits = [PlaceVisits(table.country(code), table.country(code), n, d) for code, (n, d) in by_country.items()]
+
+        most_first = lambda p: (-p.activities, -p.distance, p.name)
+        return PlacesSummary(sorted(city_visits, key=most_first), sorted(country_visits, key=most_first), int((~known).sum()))
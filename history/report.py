@@ -0,0 +1,173 @@
+"""
+Builds the monthly and yearly CO2, distance, and commute totals of every athlete with a stored
+history, e.g. for reports to members, without going through the server or the API. Histories
+come from syncs, or from archives imported with `python -m history.archive`. Athletes are
+summarised on a process pool, and each athlete's rows are saved as soon as they're done, so an
+interrupted run carries on with the athletes it hadn't finished. The rows of every athlete
+are then written to one CSV or NPZ file of columns.
+
+Run with `python -m history.report <out.csv|out.npz> [athlete ID ...]`.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import csv
+import os
+import sys
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from strava_api.models import SportType
+from . import DATA_DIR
+from .clusters import RouteClusters
+from .co2 import EmissionFactors, SPORT_CODES, co2_saved
+from .store import ActivityHistory
+
+# Athletes submitted to the pool ahead of those completed, per worker
+JOBS_PER_WORKER = 4
+
+# The columns of a report, in order. `month` is 0 in the row of a whole year
+COLUMNS = (
+    'athlete_id', 'year', 'month', 'activities', 'distance', 'co2',
+    'commutes', 'commute_distance', 'inferred_commutes',
+)
+
+Rows = dict[str, np.ndarray]
+"""A report's columns by name"""
+
+Progress = Callable[[int, int, float], None]
+
+
+def stored_athletes() -> list[int]:
+    """IDs of every athlete with a stored history"""
+    directory = os.path.join(DATA_DIR, 'activities')
+    if not os.path.isdir(directory): return []
+    return sorted(int(name.removesuffix('.pickle')) for name in os.listdir(directory) if name.removesuffix('.pickle').isdigit())
+
+
+def summarise(athlete_id: int, factors: EmissionFactors = EmissionFactors()) -> Rows:
+    """The monthly and yearly totals of one athlete's stored history"""
+    history = ActivityHistory.load(athlete_id)
+    activities = list(history.activities.values())
+    clusters = history.view(RouteClusters)
+    clusters.update()
+    inferred = clusters.likely_commutes()
+
+    distance = np.array([a.distance or 0 for a in activities], np.float64)
+    sport = np.array([SPORT_CODES.get(a.sport_type, SPORT_CODES[SportType.Workout]) for a in activities], np.intp)
+    marked = np.array([bool(a.commute) for a in activities], np.bool_)
+    guessed = np.array([a.id in inferred for a in activities], np.bool_) & ~marked
+    commute = marked | guessed
+    co2 = co2_saved(distance, sport, commute, factors)
+    year = np.array([a.start_date_local.year for a in activities], np.int64)
+    month = np.array([a.start_date_local.month for a in activities], np.int64)
+
+    # Each activity counts towards its month and its year, which is month 0
+    period = np.concatenate([year * 13 + month, year * 13])
+    keys, row = np.unique(period, return_inverse=True)
+    total = lambda values: np.bincount(row, weights=np.tile(values, 2), minlength=len(keys))
+    return {
+        'athlete_id': np.full(len(keys), athlete_id, np.int64),
+        'year': keys // 13,
+        'month': keys % 13,
+        'activities': total(np.ones(len(activities))).astype(np.int64),
+        'distance': total(distance),
+        'co2': total(co2),
+        'commutes': total(commute).astype(np.int64),
+        'commute_distance': total(distance * commute),
+        'inferred_commutes': total(guessed).astype(np.int64),
+    }
+
+
+def part_path(parts: str, athlete_id: int) -> str:
+    return os.path.join(parts, f'{athlete_id}.npz')
+
+def history_path(athlete_id: int) -> str:
+    return os.path.join(DATA_DIR, 'activities', f'{athlete_id}.pickle')
+
+def is_done(parts: str, athlete_id: int) -> bool:
+    """Whether an athlete's rows were saved by an earlier run, since their history last changed"""
+    part = part_path(parts, athlete_id)
+    return os.path.exists(part) and os.path.getmtime(part) >= os.path.getmtime(history_path(athlete_id))
+
+def summarise_to(parts: str, athlete_id: int) -> int:
+    """Saves the rows of one athlete in the run's directory of parts, returning the number of rows"""
+    rows = summarise(athlete_id)
+    path = part_path(parts, athlete_id)
+    # Write to a temporary file first so an interrupted run never leaves a half-written part
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, **rows)
+    os.replace(tmp, path)
+    return len(rows['athlete_id'])
+
+
+def write_rows(path: str, rows: Rows) -> None:
+    """Writes the columns of a report to a CSV or NPZ file, depending on its extension"""
+    if path.endswith('.npz'):
+        np.savez_compressed(path, **rows)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*(rows[c].tolist() for c in COLUMNS)))
+
+
+def build_report(
+    out: str,
+    athlete_ids: Optional[Iterable[int]] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Progress] = None,
+) -> Rows:
+    """
+    Summarises athletes and writes every athlete's rows to `out`, returning them.
+    Athletes summarised by an earlier run with the same `out` aren't summarised again,
+    unless their history has changed since.
+    :param athlete_ids: The athletes to include, defaults to every athlete with a stored history
+    :param workers: Number of processes summarising athletes, defaults to the number of CPUs
+    :param progress: Called with the number of athletes done, the total, and athletes per minute
+    """
+    athlete_ids = sorted(athlete_ids) if athlete_ids is not None else stored_athletes()
+    athlete_ids = [id for id in athlete_ids if os.path.exists(history_path(id))]
+    parts = f'{out}.parts'
+    os.makedirs(parts, exist_ok=True)
+    todo = [id for id in athlete_ids if not is_done(parts, id)]
+    total, done = len(athlete_ids), len(athlete_ids) - len(todo)
+    started, summarised = time.monotonic(), 0
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending: set[Future] = set()
+
+        def finish(futures) -> None:
+            nonlocal done, summarised
+            for f in futures:
+                pending.discard(f)
+                f.result()
+            done += len(futures)
+            summarised += len(futures)
+            if progress: progress(done, total, summarised / max(time.monotonic() - started, 1e-9) * 60)
+
+        for id in todo:
+            while len(pending) >= JOBS_PER_WORKER * workers:
+                finish(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending.add(pool.submit(summarise_to, parts, id))
+        finish(list(pending))
+
+    columns: dict[str, list[np.ndarray]] = {c: [] for c in COLUMNS}
+    for id in athlete_ids:
+        with np.load(part_path(parts, id)) as part:
+            for c in COLUMNS: columns[c].append(part[c])
+    rows = {c: np.concatenate(columns[c]) if athlete_ids else np.empty(0) for c in COLUMNS}
+    write_rows(out, rows)
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(f"Usage: python -m history.report <out.csv|out.npz> [athlete ID ...]")
+    out = sys.argv[1]
+    ids = [int(id) for id in sys.argv[2:]] or None
+    rows = build_report(out, ids, progress=lambda done, total, rate: print(f"\rSummarised {done}/{total} athletes, {rate:.0f} athletes/minute", end=''))
+    print(f"\nWrote {len(rows['athlete_id'])} rows to {out}")
@@ -0,0 +1,130 @@
+"""
+A grid index over the start and end points of activities, to find the activities
+near a point or within a map's bounds without looking at every activity.
+"""
+
+from __future__ import annotations
+from enum import StrEnum
+from math import asin, cos, degrees, floor, radians, sqrt, sin
+from typing import Iterator
+
+from strava_api.models import SummaryActivity
+from .view import HistoryView
+
+# Mean radius of the Earth in metres
+EARTH_RADIUS = 6_371_000
+
+# Size of a grid cell in degrees, ~2 km north to south
+CELL_DEGREES = 0.02
+
+Cell = tuple[int, int]
+Bounds = tuple[float, float, float, float]
+"""A bounding box of `(west, south, east, north)` in degrees"""
+
+
+class Endpoint(StrEnum):
+    """Which points of an activity to match against"""
+    START="start"
+    END="end"
+    EITHER="either"
+
+
+def distance(a: tuple[float, float], b: tuple[float, float]) -> float:
+    """The great-circle distance in metres between two `(latitude, longitude)` points"""
+    lat1, lon1, lat2, lon2 = map(radians, (*a, *b))
+    h = sin((lat2 - lat1) / 2)**2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * asin(min(1, sqrt(h)))
+
+def cell_of(lat: float, lon: float) -> Cell:
+    return floor(lat / CELL_DEGREES), floor(lon / CELL_DEGREES)
+
+
+class PointGrid:
+    """Points bucketed into grid cells, each point labelled with an activity ID"""
+
+    cells: dict[Cell, dict[int, tuple[float, float]]]
+
+    def __init__(self):
+        self.cells = {}
+
+    def add(self, id: int, point: tuple[float, float]) -> None:
+        self.cells.setdefault(cell_of(*point), {})[id] = point
+
+    def remove(self, id: int, point: tuple[float, float]) -> None:
+        cell = cell_of(*point)
+        bucket = self.cells.get(cell, {})
+        bucket.pop(id, None)
+        if not bucket: self.cells.pop(cell, None)
+
+    def _candidates(self, bounds: Bounds) -> Iterator[tuple[int, tuple[float, float]]]:
+        """Every point in the cells overlapping a bounding box"""
+        west, south, east, north = bounds
+        (i0, j0), (i1, j1) = cell_of(south, west), cell_of(north, east)
+        # The box may cross the antimeridian
+        j_ranges = [(j0, j1)] if west <= east else [(j0, cell_of(0, 180)[1]), (cell_of(0, -180)[1], j1)]
+        n_cells = (i1 - i0 + 1) * sum(b - a + 1 for a, b in j_ranges)
+
+        if n_cells > len(self.cells):
+            # The box covers more cells than are occupied, look at each occupied cell instead
+            for (i, j), bucket in self.cells.items():
+                if i0 <= i <= i1 and any(a <= j <= b for a, b in j_ranges):
+                    yield from bucket.items()
+            return
+
+        for i in range(i0, i1 + 1):
+            for a, b in j_ranges:
+                for j in range(a, b + 1):
+                    yield from self.cells.get((i, j), {}).items()
+
+    def within(self, bounds: Bounds) -> set[int]:
+        """IDs of points inside a bounding box"""
+        west, south, east, north = bounds
+        in_lon = (lambda lon: west <= lon <= east) if west <= east else (lambda lon: lon >= west or lon <= east)
+        return {id for id, (lat, lon) in self._candidates(bounds) if south <= lat <= north and in_lon(lon)}
+
+    def near(self, point: tuple[float, float], radius: float) -> set[int]:
+        """IDs of points within `radius` metres of a point"""
+        lat, lon = point
+        dlat = degrees(radius / EARTH_RADIUS)
+        # Near the poles the circle covers every longitude
+        coslat = cos(radians(min(abs(lat) + dlat, 90)))
+        dlon = 180 if coslat < 1e-9 else min(dlat / coslat, 180)
+        if dlon >= 180:
+            west, east = -180.0, 180.0
+        else:
+            wrap = lambda x: (x + 180) % 360 - 180
+            west, east = wrap(lon - dlon), wrap(lon + dlon)
+        bounds = (west, max(lat - dlat, -90), east, min(lat + dlat, 90))
+        return {id for id, p in self._candidates(bounds) if distance(point, p) <= radius}
+
+
+class SpatialIndex(HistoryView):
+    """Grids of the start and end points of every activity with a location"""
+
+    start: PointGrid
+    end: PointGrid
+
+    def __init__(self):
+        self.start = PointGrid()
+        self.end = PointGrid()
+
+    def add(self, activity: SummaryActivity) -> None:
+        if activity.start_latlng: self.start.add(activity.id, activity.start_latlng)
+        if activity.end_latlng: self.end.add(activity.id, activity.end_latlng)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        if activity.start_latlng: self.start.remove(activity.id, activity.start_latlng)
+        if activity.end_latlng: self.end.remove(activity.id, activity.end_latlng)
+
+    def _grids(self, endpoint: Endpoint) -> list[PointGrid]:
+        if endpoint == Endpoint.START: return [self.start]
+        if endpoint == Endpoint.END: return [self.end]
+        return [self.start, self.end]
+
+    def near(self, point: tuple[float, float], radius: float, endpoint: Endpoint = Endpoint.START) -> set[int]:
+        """IDs of activities starting (or ending) within `radius` metres of a point"""
+        return set().union(*(g.near(point, radius) for g in self._grids(endpoint)))
+
+    def within(self, bounds: Bounds, endpoint: Endpoint = Endpoint.START) -> set[int]:
+        """IDs of activities starting (or ending) inside a bounding box of `(west, south, east, north)`"""
+        return set().union(*(g.within(bounds) for g in self._grids(endpoint)))
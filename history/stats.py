@@ -0,0 +1,140 @@
+"""
+Running totals of an athlete's activities by sport and by week, month, year, and all time,
+updated as activities are added or removed. These replace Strava's `/athletes/{id}/stats`,
+which only totals runs, rides, and swims, and only counts activities visible to everyone.
+"""
+
+from __future__ import annotations
+from datetime import date, timedelta
+from enum import StrEnum
+import heapq
+from typing import Iterable, Optional
+
+from strava_api.models import ActivityStats, ActivityTotal, SportType, SummaryActivity
+from .view import HistoryView
+
+# The sports that Strava includes in its ride, run, and swim totals
+RIDE_SPORTS = (
+    SportType.Ride, SportType.MountainBikeRide, SportType.GravelRide, SportType.EBikeRide,
+    SportType.EMountainBikeRide, SportType.VirtualRide, SportType.Velomobile, SportType.Handcycle,
+)
+RUN_SPORTS = (SportType.Run, SportType.TrailRun, SportType.VirtualRun)
+SWIM_SPORTS = (SportType.Swim,)
+
+# The order of the values in each total, matching `ActivityTotal`
+FIELDS = ('count', 'distance', 'moving_time', 'elapsed_time', 'elevation_gain', 'achievement_count')
+
+
+class Period(StrEnum):
+    """The lengths of time that totals are kept for"""
+    WEEK="week"
+    MONTH="month"
+    YEAR="year"
+    ALL="all"
+
+def period_key(period: Period, day: date) -> tuple[int, ...]:
+    """Identifies the week (ISO), month, or year containing a day"""
+    if period == Period.WEEK: return tuple(day.isocalendar())[:2]
+    if period == Period.MONTH: return (day.year, day.month)
+    if period == Period.YEAR: return (day.year,)
+    return ()
+
+
+class LargestValue:
+    """The largest of a set of values labelled by ID, supporting removal"""
+
+    def __init__(self):
+        self.values: dict[int, float] = {}
+        self._heap: list[tuple[float, int]] = []
+
+    def set(self, id: int, value: float) -> None:
+        self.values[id] = value
+        heapq.heappush(self._heap, (-value, id))
+
+    def remove(self, id: int) -> None:
+        # Stale heap entries are discarded lazily by `max`
+        self.values.pop(id, None)
+
+    def max(self) -> float:
+        while self._heap and self.values.get(self._heap[0][1]) != -self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return -self._heap[0][0] if self._heap else 0
+
+
+class StatsEngine(HistoryView):
+    """Totals of every `SportType` for every week, month, and year, and for all time"""
+
+    totals: dict[tuple[Optional[str], Period, tuple[int, ...]], list[float]]
+    """Keyed by sport (`None` for all sports), period, and the period's key"""
+
+    def __init__(self):
+        self.totals = {}
+        self.biggest_ride_distance = LargestValue()
+        self.biggest_climb_elevation_gain = LargestValue()
+
+    def _update(self, activity: SummaryActivity, sign: int) -> None:
+        day = activity.start_date_local.date()
+        values = (
+            1,
+            activity.distance or 0,
+            activity.moving_time or 0,
+            activity.elapsed_time or 0,
+            activity.total_elevation_gain or 0,
+            activity.achievement_count or 0,
+        )
+        for period in Period:
+            key = period_key(period, day)
+            for sport in (activity.sport_type, None):
+                total = self.totals.setdefault((sport, period, key), [0] * len(FIELDS))
+                for i, v in enumerate(values): total[i] += sign * v
+                if total[0] <= 0: del self.totals[(sport, period, key)]
+
+    def add(self, activity: SummaryActivity) -> None:
+        self._update(activity, 1)
+        if activity.sport_type in RIDE_SPORTS:
+            self.biggest_ride_distance.set(activity.id, activity.distance or 0)
+            self.biggest_climb_elevation_gain.set(activity.id, activity.total_elevation_gain or 0)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        self._update(activity, -1)
+        self.biggest_ride_distance.remove(activity.id)
+        self.biggest_climb_elevation_gain.remove(activity.id)
+
+    def total(
+        self,
+        sports: Optional[Iterable[str]] = None,
+        period: Period = Period.ALL,
+        day: Optional[date] = None,
+    ) -> ActivityTotal:
+        """
+        The totals of some sports over the period containing a day.
+        :param sports: Sports to include, or all sports if `None`
+        :param day: A day in the period, defaults to today
+        """
+        key = period_key(period, day or date.today())
+        totals = [0] * len(FIELDS)
+        for sport in (sports if sports is not None else [None]):
+            for i, v in enumerate(self.totals.get((sport, period, key), ())): totals[i] += v
+        return ActivityTotal(*totals)
+
+    def recent(self, sports: Optional[Iterable[str]] = None, today: Optional[date] = None) -> ActivityTotal:
+        """The totals of some sports over the last four weeks, this one included"""
+        today = today or date.today()
+        weeks = [self.total(sports, Period.WEEK, today - timedelta(weeks=i)) for i in range(4)]
+        return ActivityTotal(**{f: sum(getattr(w, f) for w in weeks) for f in FIELDS})
+
+    def activity_stats(self, today: Optional[date] = None) -> ActivityStats:
+        """The totals in the same form as Strava's `/athletes/{id}/stats`, but counting every activity"""
+        return ActivityStats(
+            biggest_ride_distance=self.biggest_ride_distance.max(),
+            biggest_climb_elevation_gain=self.biggest_climb_elevation_gain.max(),
+            recent_ride_totals=self.recent(RIDE_SPORTS, today),
+            recent_run_totals=self.recent(RUN_SPORTS, today),
+            recent_swim_totals=self.recent(SWIM_SPORTS, today),
+            ytd_ride_totals=self.total(RIDE_SPORTS, Period.YEAR, today),
+            ytd_run_totals=self.total(RUN_SPORTS, Period.YEAR, today),
+            ytd_swim_totals=self.total(SWIM_SPORTS, Period.YEAR, today),
+            all_ride_totals=self.total(RIDE_SPORTS),
+            all_run_totals=self.total(RUN_SPORTS),
+            all_swim_totals=self.total(SWIM_SPORTS),
+        )
@@ -0,0 +1,180 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+import itertools
+import os
+import pickle
+import threading
+from typing import Callable, Iterable, Optional
+
+from apis import Priority, scheduling
+import strava_api as api
+from strava_api.models import SummaryActivity
+from . import DATA_DIR
+from .spatial import Bounds, Endpoint, SpatialIndex
+from .view import AnyView, HistoryView
+
+# Number of activities requested per page when syncing
+SYNC_PAGE_SIZE = 200
+
+class ActivityHistory:
+    """All of an athlete's activities that have been fetched so far, by activity ID"""
+
+    athlete_id: int
+    activities: dict[int, SummaryActivity]
+    synced: Optional[datetime]
+    """When the history was last completely up to date, or `None` if it never has been"""
+
+    def __init__(self, athlete_id: int):
+        self.athlete_id = athlete_id
+        self.activities = {}
+        self.synced = None
+        self._views: dict[type[HistoryView], HistoryView] = {}
+        self.lock = threading.RLock()
+        self._saved: Optional[float] = None
+        """Modification time of the history's file when this process last loaded or saved it"""
+
+    def view(self, type: type[AnyView]) -> AnyView:
+        """
+        Returns the view of the given type, creating it from the activities
+        already in the history if it doesn't exist yet.
+        """
+        with self.lock:
+            if type not in self._views:
+                view = type()
+                for a in self.activities.values(): view.add(a)
+                self._views[type] = view
+            return self._views[type] # type: ignore views are keyed by their own type
+
+    def add(self, activities: Iterable[SummaryActivity]) -> None:
+        """Adds activities, replacing any already in the history with the same ID"""
+        with self.lock:
+            for a in activities:
+                old = self.activities.get(a.id)
+                if old is not None:
+                    for view in self._views.values(): view.remove(old)
+                self.activities[a.id] = a
+                for view in self._views.values(): view.add(a)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """Removes activities by ID, ignoring any that aren't in the history"""
+        with self.lock:
+            for id in ids:
+                old = self.activities.pop(id, None)
+                if old is None: continue
+                for view in self._views.values(): view.remove(old)
+
+    def select(
+        self,
+        sport: Optional[str] = None,
+        near: Optional[tuple[tuple[float, float], float]] = None,
+        within: Optional[Bounds] = None,
+        endpoint: Endpoint = Endpoint.START,
+    ) -> list[SummaryActivity]:
+        """
+        Returns the activities matching all of the given filters, most recent first.
+        :param sport: Only activities of this sport type (case insensitive)
+        :param near: Only activities starting within a radius in metres of a point, as `((lat, lng), radius)`
+        :param within: Only activities starting inside a bounding box of `(west, south, east, north)`
+        :param endpoint: Whether `near` and `within` match the start, end, or either point of activities
+        """
+        with self.lock:
+            ids: Optional[set[int]] = None
+            if near is not None:
+                ids = self.view(SpatialIndex).near(*near, endpoint=endpoint)
+            if within is not None:
+                found = self.view(SpatialIndex).within(within, endpoint=endpoint)
+                ids = found if ids is None else ids & found
+            activities = self.activities.values() if ids is None else [self.activities[i] for i in ids]
+            if sport:
+                activities = [a for a in activities if a.sport_type.lower() == sport.lower()]
+            return sorted(activities, key=lambda a: a.start_date, reverse=True)
+
+    @property
+    def latest(self) -> Optional[SummaryActivity]:
+        """The most recently started activity in the history"""
+        with self.lock:
+            return max(self.activities.values(), key=lambda a: a.start_date, default=None)
+
+    def sync(self, client: api.Client, progress: Optional[Callable[[int], None]] = None) -> Optional[api.models.Fault]:
+        """
+        Fetches every activity started since the latest one in the history.
+        On the first sync this fetches the athlete's entire history.
+        Activities arrive oldest first and are added (and saved) a page at a time, so views show
+        partial results while a long sync runs, and an interrupted sync carries on where it stopped.
+        :param progress: Called with the number of activities fetched so far after each page
+        """
+        latest = self.latest
+        activities = api.iter_athlete_activities(client, after=latest.start_date if latest else None, per_page=SYNC_PAGE_SIZE)
+        fetched = 0
+        while True:
+            # The first page is what the user is waiting for, the rest of a long sync can wait its turn
+            with scheduling(priority=Priority.BULK if fetched else Priority.INTERACTIVE):
+                page = list(itertools.islice(activities, SYNC_PAGE_SIZE))
+            fault = next((a for a in page if isinstance(a, api.models.Fault)), None)
+            page = [a for a in page if not isinstance(a, api.models.Fault)]
+            if page:
+                self.add(page)
+                self.save()
+                fetched += len(page)
+                if progress: progress(fetched)
+            if fault: return fault
+            if len(page) < SYNC_PAGE_SIZE: break
+        self.synced = datetime.now(timezone.utc)
+
+    @property
+    def path(self) -> str:
+        """The file the history is saved to"""
+        return os.path.join(DATA_DIR, 'activities', f'{self.athlete_id}.pickle')
+
+    def save(self) -> None:
+        """Saves the activities to disk, so they are kept when the server restarts"""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write to a temporary file first so a crash, or another worker process saving at the
+            # same time, never leaves a half-written history
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(list(self.activities.values()), f)
+            os.replace(tmp, self.path)
+            self._saved = os.path.getmtime(self.path)
+
+    def refresh(self) -> None:
+        """
+        Adds activities saved to the history's file by another process since this one last loaded
+        or saved it, e.g. by another worker's sync or by `python -m history.archive`, so that they
+        aren't lost the next time this process saves. Activities are never removed by a refresh.
+        """
+        try:
+            modified = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return
+        if modified == self._saved: return
+        with self.lock:
+            if modified == self._saved: return
+            with open(self.path, 'rb') as f:
+                saved: list[SummaryActivity] = pickle.load(f)
+            self._saved = modified
+            self.add([a for a in saved if self.activities.get(a.id) != a])
+
+    @classmethod
+    def load(cls, athlete_id: int) -> ActivityHistory:
+        """Loads an athlete's saved history, or returns an empty history if none is saved"""
+        history = cls(athlete_id)
+        history.refresh()
+        return history
+
+
+_histories: dict[int, ActivityHistory] = {}
+_histories_lock = threading.Lock()
+
+def history_for(athlete_id: int) -> ActivityHistory:
+    """
+    Returns the history of the given athlete, shared by every request in this process,
+    with any activities saved by other processes since it was loaded, see `ActivityHistory.refresh`
+    """
+    with _histories_lock:
+        if athlete_id not in _histories:
+            _histories[athlete_id] = ActivityHistory.load(athlete_id)
+        history = _histories[athlete_id]
+    history.refresh()
+    return history
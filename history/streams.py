@@ -0,0 +1,185 @@
+"""
+Append-only columnar storage of activity streams (the per-second samples of an activity).
+Each athlete has a directory holding one file per column, with the samples of every
+stored activity appended one after another, and an index of where each activity's
+samples start. Columns are read through memory maps, so the samples of one activity,
+or of every activity at once, can be used as numpy arrays without copying them.
+Every worker process may append to the same store, so appends hold a lock on the store's
+`lock` file, and each process reads the activities the others have appended from the index.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import threading
+from typing import Iterable, Iterator, Optional, Union
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where only one process should use a store
+    fcntl = None
+
+from apis import Priority, scheduling
+import strava_api as api
+from strava_api.models import StreamSet, StreamType
+from . import DATA_DIR
+
+# Column name, data type, and the stream (and element of each sample) the column is taken from
+COLUMNS: dict[str, tuple[str, StreamType, Optional[int]]] = {
+    'time': ('<i4', StreamType.time, None),
+    'lat': ('<f8', StreamType.latlng, 0),
+    'lng': ('<f8', StreamType.latlng, 1),
+    'distance': ('<f4', StreamType.distance, None),
+    'altitude': ('<f4', StreamType.altitude, None),
+    'velocity': ('<f4', StreamType.velocity_smooth, None),
+    'heartrate': ('<f4', StreamType.heartrate, None),
+    'watts': ('<f4', StreamType.watts, None),
+}
+
+# Each index record is (activity ID, offset of the first sample, number of samples)
+INDEX_DTYPE = np.dtype([('id', '<i8'), ('offset', '<i8'), ('length', '<i8')])
+
+# Maximum number of stream requests in flight at once when fetching many activities
+MAX_CONCURRENT_FETCHES = 4
+
+
+def to_columns(streams: StreamSet) -> dict[str, np.ndarray]:
+    """Converts a `StreamSet` to equal length columns, filling streams that weren't recorded with NaN (or 0 for time)"""
+    length = max((len(s.data) for s in (getattr(streams, f) for f in StreamType) if s), default=0)
+    columns = {}
+    for name, (dtype, type, element) in COLUMNS.items():
+        stream = getattr(streams, type)
+        column = np.zeros(length, dtype) if np.dtype(dtype).kind == 'i' else np.full(length, np.nan, dtype)
+        if stream and stream.data:
+            data = np.asarray(stream.data, dtype=np.float64)
+            data = data[:, element] if element is not None and data.ndim == 2 else data
+            column[:len(data)] = data
+        columns[name] = column
+    return columns
+
+
+class StreamStore:
+    """The stored streams of one athlete's activities"""
+
+    path: str
+    index: dict[int, tuple[int, int]]
+    """Offset and number of samples of each stored activity"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._maps: dict[str, np.ndarray] = {}
+        self.index = {}
+        self.size = 0
+        self._records = 0
+        """Number of index records read so far"""
+        os.makedirs(path, exist_ok=True)
+        with self.lock, self._locked():
+            self._read_index()
+            self._truncate()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name + ('.idx' if name == 'index' else '.bin'))
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Holds the store's lock file, so no other process appends meanwhile"""
+        with open(os.path.join(self.path, 'lock'), 'ab') as f:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self) -> None:
+        """Reads the index records appended since the index was last read, e.g. by other processes"""
+        if not os.path.exists(self._file('index')): return
+        records = np.fromfile(self._file('index'), INDEX_DTYPE, offset=self._records * INDEX_DTYPE.itemsize)
+        for r in records:
+            self.index[int(r['id'])] = (int(r['offset']), int(r['length']))
+            self.size = max(self.size, int(r['offset'] + r['length']))
+        self._records += len(records)
+
+    def _truncate(self) -> None:
+        """Drops anything written after the last indexed activity, e.g. by an interrupted append"""
+        for name, (dtype, _, _) in COLUMNS.items():
+            with open(self._file(name), 'ab') as f:
+                f.truncate(self.size * np.dtype(dtype).itemsize)
+
+    def refresh(self) -> None:
+        """Adds the activities that other processes have appended to the index"""
+        with self.lock:
+            self._read_index()
+
+    def __contains__(self, id: int) -> bool:
+        return id in self.index
+
+    def append(self, id: int, streams: Union[StreamSet, dict[str, np.ndarray]]) -> None:
+        """Stores the streams of an activity. Activities that are already stored are left unchanged."""
+        columns = to_columns(streams) if isinstance(streams, StreamSet) else streams
+        length = len(next(iter(columns.values()), []))
+        with self.lock, self._locked():
+            self._read_index()
+            if id in self.index: return
+            self._truncate()
+            for name, (dtype, _, _) in COLUMNS.items():
+                with open(self._file(name), 'ab') as f:
+                    f.write(np.asarray(columns[name], dtype).tobytes())
+            # The index is written last, so a partly written activity is never visible
+            with open(self._file('index'), 'ab') as f:
+                f.write(np.array([(id, self.size, length)], INDEX_DTYPE).tobytes())
+            self.index[id] = (self.size, length)
+            self.size += length
+            self._records += 1
+
+    def column(self, name: str) -> np.ndarray:
+        """A read-only memory map of a column across every stored activity"""
+        with self.lock:
+            column = self._maps.get(name)
+            if column is None or len(column) != self.size:
+                dtype = COLUMNS[name][0]
+                column = np.memmap(self._file(name), dtype, 'r', shape=(self.size,)) if self.size else np.empty(0, dtype)
+                self._maps[name] = column
+            return column
+
+    def streams(self, id: int) -> Optional[dict[str, np.ndarray]]:
+        """Views of the columns of one activity, or `None` if it isn't stored"""
+        if id not in self.index: return
+        offset, length = self.index[id]
+        return {name: self.column(name)[offset:offset + length] for name in COLUMNS}
+
+    def fetch(
+        self,
+        client: api.Client,
+        ids: Iterable[int],
+        max_workers: int = MAX_CONCURRENT_FETCHES,
+        priority: Priority = Priority.BULK,
+    ) -> list[api.models.Fault]:
+        """
+        Fetches and stores the streams of every activity that isn't stored yet,
+        with at most `max_workers` requests in flight. Returns any faults.
+        """
+        def fetch_one(id: int) -> Optional[api.models.Fault]:
+            with scheduling(priority=priority):
+                streams = api.get_activity_streams(client, id)
+            if isinstance(streams, api.models.Fault): return streams
+            self.append(id, streams)
+
+        self.refresh()
+        missing = [id for id in dict.fromkeys(ids) if id not in self]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return [f for f in pool.map(fetch_one, missing) if f is not None]
+
+
+_stores: dict[int, StreamStore] = {}
+_stores_lock = threading.Lock()
+
+def stream_store_for(athlete_id: int) -> StreamStore:
+    """Returns the stream store of the given athlete, shared by every request in this process"""
+    with _stores_lock:
+        if athlete_id not in _stores:
+            _stores[athlete_id] = StreamStore(os.path.join(DATA_DIR, 'streams', str(athlete_id)))
+        return _stores[athlete_id]
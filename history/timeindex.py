@@ -0,0 +1,147 @@
+"""
+An athlete's activities sorted by start time, with prefix sums of their totals, so that
+the totals of any date range are two binary searches and a subtraction, and the
+activities in a date range are a slice of the sorted arrays.
+"""
+
+from __future__ import annotations
+from datetime import datetime
+from typing import Optional
+import numpy as np
+
+from strava_api.models import ActivityTotal, SummaryActivity
+from .stats import FIELDS
+from .view import HistoryView
+
+
+class PrefixSums:
+    """
+    Activities sorted by start time (in seconds since the epoch) with a running total of each of `FIELDS`.
+    Arrays have spare capacity at the end, so activities arriving in time order are appended in
+    constant time. Inserting or removing anywhere else shifts the later rows and recomputes their sums.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.n = 0
+        self._time = np.zeros(capacity, np.int64)
+        self._id = np.zeros(capacity, np.int64)
+        self._values = np.zeros((capacity, len(FIELDS)))
+        # Prefixed with a row of zeros so that _prefix[i] is the total of the first i activities
+        self._prefix = np.zeros((capacity + 1, len(FIELDS)))
+
+    @property
+    def time(self) -> np.ndarray: return self._time[:self.n]
+    @property
+    def id(self) -> np.ndarray: return self._id[:self.n]
+    @property
+    def values(self) -> np.ndarray: return self._values[:self.n]
+    @property
+    def prefix(self) -> np.ndarray: return self._prefix[:self.n + 1]
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._time)
+        for name in ('_time', '_id', '_values'):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+        prefix = np.zeros((capacity + 1, len(FIELDS)))
+        prefix[:self.n + 1] = self._prefix[:self.n + 1]
+        self._prefix = prefix
+
+    def _recompute(self, start: int) -> None:
+        """Recomputes the prefix sums after row `start`"""
+        self._prefix[start + 1:self.n + 1] = self._prefix[start] + np.cumsum(self._values[start:self.n], axis=0)
+
+    def insert(self, time: int, id: int, values: np.ndarray) -> None:
+        if self.n == len(self._time): self._grow()
+        i = int(np.searchsorted(self.time, time, 'right'))
+        # Shift any later activities along one row
+        self._time[i + 1:self.n + 1] = self._time[i:self.n]
+        self._id[i + 1:self.n + 1] = self._id[i:self.n]
+        self._values[i + 1:self.n + 1] = self._values[i:self.n]
+        self._time[i], self._id[i], self._values[i] = time, id, values
+        self.n += 1
+        self._recompute(i)
+
+    def remove(self, time: int, id: int) -> None:
+        lo, hi = np.searchsorted(self.time, time, 'left'), np.searchsorted(self.time, time, 'right')
+        matches = np.flatnonzero(self._id[lo:hi] == id)
+        if not len(matches): return
+        i = int(lo + matches[0])
+        self._time[i:self.n - 1] = self._time[i + 1:self.n]
+        self._id[i:self.n - 1] = self._id[i + 1:self.n]
+        self._values[i:self.n - 1] = self._values[i + 1:self.n]
+        self.n -= 1
+        self._recompute(i)
+
+    def bounds(self, start: Optional[int], end: Optional[int]) -> tuple[int, int]:
+        """The rows of activities starting in `[start, end)`"""
+        lo = 0 if start is None else int(np.searchsorted(self.time, start, 'left'))
+        hi = self.n if end is None else int(np.searchsorted(self.time, end, 'left'))
+        return lo, max(lo, hi)
+
+
+def timestamp(t: Optional[datetime]) -> Optional[int]:
+    return None if t is None else int(t.timestamp())
+
+
+class TimeIndex(HistoryView):
+    """Prefix sums of activities by start time, for all activities and for each sport"""
+
+    all: PrefixSums
+    by_sport: dict[str, PrefixSums]
+
+    def __init__(self):
+        self.all = PrefixSums()
+        self.by_sport = {}
+
+    def _sums(self, sport: Optional[str]) -> Optional[PrefixSums]:
+        return self.all if sport is None else self.by_sport.get(sport)
+
+    def add(self, activity: SummaryActivity) -> None:
+        values = np.array([
+            1,
+            activity.distance or 0,
+            activity.moving_time or 0,
+            activity.elapsed_time or 0,
+            activity.total_elevation_gain or 0,
+            activity.achievement_count or 0,
+        ], dtype=np.float64)
+        time = int(activity.start_date.timestamp())
+        self.all.insert(time, activity.id, values)
+        self.by_sport.setdefault(activity.sport_type, PrefixSums()).insert(time, activity.id, values)
+
+    def remove(self, activity: SummaryActivity) -> None:
+        time = int(activity.start_date.timestamp())
+        self.all.remove(time, activity.id)
+        sums = self.by_sport.get(activity.sport_type)
+        if sums: sums.remove(time, activity.id)
+
+    def total(self, start: Optional[datetime] = None, end: Optional[datetime] = None, sport: Optional[str] = None) -> ActivityTotal:
+        """The totals of activities (of one sport, if given) starting from `start` up to but not including `end`"""
+        sums = self._sums(sport)
+        if sums is None: return ActivityTotal()
+        lo, hi = sums.bounds(timestamp(start), timestamp(end))
+        totals = sums.prefix[hi] - sums.prefix[lo]
+        return ActivityTotal(*(float(v) if f in ('distance', 'elevation_gain') else round(v) for f, v in zip(FIELDS, totals)))
+
+    def slice(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        sport: Optional[str] = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The start times, IDs, and values (in the order of `FIELDS`) of activities (of one sport, if given)
+        starting in a date range, oldest first.
+        These are views of the index rather than copies, so are only valid until the next change.
+        """
+        sums = self._sums(sport)
+        if sums is None: return np.empty(0, np.int64), np.empty(0, np.int64), np.empty((0, len(FIELDS)))
+        lo, hi = sums.bounds(timestamp(start), timestamp(end))
+        return sums.time[lo:hi], sums.id[lo:hi], sums.values[lo:hi]
+
+    def ids(self, start: Optional[datetime] = None, end: Optional[datetime] = None, sport: Optional[str] = None) -> np.ndarray:
+        """The IDs of activities starting in a date range, oldest first, as a view like `slice`"""
+        return self.slice(start, end, sport)[1]
@@ -0,0 +1,22 @@
+from abc import ABC, abstractmethod
+from typing import TypeVar
+
+from strava_api.models import SummaryActivity
+
+class HistoryView(ABC):
+    """
+    A structure derived from an athlete's activities, e.g. an index or running totals.
+    A view is told about every activity that is added to or removed from the history,
+    so it can update itself incrementally rather than being rebuilt.
+    An edited activity is removed and then added again.
+    """
+
+    @abstractmethod
+    def add(self, activity: SummaryActivity) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove(self, activity: SummaryActivity) -> None:
+        raise NotImplementedError()
+
+AnyView = TypeVar('AnyView', bound=HistoryView)
@@ -0,0 +1,111 @@
+"""
+Fetches what the first pages after a user connects their Strava account will need, i.e.
+their athlete, stats, first page of activities, and home city, on a background thread
+as soon as they authorize, so the redirect and the plots are served from warm data.
+Pages get the athlete with `athlete_for`, which uses the warm data while it's fresh.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+import dataclasses
+from dataclasses import dataclass
+import hashlib
+import threading
+import time
+from typing import Optional, Union
+
+from apis import scheduling
+import strava_api as api
+import geodb_api as geodb
+from .jobs import Job, job_queue, sync_in_background
+
+# Seconds that warm data is used for before it's fetched again
+WARM_TTL = 600
+
+# Seconds after which a warm-up gives up on anything it hasn't fetched yet. Each request also
+# gives up after `apis.transport.READ_TIMEOUT`, so a hung request can't outlast it by much.
+WARMUP_TIMEOUT = 30
+
+# Refresh tokens whose athlete is remembered, the least recently used are forgotten first
+MAX_TOKENS = 10_000
+
+
+@dataclass(frozen=True)
+class WarmAthlete:
+    athlete: api.models.Athlete
+    fetched: float                                      # When the athlete was fetched, from `time.time()`
+    stats: Optional[api.models.ActivityStats] = None    # Strava's totals, used until the history is synced
+    home_city: Optional[geodb.models.PopulatedPlaceSummary] = None # The city on the athlete's profile
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.fetched < WARM_TTL
+
+
+_warm: dict[int, WarmAthlete] = {}
+_athlete_ids: OrderedDict[str, int] = OrderedDict()
+"""The athlete of each recently used refresh token, least recently used first"""
+_warm_lock = threading.Lock()
+
+def warm(athlete_id: int) -> Optional[WarmAthlete]:
+    """The warm data of an athlete, or `None` if there is none or it's stale"""
+    with _warm_lock:
+        data = _warm.get(athlete_id)
+    return data if data and data.fresh else None
+
+def _update(athlete_id: int, **fields) -> None:
+    with _warm_lock:
+        if athlete_id in _warm: _warm[athlete_id] = dataclasses.replace(_warm[athlete_id], **fields)
+
+def athlete_for(client: api.Client) -> Union[api.models.Athlete, api.models.Fault]:
+    """The client's athlete, fetched only if there's no fresh warm copy"""
+    with _warm_lock:
+        id = _athlete_ids.get(client.tokens.refresh)
+        if id is not None: _athlete_ids.move_to_end(client.tokens.refresh)
+    data = warm(id) if id is not None else None
+    if data:
+        client.athlete_id = data.athlete.id
+        return data.athlete
+
+    athlete = api.get_athlete(client)
+    if isinstance(athlete, api.models.Fault): return athlete
+    with _warm_lock:
+        _athlete_ids[client.tokens.refresh] = athlete.id
+        _athlete_ids.move_to_end(client.tokens.refresh)
+        while len(_athlete_ids) > MAX_TOKENS:
+            # The athlete's warm data goes too, it's fetched again if another of their tokens is used
+            _, forgotten = _athlete_ids.popitem(last=False)
+            _warm.pop(forgotten, None)
+        old = _warm.get(athlete.id)
+        _warm[athlete.id] = WarmAthlete(athlete, time.time()) if old is None else dataclasses.replace(old, athlete=athlete, fetched=time.time())
+    return athlete
+
+
+def warm_up(client: api.Client) -> Job:
+    """Starts fetching the athlete's data in the background, unless it's already fresh"""
+    # The job table is on disk, so don't put the token itself in the key
+    key = 'warmup:' + hashlib.sha256(client.tokens.refresh.encode()).hexdigest()[:16]
+
+    def run(_) -> Optional[api.models.Fault]:
+        deadline = time.monotonic() + WARMUP_TIMEOUT
+        with _warm_lock:
+            id = _athlete_ids.get(client.tokens.refresh)
+        data = warm(id) if id is not None else None
+        if data and data.stats is not None: return
+
+        athlete = athlete_for(client)
+        if isinstance(athlete, api.models.Fault): return athlete
+        # Fetches the first page of activities first, then the rest of the history
+        sync_in_background(client, athlete.id)
+
+        if time.monotonic() > deadline: return api.models.Fault([], "Warm-up timed out")
+        stats = api.get_athlete_stats(client, athlete.id)
+        if not isinstance(stats, api.models.Fault): _update(athlete.id, stats=stats)
+
+        if not athlete.city: return
+        if time.monotonic() > deadline: return api.models.Fault([], "Warm-up timed out")
+        with scheduling(athlete.id):
+            city = geodb.find_city_by_name(athlete.city, athlete.state, athlete.country)
+        if not isinstance(city, geodb.models.Error): _update(athlete.id, home_city=city)
+
+    return job_queue().submit(key, run)
@@ -1,12 +1,81 @@
+import base64
+from typing import Any, Iterable, Optional
 import dash
 from dash import Dash
+import numpy as np
+import plotly.graph_objects as go
+import strava_api as api
+import history
 
-def make_layout(unique_plot_name: str):
+# Trace attributes which hold plain numeric arrays and can be sent as typed arrays
+TYPED_ARRAY_KEYS = ('lat', 'lon', 'x', 'y', 'z', 'r', 'theta', 'customdata')
+
+# Coordinates are rounded to this many degrees (~11 m) before encoding
+COORDINATE_QUANTUM = 1e-4
+
+# Milliseconds between redrawing a plot while the athlete's history is syncing
+SYNC_POLL_INTERVAL = 2000
+
+# Milliseconds before showing the loading spinner, so quick redraws while syncing don't flash it
+LOADING_DELAY = 500
+
+def make_layout(unique_plot_name: str, poll_sync: bool = False):
     # Bare-bones page layout to display and update the plot
     return dash.dcc.Loading(children=[
         dash.dcc.Location(id='url', refresh=False),
         dash.dcc.Graph(id=unique_plot_name, config=dict(displayModeBar=False)),
-    ], className='plot-container')
+    ] + ([sync_poller(unique_plot_name)] if poll_sync else []), className='plot-container', delay_show=LOADING_DELAY)
+
+def sync_poller(unique_plot_name: str) -> dash.dcc.Interval:
+    """
+    Triggers a plot's callback every `SYNC_POLL_INTERVAL` while the athlete's history syncs.
+    The callback should take `Input(f'{unique_plot_name}-sync', 'n_intervals')` and return
+    whether the sync has finished to `Output(f'{unique_plot_name}-sync', 'disabled')`.
+    """
+    return dash.dcc.Interval(id=f'{unique_plot_name}-sync', interval=SYNC_POLL_INTERVAL)
+
+def sync_for_plot(client: api.Client, athlete_id: int, unique_plot_name: str) -> history.Job:
+    """
+    Starts syncing an athlete's history in the background when a plot first loads.
+    Later calls from the plot's poller only check on the sync, so a finished sync isn't started again.
+    """
+    if dash.ctx.triggered_id == f'{unique_plot_name}-sync':
+        job = history.job_status(history.sync_key(athlete_id))
+        if job: return job
+    return history.sync_in_background(client, athlete_id)
+
+def typed_array(values: Iterable[float], dtype: str = 'f4', quantum: Optional[float] = None) -> dict[str, str]:
+    """
+    Encodes numeric values as a plotly.js typed array, i.e. `{'dtype': ..., 'bdata': ...}`
+    holding the base64 of the raw little-endian buffer. This is far smaller than a JSON list
+    of floats, and plotly.js can use the buffer without parsing each number.
+    :param quantum: If set, round values to a multiple of this before encoding
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    if quantum:
+        arr = np.round(arr / quantum) * quantum
+    arr = np.ascontiguousarray(arr, dtype=np.dtype(dtype).newbyteorder('<'))
+    return dict(dtype=dtype, bdata=base64.b64encode(arr.tobytes()).decode('ascii'))
+
+def compact_figure(fig: go.Figure) -> dict[str, Any]:
+    """
+    Converts a figure to a dict with every numeric data array sent as a float32 typed array,
+    and latitudes/longitudes quantised to `COORDINATE_QUANTUM`. Return this from a callback
+    instead of the figure itself to shrink the payload sent to the browser.
+    """
+    d = fig.to_dict()
+    for trace in d.get('data', []):
+        for key in TYPED_ARRAY_KEYS:
+            values = trace.get(key)
+            # Leave strings, dates, and already-encoded arrays alone
+            if values is None or isinstance(values, dict): continue
+            arr = np.asarray(values)
+            if arr.ndim != 1 or arr.dtype.kind not in 'iuf': continue
+            quantum = COORDINATE_QUANTUM if key in ('lat', 'lon') else None
+            # Integers too large for float32 (e.g. activity IDs) stay exact as float64
+            dtype = 'f8' if arr.dtype.kind in 'iu' and arr.size and np.abs(arr).max() > 2**24 else 'f4'
+            trace[key] = typed_array(arr, dtype, quantum)
+    return d
 
 app = Dash(__name__, use_pages=True, pages_folder='plots/', server=False, url_base_pathname='/plots/')
 app.layout = dash.page_container
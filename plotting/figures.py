@@ -0,0 +1,321 @@
+"""
+Builds the figures of the plots from an athlete's history, without any Dash callbacks, so the
+same figures can be drawn by the pages in `plots/` or embedded straight into the profile page.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+import dataclasses
+from datetime import date
+from math import asin
+import json
+import threading
+from typing import Any, Iterable, Optional, Union
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import apis
+import strava_api as api
+import geodb_api as geodb
+import history
+from history.stats import RIDE_SPORTS, RUN_SPORTS, SWIM_SPORTS
+from . import compact_figure
+
+# Past this projection scale only the activities in view are sent
+ZOOMED_IN_SCALE = 2
+
+
+def sport_types(sport: str) -> Optional[list[api.models.SportType]]:
+    """The sport types matching a `?sport=` query parameter, or `None` for every sport"""
+    return [t for t in api.models.SportType if t.lower() == sport.lower()] if sport else None
+
+
+def activity_clock(
+    activity_history: history.ActivityHistory,
+    sport: str = '',
+    after: Optional[date] = None,
+    before: Optional[date] = None,
+) -> go.Figure:
+    """The number of activities started in each hour of the day"""
+    # The sync adds to the clock's counts on another thread
+    with activity_history.lock:
+        hist = activity_history.view(history.ActivityClock).hours(sport_types(sport), after, before)
+
+    # The following question was super helpful for this:
+    # https://stackoverflow.com/questions/72595317/is-it-possible-to-generate-a-clock-chart-using-plotly
+    fig = go.Figure()
+    fig.add_trace(go.Barpolar(
+        r=hist,
+        offset=0.5,
+        customdata=np.arange(24),
+        hovertemplate="%{r} activities at %{customdata:02}:00<extra></extra>",
+    ))
+    fig.update_layout(
+        margin=dict(l=20, t=20, r=20, b=20),
+        polar=dict(
+            hole=0.4,
+            bgcolor='rgba(255,255,255,0.3)',
+            radialaxis=dict(
+                showticklabels=False,
+                showgrid=False,
+            ),
+            angularaxis=dict(
+                tickvals=np.arange(0, 360, 360/24),
+                ticktext=[f'{i:02}' if i % 6 == 0 else '' for i in range(24)],
+                direction='clockwise',
+                period=24,
+            )
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+    )
+    return fig
+
+
+def activity_map(
+    activity_history: history.ActivityHistory,
+    sport: str = '',
+    relayout: Optional[dict[str, Any]] = None,
+    uirevision: str = 'activitymap',
+) -> dict[str, Any]:
+    """
+    The start locations of activities on a globe, as a compact figure.
+    :param relayout: The globe's `relayoutData`, when zoomed in only the activities in view are sent
+    :param uirevision: Keeps the user's view when the figure is redrawn
+    """
+    # When zoomed in, the orthographic globe shows a circle around its centre whose
+    # angular radius is asin(1 / scale)
+    relayout = relayout or {}
+    scale = relayout.get('geo.projection.scale', 1)
+    center = (relayout.get('geo.projection.rotation.lat', 0), relayout.get('geo.projection.rotation.lon', 0))
+    near = None
+    if scale > ZOOMED_IN_SCALE:
+        near = (center, asin(1 / scale) * history.spatial.EARTH_RADIUS)
+
+    # Activities without GPS have no start location
+    activities = [a for a in activity_history.select(sport=sport, near=near) if a.start_latlng]
+    locations = [geodb.models.LatLong(*a.start_latlng) for a in activities]
+
+    # Labels are not sent with the figure, the activity ID is kept in `customdata` so
+    # the label can be looked up when a marker is hovered.
+    fig = go.Figure()
+    fig.add_trace(go.Scattergeo(
+        mode='markers',
+        lon=[l.longitude for l in locations],
+        lat=[l.latitude for l in locations],
+        customdata=[a.id for a in activities],
+        hoverinfo='none',
+    ))
+    fig.update_layout(
+        margin={'l':0,'t':0,'b':0,'r':0},
+        geo = dict(
+            projection_type = 'orthographic',
+            showland = True,
+        ),
+        uirevision=uirevision,
+    )
+    return compact_figure(fig)
+
+
+def activity_label(activity: api.models.SummaryActivity) -> str:
+    """What's shown when an activity's marker is hovered"""
+    return activity.name + ' ' + activity.start_date_local.strftime('%d %b %H:%M')
+
+
+# Starting cities whose destinations are kept, so redraws don't ask GeoDB again
+DESTINATIONS_CACHE_SIZE = 1024
+
+_destinations: OrderedDict[tuple[geodb.models.ID, int], list[geodb.models.PopulatedPlaceSummary]] = OrderedDict()
+_destinations_lock = threading.Lock()
+
+def destinations(user_city: geodb.models.PopulatedPlaceSummary, search_radius: float) -> list[geodb.models.PopulatedPlaceSummary]:
+    """
+    Cities to compare a distance with, and their distances from the user's city. These are
+    kept for each city and search radius, unless GeoDB returned an error for any of them.
+    :param search_radius: km around the user's city to look for cities in
+    """
+    nearby = search_radius < geodb.MAX_NEARBY_RADIUS
+    # Past the nearby radius the same cities are used whatever the distance
+    key = (user_city.id, int(search_radius) if nearby else -1)
+    with _destinations_lock:
+        cached = _destinations.get(key)
+        if cached is not None:
+            _destinations.move_to_end(key)
+            return cached
+
+    if nearby:
+        # Find nearby cities to the user's location
+        cities = geodb.places_near_place(
+            user_city.id,
+            geodb.NearbyPlacesParameters(
+                radius=int(search_radius),
+                sort=geodb.models.SortBy.POPULATION_DEC,
+                types=[geodb.models.PopulatedPlaceType.CITY],
+            ),
+            max_results=20
+        )
+        complete = not any(isinstance(c, geodb.models.Error) for c in cities)
+    else:
+        # If outside the maximum search radius, use the most populous cities in the same country
+        cities = geodb.find_places(
+            geodb.FindPlacesParameters(
+                countryIds=[user_city.countryCode],
+                sort=geodb.models.SortBy.POPULATION_DEC,
+                types=[geodb.models.PopulatedPlaceType.CITY],
+            ),
+            max_results=10
+        )
+        complete = not any(isinstance(c, geodb.models.Error) for c in cities)
+        # Get distances to all the cities
+        for i, city in enumerate(cities):
+            if isinstance(city, geodb.models.Error): continue
+            res = geodb.place_distance(user_city.id, city.id)
+            if isinstance(res, geodb.models.Error):
+                complete = False
+            else:
+                cities[i] = dataclasses.replace(city, distance=res)
+
+    found = [c for c in cities if not isinstance(c, geodb.models.Error)]
+    if complete:
+        with _destinations_lock:
+            _destinations[key] = found
+            while len(_destinations) > DESTINATIONS_CACHE_SIZE: _destinations.popitem(last=False)
+    return found
+
+
+def distance_map(
+    athlete: api.models.Athlete,
+    activity_history: history.ActivityHistory,
+    sport: str = '',
+    location: Optional[dict[str, float]] = None,
+) -> Optional[tuple[go.Figure, str]]:
+    """
+    A line from the athlete's city to a city as far away as they've travelled, and a description
+    of it, or `None` if there's nothing to compare yet or no city could be found.
+    :param location: The browser's geolocation, used as the starting city if given
+    """
+    # Requests to GeoDB are queued fairly with other athletes' requests
+    with apis.scheduling(athlete.id):
+        # For the starting city, first try using the user's current location.
+        user_city: Union[geodb.models.PopulatedPlaceSummary, geodb.models.Error]
+        user_city = geodb.models.Error(geodb.models.ErrorCode.ENTITY_NOT_FOUND, "")
+        if location and location.get('lat') and location.get('lon'):
+            user_city = geodb.find_places(
+                geodb.FindPlacesParameters(
+                    location=geodb.models.LatLong(location['lat'], location['lon']),
+                    radius=100,
+                    types=[geodb.models.PopulatedPlaceType.CITY],
+                ),
+                max_results=1
+            )[0]
+
+        # If the location isn't available, see if the user has a location on their
+        # Strava profile, which is looked up when they authorize.
+        if isinstance(user_city, geodb.models.Error) and athlete.city:
+            warm = history.warm(athlete.id)
+            user_city = warm.home_city if warm and warm.home_city else geodb.find_city_by_name(athlete.city, athlete.state, athlete.country)
+
+        # Lastly, try using the location of an activity
+        if isinstance(user_city, geodb.models.Error):
+            latest = next((a for a in activity_history.select() if a.start_latlng), None)
+            if latest:
+                user_city = geodb.find_places(geodb.FindPlacesParameters(
+                    location=geodb.models.LatLong(*latest.start_latlng),
+                    radius=20,
+                    types=[geodb.models.PopulatedPlaceType.CITY],
+                    sort=geodb.models.SortBy.POPULATION_DEC,
+                ), max_results=1)[0]
+
+        # All of these attempts failed, nothing more we can do
+        if isinstance(user_city, geodb.models.Error): return None
+
+        if sport.lower() == api.models.SportType.Run.lower():
+            sports, verb = RUN_SPORTS, "run"
+        elif sport.lower() == api.models.SportType.Ride.lower():
+            sports, verb = RIDE_SPORTS, "cycled"
+        elif sport.lower() == api.models.SportType.Swim.lower():
+            sports, verb = SWIM_SPORTS, "swum"
+        else:
+            # Any other sport on its own, or every sport
+            sports, verb = sport_types(sport), "travelled"
+        with activity_history.lock:
+            time_index = activity_history.view(history.TimeIndex)
+            total_distance = sum(time_index.total(sport=s).distance for s in (sports or [None]))
+
+        # Nothing to compare yet, e.g. if the activities haven't been fetched
+        if not total_distance: return None
+
+        # Find the city with a distance nearest to the user's travel distance
+        cities = destinations(user_city, total_distance * 1.5 / 1000)
+        if not cities: return None
+        dest_city = sorted(cities, key=lambda place: abs((place.distance or 0)*1000 - total_distance))[0]
+        distance = (dest_city.distance or 0) * 1000
+        if not distance: return None
+
+        if total_distance/distance < 2:
+            # If the best match we found is less than twice the distance travelled, use it
+            src_latlong = geodb.models.LatLong(user_city.latitude, user_city.longitude)
+            dest_latlong = geodb.models.LatLong(dest_city.latitude, dest_city.longitude)
+            names = (user_city.name, dest_city.name)
+            desc_text = f"You've {verb} {total_distance/distance:.1f}x the distance from {user_city.name} to {dest_city.name}!"
+        else:
+            # Otherwise, compare to the Earth's circumference
+            src_latlong = geodb.models.LatLong(0, user_city.longitude)
+            dest_latlong = geodb.models.LatLong(0, 0.008999497 * total_distance / 1000)
+            degrees = dest_latlong.longitude - src_latlong.longitude
+            percent = int(degrees / 360 * 100)
+            names = (user_city.name, f"{percent}% of the way around the Earth!")
+            desc_text = f"You've {verb} {percent}% of the Earth's circumference!"
+
+    # plotly.js 3 draws street maps with MapLibre, the Mapbox traces were removed
+    fig = go.Figure()
+    fig.add_trace(go.Scattermap(
+        mode='markers+lines',
+        lon=[src_latlong.longitude, dest_latlong.longitude],
+        lat=[src_latlong.latitude, dest_latlong.latitude],
+        text=names,
+    ))
+    fig.update_layout(
+        margin={'l':0,'t':0,'b':0,'r':0},
+        map={
+            'center': {
+                'lon': 0.5 * (src_latlong.longitude + dest_latlong.longitude),
+                'lat': 0.5 * (src_latlong.latitude + dest_latlong.latitude),
+            },
+            'style': "open-street-map",
+            'zoom': 1_000_000 // total_distance,
+        }
+    )
+    return fig, desc_text
+
+
+# The figures that can be built together by `build`
+NAMES = ('activityclock', 'activitymap', 'distancemap')
+
+
+def build(
+    names: Iterable[str],
+    athlete: api.models.Athlete,
+    activity_history: history.ActivityHistory,
+    sport: str = '',
+    location: Optional[dict[str, float]] = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Builds several figures in one pass over the athlete's history, as plain JSON-serialisable
+    dicts by name. The distance map also has its description in `text`, and is left out if
+    there's nothing to compare yet.
+    """
+    figures: dict[str, dict[str, Any]] = {}
+    for name in names:
+        if name == 'activityclock':
+            figures[name] = json.loads(pio.to_json(activity_clock(activity_history, sport), validate=False))
+        elif name == 'activitymap':
+            figures[name] = activity_map(activity_history, sport)
+        elif name == 'distancemap':
+            res = distance_map(athlete, activity_history, sport, location)
+            if res is None: continue
+            fig, text = res
+            figures[name] = json.loads(pio.to_json(fig, validate=False)) | dict(text=text)
+    return figures
@@ -1,58 +1,41 @@
+from datetime import date
 import dash
 from flask import request
-import plotly.graph_objects as go
 import strava_api as api
-import numpy as np
-from plotting import make_layout
+import history
+from plotting import make_layout, sync_for_plot
+from plotting.figures import activity_clock
+from urllib.parse import parse_qs
 
 NAME = __name__.split('.')[-1]
 dash.register_page(__name__)
-layout = make_layout(NAME)
+layout = make_layout(NAME, poll_sync=True)
 
 @dash.callback(
     dash.Output(NAME, 'figure'),
-    dash.Input('url', 'href'),
+    dash.Output(f'{NAME}-sync', 'disabled'),
+    dash.Input('url', 'search'),
+    dash.Input(f'{NAME}-sync', 'n_intervals'),
 )
-def update(_):
+def update(s: str, _ = None):
+
+    args = parse_qs((s or '').replace('?', ''))
+    sport = ''.join(args.get('sport', ['']))
+    try:
+        # Dates are given as e.g. `?after=2023-01-01&before=2023-12-31`
+        after = date.fromisoformat(args['after'][0]) if 'after' in args else None
+        before = date.fromisoformat(args['before'][0]) if 'before' in args else None
+    except ValueError:
+        return dash.no_update, True
 
     client = api.Client.from_refresh(request.cookies.get('refresh-token'))
     if not client:
         # The user hasn't authorized, can't plot
-        return
-
-    activities = api.get_athlete_activities(client, max_results=60)
-    if isinstance(activities, api.models.Fault): return dash.no_update
-    hours = [
-        a.start_date_local.hour for a in activities
-    ]
-    hist = np.histogram(hours, range(25))[0]
+        return dash.no_update, True
 
-    # The following question was super helpful for this:
-    # https://stackoverflow.com/questions/72595317/is-it-possible-to-generate-a-clock-chart-using-plotly
-    fig = go.Figure()
-    fig.add_trace(go.Barpolar(
-        r=hist,
-        offset=0.5,
-        customdata=np.arange(24),
-        hovertemplate="%{r} activities at %{customdata:02}:00<extra></extra>",
-    ))
-    fig.update_layout(
-        margin=dict(l=20, t=20, r=20, b=20),
-        polar=dict(
-            hole=0.4,
-            bgcolor='rgba(255,255,255,0.3)',
-            radialaxis=dict(
-                showticklabels=False,
-                showgrid=False,
-            ),
-            angularaxis=dict(
-                tickvals=np.arange(0, 360, 360/24),
-                ticktext=[f'{i:02}' if i % 6 == 0 else '' for i in range(24)],
-                direction='clockwise',
-                period=24,
-            )
-        ),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-    )
-    return fig
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return dash.no_update, True
+    # Plot whatever has been fetched so far, and keep redrawing until the sync finishes
+    job = sync_for_plot(client, athlete.id, NAME)
+    activity_history = history.history_for(athlete.id)
+    return activity_clock(activity_history, sport, after, before), job.finished
@@ -1,9 +1,10 @@
 import dash
 from flask import request
-import plotly.graph_objects as go
 import strava_api as api
 from strava_api.models import SportType
-import geodb_api as geodb
+import history
+from plotting import sync_for_plot, sync_poller, LOADING_DELAY
+from plotting.figures import activity_label, activity_map
 from urllib.parse import parse_qs
 
 NAME = __name__.split('.')[-1]
@@ -11,68 +12,56 @@ dash.register_page(__name__)
 layout = dash.dcc.Loading(children=[
     dash.dcc.Location(id='url', refresh=False),
     dash.dcc.Graph(id=NAME, config=dict(displayModeBar=False)),
-], className='plot-container')
-
-# Save the destination globally so we can update the paragraph element to show its name
-desc_text: str = ""
+    dash.html.P(id=f'{NAME}-label'),
+    sync_poller(NAME),
+], className='plot-container', delay_show=LOADING_DELAY)
 
 @dash.callback(
     dash.Output(NAME, 'figure'),
+    dash.Output(f'{NAME}-sync', 'disabled'),
     dash.Input('url', 'search'),
+    dash.Input(NAME, 'relayoutData'),
+    dash.Input(f'{NAME}-sync', 'n_intervals'),
 )
-def update(s: str):
-    
-    global desc_text
+def update(s: str, relayout = None, _ = None):
 
     args = parse_qs(s.replace('?', ''))
     sport_str = ''.join(args.get('sport', ['']))
     if sport_str:
         if not sport_str in [s.lower() for s in SportType]:
             print(f"Invalid sport type")
-            return dash.no_update
+            return dash.no_update, True
 
     client = api.Client.from_refresh(request.cookies.get('refresh-token'))
     if not client:
         # The user hasn't authorized, can't plot
-        return dash.no_update
+        return dash.no_update, True
 
-    activities = api.get_athlete_activities(client, max_results=None)
-    if isinstance(activities, api.models.Fault):
-        return dash.no_update
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return dash.no_update, True
+    # Plot whatever has been fetched so far, and keep redrawing until the sync finishes
+    job = sync_for_plot(client, athlete.id, NAME)
+    activity_history = history.history_for(athlete.id)
 
-    if sport_str:
-        activities = [a for a in activities if a.sport_type.lower() == sport_str]
+    return activity_map(activity_history, sport_str, relayout, uirevision=NAME), job.finished
+
+@dash.callback(
+    dash.Output(f'{NAME}-label', 'children'),
+    dash.Input(NAME, 'hoverData'),
+    prevent_initial_call=True,
+)
+def update_label(hover):
+    if not hover or not hover.get('points'): return ""
+    id = hover['points'][0].get('customdata')
+    if id is None: return ""
 
-    N = len(activities)
-    locations = [geodb.models.LatLong(*a.start_latlng) for a in activities]
-    labels = [
-        a.name + ' ' + a.start_date_local.strftime('%d %b %H:%M')
-        for a in activities
-    ]
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return dash.no_update
 
-    # All's good, create the plot!
-    fig = go.Figure()
-    fig.add_trace(go.Scattergeo(
-        mode='markers',
-        lon=[l.longitude for l in locations],
-        lat=[l.latitude for l in locations],
-        text=labels,
-    ))
-    fig.update_layout(
-        margin={'l':0,'t':0,'b':0,'r':0},
-        # mapbox={
-        #     'style': "open-street-map",
-        #     'center': {
-        #         'lon': sum(l.longitude for l in locations) / N,
-        #         'lat': sum(l.latitude for l in locations) / N,
-        #     },
-        # }
-        geo = dict(
-            projection_type = 'orthographic',
-            showland = True,
-            # landcolor = 'rgb(243, 243, 243)',
-            # countrycolor = 'rgb(204, 204, 204)',
-        ),
-    )
-    return fig
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return dash.no_update
+    # Every marker is an activity in the history, so hovering never needs a request to Strava
+    activity = history.history_for(athlete.id).activities.get(int(id))
+    if activity is None: return ""
+    return activity_label(activity)
 
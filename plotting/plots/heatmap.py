@@ -0,0 +1,75 @@
+import dash
+from flask import request
+import numpy as np
+import plotly.graph_objects as go
+import strava_api as api
+import history
+from plotting import make_layout, compact_figure, sync_for_plot
+
+NAME = __name__.split('.')[-1]
+dash.register_page(__name__)
+layout = make_layout(NAME, poll_sync=True)
+
+# Assumed size of the plot in screen pixels, used to work out the viewport from the map's centre and zoom
+VIEWPORT_SIZE = (1024, 768)
+
+@dash.callback(
+    dash.Output(NAME, 'figure'),
+    dash.Output(f'{NAME}-sync', 'disabled'),
+    dash.Input('url', 'href'),
+    dash.Input(NAME, 'relayoutData'),
+    dash.Input(f'{NAME}-sync', 'n_intervals'),
+)
+def update(_, relayout, __):
+
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client:
+        # The user hasn't authorized, can't plot
+        return dash.no_update, True
+
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return dash.no_update, True
+    # Plot whatever has been fetched so far, and keep redrawing until the sync finishes
+    job = sync_for_plot(client, athlete.id, NAME)
+    activity_history = history.history_for(athlete.id)
+    # Start zoomed out over the athlete's most recent activity
+    relayout = relayout or {}
+    zoom = relayout.get('map.zoom')
+    center = relayout.get('map.center')
+    if zoom is None or center is None:
+        latest = activity_history.latest
+        lat, lon = latest.start_latlng if latest and latest.start_latlng else (0, 0)
+        zoom, center = 8, dict(lat=lat, lon=lon)
+
+    # Map zoom levels use 512 pixel tiles, so are one less than the 256 pixel tile zoom.
+    # Bin two levels shallower than the screen so each cell is a few pixels across.
+    screen_zoom = zoom + 1
+    level = int(np.clip(np.floor(screen_zoom) - 2, 0, history.heatmap.MAX_ZOOM))
+    bounds = history.heatmap.viewport(center['lat'], center['lon'], screen_zoom, *VIEWPORT_SIZE)
+    # The sync adds tiles on another thread
+    with activity_history.lock:
+        latlng, counts = activity_history.view(history.HeatmapPyramid).cells_in(level, *bounds)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattermap(
+        mode='markers',
+        lat=latlng[:, 0],
+        lon=latlng[:, 1],
+        marker=dict(
+            size=4,
+            color=np.log1p(counts),
+            colorscale='Hot',
+        ),
+        hoverinfo='none',
+    ))
+    fig.update_layout(
+        margin={'l':0,'t':0,'b':0,'r':0},
+        # Keep the user's pan and zoom when the figure is redrawn with new tiles
+        uirevision=NAME,
+        map={
+            'center': center,
+            'style': "carto-darkmatter",
+            'zoom': zoom,
+        },
+    )
+    return compact_figure(fig), job.finished
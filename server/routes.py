@@ -4,11 +4,31 @@ and their responses.
 """
 
 from . import app
-from flask import Response, render_template, request, redirect
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+import hmac
+import os
+from typing import Optional
+from flask import Response, jsonify, render_template, request, redirect, url_for
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+import numpy as np
 
+import apis
 import strava_api as api
+import geodb_api as geodb
+import history
+from plotting import figures
 from . import units
 
+# Members shown on a club's leaderboard
+LEADERBOARD_SIZE = 50
+
+# The plotly.js bundle is versioned in its URL, so browsers can cache it for good
+PLOTLY_JS_URL = f'/scripts/plotly-{get_plotlyjs_version()}.min.js'
+
+# The secret that `/metrics` is served to, which is hidden if it's not set
+METRICS_TOKEN = os.environ.get('STRAVACO2_METRICS_TOKEN')
+
 
 def render_error(code: int):
     refresh = request.cookies.get('refresh-token')
@@ -24,19 +44,41 @@ def home():
         res.delete_cookie('refresh-token')
         return res
 
-    athlete = api.get_athlete(client)
+    athlete = history.athlete_for(client)
     if isinstance(athlete, api.models.Fault): return render_error(500)
-    activity_stats = api.get_athlete_stats(client, athlete.id)
-    if isinstance(activity_stats, api.models.Fault): return render_error(500)
+    activity_history = history.history_for(athlete.id)
+    history.sync_in_background(client, athlete.id)
+    if activity_history.synced is None:
+        # Until the history has been fetched once, use Strava's own totals rather than wait for it
+        warm = history.warm(athlete.id)
+        activity_stats = warm.stats if warm and warm.stats else api.get_athlete_stats(client, athlete.id)
+        if isinstance(activity_stats, api.models.Fault): return render_error(500)
+    else:
+        with activity_history.lock:
+            activity_stats = activity_history.view(history.StatsEngine).activity_stats()
+    with activity_history.lock:
+        # Activities on routes repeated like commutes count as commutes, even if they aren't marked as one
+        co2_engine = activity_history.view(history.CO2Engine)
+        co2_engine.inferred_commutes = activity_history.view(history.RouteClusters).likely_commutes()
+        co2 = co2_engine.ledger
 
     use_metric = athlete.measurement_preference == 'meters'
+    sport = request.args.get('sport', default='', type=str)
+
+    # Once the history has been fetched, the plots that only need it are drawn from the same pass
+    # and embedded in the page. The distance map waits on GeoDB, so the page fetches it afterwards
+    # from `/figures` rather than hold up the response. Until then, the plots are shown in frames
+    # which keep redrawing while the sync runs.
+    inline = figures.build(('activityclock', 'activitymap'), athlete, activity_history, sport) if activity_history.synced else None
 
     res = render_template(
         'profile/index.html',
         title='Home',
         connect_url=api.connect_url,
         auth=True,
-        sport=request.args.get('sport', default='', type=str),
+        sport=sport,
+        figures=inline,
+        plotly_js=PLOTLY_JS_URL,
         # Tell the template how to format distances and elevations
         format_distance=lambda x: units.format_distance(x, use_metric),
         format_elevation=lambda x: units.format_elevation(x, use_metric),
@@ -44,10 +86,233 @@ def home():
         # Athlete info
         athlete=athlete,
         stats=activity_stats,
+        co2_saved=co2.total(),
+    )
+    print(f"Responded to '{request.path}' with {client.api_calls} API calls")
+    return res
+
+
+@app.route('/activities')
+def activities():
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return redirect('/')
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+    activity_history = history.history_for(athlete.id)
+    history.sync_in_background(client, athlete.id)
+
+    # Filters are given as e.g. `?sport=ride&after=2023-01-01&before=2023-12-31&commute=yes&q=morning`,
+    # with both dates included
+    args = request.args
+    try:
+        after = date.fromisoformat(args['after']) if args.get('after') else None
+        before = date.fromisoformat(args['before']) if args.get('before') else None
+        order = history.ActivityOrder(args.get('sort', 'date'))
+    except ValueError:
+        return render_error(400)
+    filter = history.ActivityFilter(
+        sport=args.get('sport') or None,
+        after=datetime.combine(after, time(), timezone.utc) if after else None,
+        before=datetime.combine(before + timedelta(days=1), time(), timezone.utc) if before else None,
+        commute={'yes': True, 'no': False}.get(args.get('commute', '')),
+        text=args.get('q') or None,
+    )
+    with activity_history.lock:
+        page = activity_history.view(history.ActivityList).page(
+            filter,
+            order,
+            descending=args.get('order', 'desc') != 'asc',
+            cursor=args.get('cursor'),
+        )
+        likely_commutes = activity_history.view(history.RouteClusters).likely_commutes()
+        # Read while locked, since the sync adds sports on another thread
+        time_index = activity_history.view(history.TimeIndex)
+        sports = sorted(s for s, sums in time_index.by_sport.items() if sums.n)
+        # The totals of every activity in the date range, from two binary searches of its prefix sums,
+        # which don't know which activities are commutes or what they're called
+        totals = None
+        if filter.commute is None and not filter.text:
+            sport = next((s for s in sports if s.lower() == filter.sport.lower()), '') if filter.sport else None
+            totals = time_index.total(filter.after, filter.before, sport)
+
+    # Every cell of the page is formatted at once
+    use_metric = athlete.measurement_preference == 'meters'
+    acts = page.activities
+    rows = zip(
+        acts,
+        [a.start_date_local.strftime('%d %b %Y %H:%M') for a in acts],
+        units.format_distances((a.distance or 0 for a in acts), use_metric),
+        units.format_times((a.moving_time or 0 for a in acts)),
+        units.format_elevations((a.total_elevation_gain or 0 for a in acts), use_metric),
+    )
+    summary = None
+    if totals is not None and totals.count:
+        summary = (
+            f"{totals.count} {'activity' if totals.count == 1 else 'activities'}, "
+            f"{units.format_distance(totals.distance, use_metric)}, "
+            f"{units.format_time(totals.moving_time)} moving, "
+            f"{units.format_elevation(totals.elevation_gain, use_metric)} climbed"
+        )
+    return render_template(
+        'activities/index.html',
+        title='Activities',
+        connect_url=api.connect_url,
+        auth=True,
+        args=args,
+        rows=list(rows),
+        summary=summary,
+        likely_commutes=likely_commutes,
+        sports=sports,
+        orders=list(history.ActivityOrder),
+        next_url=url_for('activities', **(args.to_dict() | dict(cursor=page.next))) if page.next else None,
+        syncing=activity_history.synced is None,
+    )
+
+
+@app.route('/clubs')
+@app.route('/clubs/<int:id>')
+def clubs(id: Optional[int] = None):
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return redirect('/')
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+    athlete_clubs = api.get_athlete_clubs(client)
+    if isinstance(athlete_clubs, api.models.Fault): return render_error(500)
+    club = next((c for c in athlete_clubs if c.id == id), None) if id is not None else None
+    # Only members of a club can see its activities
+    if id is not None and club is None: return render_error(404)
+
+    try:
+        metric = history.Metric(request.args.get('metric', 'distance'))
+        period = history.Period(request.args.get('period', 'week'))
+    except ValueError:
+        return render_error(400)
+
+    leaders, member_count, job = [], 0, None
+    if club is not None:
+        # Serve the leaderboard as it is, and add the club's new activities in the background
+        job = history.refresh_club_in_background(client, club.id)
+        leaderboards = history.leaderboards_for(club.id)
+        with leaderboards.lock:
+            board = leaderboards.board(metric, period)
+            leaders, member_count = board.top(LEADERBOARD_SIZE), len(board)
+
+    use_metric = athlete.measurement_preference == 'meters'
+    totals = units.format_distances((t for _, t in leaders), use_metric) if metric == history.Metric.DISTANCE else [f'{t:.1f} kg' for _, t in leaders]
+    return render_template(
+        'clubs/index.html',
+        title=club.name if club else 'Clubs',
+        connect_url=api.connect_url,
+        auth=True,
+        clubs=athlete_clubs,
+        club=club,
+        metric=metric,
+        period=period,
+        metrics=list(history.Metric),
+        periods=list(history.Period),
+        leaders=list(zip(leaders, totals)),
+        member_count=member_count,
+        refreshing=job is not None and not job.finished,
+    )
+
+
+@app.route('/places')
+def places():
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return redirect('/')
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+    activity_history = history.history_for(athlete.id)
+    history.sync_in_background(client, athlete.id)
+
+    # The cities are matched from a local GeoNames table, the page says so if it isn't installed
+    table = geodb.city_table()
+    summary = None
+    if table is not None:
+        with activity_history.lock:
+            summary = activity_history.view(history.PlacesVisited).summary(table)
+
+    use_metric = athlete.measurement_preference == 'meters'
+    format_places = lambda places: list(zip(places, units.format_distances((p.distance for p in places), use_metric)))
+    return render_template(
+        'places/index.html',
+        title='Places',
+        connect_url=api.connect_url,
+        auth=True,
+        summary=summary,
+        cities=format_places(summary.cities) if summary else [],
+        countries=format_places(summary.countries) if summary else [],
+        syncing=activity_history.synced is None,
+    )
+
+
+@app.route('/figures')
+def plot_figures():
+    # Several plots' figures at once, e.g. `/figures?names=activityclock,distancemap&sport=run`
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return render_error(401)
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+
+    names = [n for n in request.args.get('names', default='', type=str).split(',') if n in figures.NAMES]
+    lat, lon = request.args.get('lat', type=float), request.args.get('lon', type=float)
+    location = dict(lat=lat, lon=lon) if lat is not None and lon is not None else None
+    res = figures.build(
+        names or figures.NAMES,
+        athlete,
+        history.history_for(athlete.id),
+        request.args.get('sport', default='', type=str),
+        location,
     )
     print(f"Responded to '{request.path}' with {client.api_calls} API calls")
+    return jsonify(res)
+
+
+@app.route('/activities/<int:id>/label')
+def activity_label(id: int):
+    # What's shown when an activity on the embedded activity map is hovered
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return render_error(401)
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+    activity = history.history_for(athlete.id).activities.get(id)
+    if activity is None: return render_error(404)
+    return Response(figures.activity_label(activity), mimetype='text/plain')
+
+
+@app.route('/activities/<int:id>/streams')
+def activity_streams(id: int):
+    # The per-second samples of one of the athlete's activities, fetched from Strava the first
+    # time they're asked for and then read from the athlete's stream store
+    client = api.Client.from_refresh(request.cookies.get('refresh-token'))
+    if not client: return render_error(401)
+    athlete = history.athlete_for(client)
+    if isinstance(athlete, api.models.Fault): return render_error(500)
+    if id not in history.history_for(athlete.id).activities: return render_error(404)
+    store = history.stream_store_for(athlete.id)
+    faults = store.fetch(client, [id], priority=apis.Priority.INTERACTIVE)
+    streams = store.streams(id)
+    if faults or streams is None: return render_error(500)
+    # Streams that weren't recorded are all NaN, and are left out
+    return jsonify({
+        name: column.tolist() if column.dtype.kind == 'i' else [None if np.isnan(v) else v for v in column.tolist()]
+        for name, column in streams.items()
+        if column.dtype.kind == 'i' or not np.isnan(column).all()
+    })
+
+
+@app.route('/scripts/plotly-<version>.min.js')
+def plotly_js(version: str):
+    if version != get_plotlyjs_version(): return render_error(404)
+    res = Response(plotly_js_source(), mimetype='text/javascript')
+    res.cache_control.public = True
+    res.cache_control.max_age = 31536000
     return res
 
+@lru_cache(maxsize=None)
+def plotly_js_source() -> str:
+    return get_plotlyjs()
+
 
 @app.route('/about')
 def about():
@@ -66,6 +331,9 @@ def authorize():
     if not client:
         return "Failed to authenticate"
 
+    # Start fetching what the home page and plots need while the browser follows the redirect
+    history.warm_up(client)
+
     # Set the refresh token as a cookie on the client
     res = redirect('/')
     res.set_cookie('refresh-token', client.tokens.refresh, httponly=True, max_age=2592000)
@@ -82,3 +350,16 @@ def deauthorize():
     res.delete_cookie('refresh-token')
     return res
 
+
+@app.route('/metrics')
+def metrics():
+    # Upstream queue depths and wait times for each athlete, and the shared cache's hit rates,
+    # only shown to requests with the `Authorization: Bearer <METRICS_TOKEN>` header. Behind a proxy
+    # every request comes from the proxy's address, so that can't tell who's asking.
+    given = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not METRICS_TOKEN or not hmac.compare_digest(given.encode(), METRICS_TOKEN.encode()): return render_error(404)
+    return jsonify({
+        'strava': api.endpoints.StravaAPIRequest.scheduler.metrics(),
+        'geodb': geodb.endpoints.GeoDBApiRequest.scheduler.metrics(),
+        'cache': {ns: vars(s) | dict(hit_rate=s.hit_rate) for ns, s in apis.cache.cache().stats().items()},
+    })
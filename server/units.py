@@ -4,6 +4,8 @@ and lengths.
 """
 
 from math import floor
+from typing import Iterable
+import numpy as np
 
 second = 1
 minute = second * 60
@@ -44,3 +46,32 @@ def format_time(x: float, detail: int = 2) -> str:
 	return ' '.join([
 		f'{floor(value)} {unit}' for value, unit in zip(values, units) if value >= 1
 	][:detail]) or '0 seconds'
+
+
+def format_distances(xs: Iterable[float], metric: bool) -> list[str]:
+	"""Like `format_distance` for many distances at once, e.g. a page of activities"""
+	values = np.fromiter(xs, np.float64) / (km if metric else mi)
+	return np.char.mod('%.1f ' + ('km' if metric else 'mi'), values).tolist()
+
+def format_elevations(xs: Iterable[float], metric: bool) -> list[str]:
+	"""Like `format_elevation` for many elevations at once"""
+	values = np.fromiter(xs, np.float64) / (1 if metric else ft)
+	return np.char.mod('%.0f ' + ('m' if metric else 'ft'), values).tolist()
+
+def format_times(xs: Iterable[float], detail: int = 2) -> list[str]:
+	"""Like `format_time` for many durations at once"""
+	units = np.array([ 'years', 'weeks', 'days', 'hours', 'minutes', 'seconds' ])
+	x = np.fromiter(xs, np.float64)
+	# One row of whole years, weeks, etc. for each duration
+	values = np.floor(np.stack([
+		x / year,
+		(x % year) / week,
+		(x % week) / day,
+		(x % day) / hour,
+		(x % hour) / minute,
+		(x % minute) / second,
+	], axis=1)).astype(np.int64)
+	return [
+		' '.join(f'{v} {u}' for v, u in zip(row[row >= 1][:detail], units[row >= 1][:detail])) or '0 seconds'
+		for row in values
+	]
@@ -9,5 +9,11 @@ from . import models
 from .endpoints import (
     get_athlete,
     get_athlete_activities,
+    iter_athlete_activities,
+    get_activity,
+    get_activity_streams,
     get_athlete_stats,
+    get_athlete_clubs,
+    iter_club_members,
+    iter_club_activities,
 )
@@ -0,0 +1,127 @@
+"""
+Asyncio versions of the endpoints in `endpoints.py`, for fanning out many requests on one thread.
+Each takes an `apis.aio.AsyncSession` first, which limits how many requests are in flight,
+and returns the same models as its blocking version.
+"""
+
+from __future__ import annotations
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Optional, Union
+
+from apis.aio import AsyncSession, send
+from apis import AnyModel
+from . import models
+from .oauth import Client, OAuthTokens, TOKEN_URL, cache_tokens, fresh_cached_tokens, refresh_data
+from .endpoints import (
+    ATHLETE_CACHE, STATS_CACHE, StravaAPIRequest, StravaAPIRequestPager, parse_page, to_single_model,
+)
+
+# Pages requested at once when iterating over a list, beyond the one that's needed next
+PAGES_AHEAD = 3
+
+
+async def client_from_refresh(session: AsyncSession, refresh_token: Optional[str]) -> Optional[Client]:
+    """Like `Client.from_refresh`, using the cached tokens if they're fresh"""
+    if not refresh_token: return
+    tokens = fresh_cached_tokens(refresh_token)
+    if tokens is None:
+        tokens = OAuthTokens.from_response(await session.post(TOKEN_URL, refresh_data(refresh_token)))
+        if not tokens: return
+        cache_tokens(tokens, refresh_token)
+    return Client(tokens)
+
+
+async def get_single(session: AsyncSession, req: StravaAPIRequest, type: type[AnyModel]) -> Union[AnyModel, models.Fault]:
+    await send(session, req)
+    if not req.success:
+        fault = to_single_model(models.Fault.fromResponse(req.response))
+        fault.warn()
+        return fault
+    model = to_single_model(type.fromResponse(req.response))
+    if isinstance(model, models.Fault):
+        model.warn()
+    return model
+
+
+async def iter_models(
+    session: AsyncSession,
+    pager: StravaAPIRequestPager,
+    type: type[AnyModel],
+    max_pages: Optional[int] = None,
+) -> AsyncIterator[Union[AnyModel, models.Fault]]:
+    """
+    Iterates over the models of every page, requesting the next `PAGES_AHEAD` pages at the same time
+    as the one that's needed. Stops after yielding a `Fault`.
+    :param max_pages: Never request pages after this one
+    """
+    page = 1
+    while max_pages is None or page <= max_pages:
+        last = page + PAGES_AHEAD if max_pages is None else min(page + PAGES_AHEAD, max_pages)
+        requests = await asyncio.gather(*(send(session, pager.page(p)) for p in range(page, last + 1)))
+        for req in requests:
+            res = parse_page(req, type)
+            if res is None: return
+            if isinstance(res, models.Fault):
+                yield res
+                return
+            for model in res: yield model
+        page = last + 1
+
+
+async def get_athlete(session: AsyncSession, client: Client) -> Union[models.Athlete, models.Fault]:
+    """See `endpoints.get_athlete`"""
+    req = StravaAPIRequest(client, '/athlete')
+    req.cache_policy = ATHLETE_CACHE
+    athlete = await get_single(session, req, models.Athlete)
+    if not isinstance(athlete, models.Fault):
+        client.athlete_id = athlete.id
+    return athlete
+
+
+async def get_athlete_activities(
+    session: AsyncSession,
+    client: Client,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    per_page: int = 30,
+    max_results: Optional[int] = 30
+) -> Union[list[models.SummaryActivity], models.Fault]:
+    """See `endpoints.get_athlete_activities`"""
+    per_page = min(per_page, max_results or per_page)
+    req = StravaAPIRequest(
+        client,
+        '/athlete/activities',
+        before=int(datetime.today().timestamp()) if before is None else int(before.timestamp()),
+        after=0 if after is None else int(after.timestamp()),
+        per_page=per_page
+    )
+    max_pages = None if max_results is None else -(-max_results // per_page)
+    results = []
+    async for r in iter_models(session, StravaAPIRequestPager(req), models.SummaryActivity, max_pages):
+        if isinstance(r, models.Fault): return r
+        results.append(r)
+    return results[:max_results]
+
+
+async def get_activity(session: AsyncSession, client: Client, id: int) -> Union[models.SummaryActivity, models.Fault]:
+    """See `endpoints.get_activity`"""
+    return await get_single(session, StravaAPIRequest(client, f'/activities/{id}'), models.SummaryActivity)
+
+
+async def get_activity_streams(
+    session: AsyncSession,
+    client: Client,
+    id: int,
+    keys: list[models.StreamType] = list(models.StreamType),
+) -> Union[models.StreamSet, models.Fault]:
+    """See `endpoints.get_activity_streams`"""
+    req = StravaAPIRequest(client, f'/activities/{id}/streams', keys=keys, key_by_type='true')
+    return await get_single(session, req, models.StreamSet)
+
+
+async def get_athlete_stats(session: AsyncSession, client: Client, id: models.ID) -> Union[models.ActivityStats, models.Fault]:
+    """See `endpoints.get_athlete_stats`"""
+    req = StravaAPIRequest(client, f'/athletes/{id}/stats')
+    req.cache_policy = STATS_CACHE
+    return await get_single(session, req, models.ActivityStats)
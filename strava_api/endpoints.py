@@ -1,15 +1,24 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterator, Optional, Union
+from typing import Any, Iterator, Optional, Union
 from functools import cached_property
+import hashlib
 import itertools
 
 from .oauth import Client
-from apis import APIRequest, APIResponse, AnyModel
+from apis import APIRequest, APIResponse, AnyModel, CachePolicy, Scheduler
 
 from . import models
 
+# Maximum number of requests to Strava in flight at once, shared between athletes
+MAX_CONCURRENT_REQUESTS = 8
+
+# How long responses that rarely change are shared between the server's processes
+ATHLETE_CACHE = CachePolicy('strava:athlete', 60 * 60)
+STATS_CACHE = CachePolicy('strava:stats', 15 * 60)
+CLUBS_CACHE = CachePolicy('strava:clubs', 60 * 60)
+
 
 def to_single_model(m: Union[AnyModel, list[AnyModel]]) -> Union[AnyModel, models.Fault]:
     if isinstance(m, list):
@@ -27,6 +36,7 @@ def to_model_list(m: Union[AnyModel, list[AnyModel]]) -> Union[list[AnyModel], m
 class StravaAPIRequest(APIRequest):
 
     client: Client
+    scheduler = Scheduler('strava', MAX_CONCURRENT_REQUESTS)
 
     def __init__(self, client: Client, path: str, **query_parameters):
         super().__init__(
@@ -37,15 +47,49 @@ class StravaAPIRequest(APIRequest):
         )
         self.client = client
 
-    @cached_property
-    def response(self) -> APIResponse:
+    @property
+    def schedule_key(self) -> Optional[str]:
+        # Requests are for the client's athlete, once known
+        return super().schedule_key or (str(self.client.athlete_id) if self.client.athlete_id else None)
+
+    @property
+    def cache_key(self) -> str:
+        # Responses depend on whose token the request is sent with. The token itself isn't kept.
+        return f'{super().cache_key}#{hashlib.sha256(self.client.tokens.access.encode()).hexdigest()[:16]}'
+
+    def _fetch(self) -> APIResponse:
+        # Responses from the cache don't count as API calls
         self.client.api_calls += 1
-        return super().response
+        return super()._fetch()
+
+    def iter_items(self) -> Iterator[Any]:
+        if 'response' not in self.__dict__: self.client.api_calls += 1
+        return super().iter_items()
 
     @property
     def success(self) -> bool:
         # Test for HTTP status code 200, which means all ok
-        return super()._res.status_code == 200
+        return self.status_code == 200
+
+
+def parse_page(req: StravaAPIRequest, type: type[AnyModel]) -> Union[list[AnyModel], models.Fault, None]:
+    """Parses a page of models from a sent request, returning `None` if there are no more pages"""
+    if not req.success:
+        fault = models.Fault.fromResponse(req.response)
+        if isinstance(fault, list): fault = fault[0]
+        if fault.errors and fault.errors[0].field == 'page':
+            return None
+        fault.warn()
+        return fault
+
+    # Stop if we didn't get a list of models
+    res = to_model_list(type.fromResponse(req.response))
+    if isinstance(res, models.Fault):
+        res.warn()
+        return res
+
+    # Stop iterating if no models are returned
+    return res or None
 
 
 @dataclass(frozen=True)
@@ -54,38 +98,39 @@ class StravaAPIRequestPager:
 
     req: StravaAPIRequest
 
-    def iter_models(self, type: type[AnyModel]) -> Iterator[Union[AnyModel, models.Fault]]:
-        req = self.req
-        page = 1
-        page_size = req.parameters.get('per_page', 30)
+    def page(self, page: int) -> StravaAPIRequest:
+        """The request for one page, counting from 1"""
+        page_size = self.req.parameters.get('per_page', 30)
+        req = StravaAPIRequest(self.req.client, self.req.path, **self.req.parameters | dict(per_page=page_size, page=page))
+        req.cache_policy = self.req.cache_policy
+        return req
 
+    def iter_models(self, type: type[AnyModel]) -> Iterator[Union[AnyModel, models.Fault]]:
         # Iterate pages
-        while True:
-            parameters = req.parameters | dict(per_page=page_size, page=page)
-            req = StravaAPIRequest(req.client, req.path, **parameters)
+        for page in itertools.count(1):
+            req = self.page(page)
+            # Models are made as the page arrives, rather than after all of it has been parsed,
+            # unless the page is cached, which needs all of it
+            req.stream = req.cache_policy is None
             if not req.success:
-                fault = models.Fault.fromResponse(req.response)
-                if isinstance(fault, list): fault = fault[0]
-                if fault.errors and fault.errors[0].field == 'page':
-                    return
-                fault.warn()
-                yield fault
+                res = parse_page(req, type)
+                if isinstance(res, models.Fault): yield res
                 return
 
-            # Stop if we didn't get a list of models
-            res = to_model_list(type.fromResponse(req.response))
-            if isinstance(res, models.Fault):
-                res.warn()
-                yield res
+            # Iterate models in page
+            count = 0
+            try:
+                for model in type.fromItems(req.iter_items()):
+                    count += 1
+                    yield model
+            except ValueError:
+                fault = models.Fault([], "Expected array of models")
+                fault.warn()
+                yield fault
                 return
 
             # Stop iterating if no models are returned
-            if len(res) == 0: return
-
-            # Iterate models in page
-            for model in res: yield model
-
-            page += 1
+            if not count: return
 
 
 def get_athlete(client: Client) -> Union[models.Athlete, models.Fault]:
@@ -95,12 +140,36 @@ def get_athlete(client: Client) -> Union[models.Athlete, models.Fault]:
     representation; all others will receive a summary representation.
     """
     req = StravaAPIRequest(client, '/athlete')
+    req.cache_policy = ATHLETE_CACHE
     athlete = to_single_model(models.Athlete.fromResponse(req.response))
     if isinstance(athlete, models.Fault):
         athlete.warn()
+    else:
+        client.athlete_id = athlete.id
     return athlete
 
 
+def iter_athlete_activities(
+    client: Client,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    per_page: int = 30,
+) -> Iterator[Union[models.SummaryActivity, models.Fault]]:
+    """
+    Iterates over the activities of the authenticated athlete, requesting each page as it's needed.
+    Activities are in order of start date, oldest first. Stops after yielding a `Fault`.
+    Requires activity:read, see `get_athlete_activities`.
+    """
+    req = StravaAPIRequest(
+        client,
+        '/athlete/activities',
+        before=int(datetime.today().timestamp()) if before is None else int(before.timestamp()),
+        after=0 if after is None else int(after.timestamp()),
+        per_page=per_page
+    )
+    return StravaAPIRequestPager(req).iter_models(models.SummaryActivity)
+
+
 def get_athlete_activities(
     client: Client,
     before: Optional[datetime] = None,
@@ -115,20 +184,53 @@ def get_athlete_activities(
     :param before: Timestamp to use for filtering activities that have taken place before a certain time.
     :param after: Timestamp to use for filtering activities that have taken place after a certain time.
     """
-    req = StravaAPIRequest(
-        client,
-        '/athlete/activities',
-        before=int(datetime.today().timestamp()) if before is None else int(before.timestamp()),
-        after=0 if after is None else int(after.timestamp()),
-        per_page=min(per_page, max_results or per_page)
-    )
-    pager = StravaAPIRequestPager(req)
-    results = list(itertools.islice(pager.iter_models(models.SummaryActivity), max_results))
+    activities = iter_athlete_activities(client, before, after, min(per_page, max_results or per_page))
+    results = list(itertools.islice(activities, max_results))
     for r in results:
         if isinstance(r, models.Fault): return r
     return results # type: ignore results will not contain Faults here
 
 
+def get_activity(client: Client, id: int) -> Union[models.SummaryActivity, models.Fault]:
+    """
+    Returns the given activity that is owned by the authenticated athlete.
+    Requires activity:read for Everyone and Followers activities, and
+    activity:read_all for Only Me activities.
+    :param id: The identifier of the activity.
+    """
+    req = StravaAPIRequest(client, f'/activities/{id}')
+    if not req.success:
+        fault = to_single_model(models.Fault.fromResponse(req.response))
+        fault.warn()
+        return fault
+    activity = to_single_model(models.SummaryActivity.fromResponse(req.response))
+    if isinstance(activity, models.Fault):
+        activity.warn()
+    return activity
+
+
+def get_activity_streams(
+    client: Client,
+    id: int,
+    keys: list[models.StreamType] = list(models.StreamType),
+) -> Union[models.StreamSet, models.Fault]:
+    """
+    Returns the given activity's streams.
+    Requires activity:read scope. Requires activity:read_all scope for Only Me activities.
+    :param id: The identifier of the activity.
+    :param keys: The types of streams to return.
+    """
+    req = StravaAPIRequest(client, f'/activities/{id}/streams', keys=keys, key_by_type='true')
+    if not req.success:
+        fault = to_single_model(models.Fault.fromResponse(req.response))
+        fault.warn()
+        return fault
+    streams = to_single_model(models.StreamSet.fromResponse(req.response))
+    if isinstance(streams, models.Fault):
+        streams.warn()
+    return streams
+
+
 def get_athlete_stats(
     client: Client,
     id: models.ID
@@ -139,7 +241,41 @@ def get_athlete_stats(
     :param id: The identifier of the athlete. Must match the authenticated athlete.
     """
     req = StravaAPIRequest(client, f'/athletes/{id}/stats')
+    req.cache_policy = STATS_CACHE
     stats = to_single_model(models.ActivityStats.fromResponse(req.response))
     if isinstance(stats, models.Fault):
         stats.warn()
     return stats
+
+
+def get_athlete_clubs(client: Client) -> Union[list[models.SummaryClub], models.Fault]:
+    """
+    Returns the clubs that the authenticated athlete is a member of.
+    Requires read scope.
+    """
+    req = StravaAPIRequest(client, '/athlete/clubs')
+    req.cache_policy = CLUBS_CACHE
+    results = list(StravaAPIRequestPager(req).iter_models(models.SummaryClub))
+    for r in results:
+        if isinstance(r, models.Fault): return r
+    return results # type: ignore results will not contain Faults here
+
+
+def iter_club_members(client: Client, id: int, per_page: int = 200) -> Iterator[Union[models.ClubAthlete, models.Fault]]:
+    """
+    Iterates over the members of a club, requesting each page as it's needed.
+    The authenticated athlete must be a member of the club. Stops after yielding a `Fault`.
+    :param id: The identifier of the club.
+    """
+    req = StravaAPIRequest(client, f'/clubs/{id}/members', per_page=per_page)
+    return StravaAPIRequestPager(req).iter_models(models.ClubAthlete)
+
+
+def iter_club_activities(client: Client, id: int, per_page: int = 200) -> Iterator[Union[models.ClubActivity, models.Fault]]:
+    """
+    Iterates over the recent activities of a club's members, newest first, requesting each page as it's needed.
+    The authenticated athlete must be a member of the club. Stops after yielding a `Fault`.
+    :param id: The identifier of the club.
+    """
+    req = StravaAPIRequest(client, f'/clubs/{id}/activities', per_page=per_page)
+    return StravaAPIRequestPager(req).iter_models(models.ClubActivity)
@@ -6,14 +6,13 @@ a load of attributes.
 """
 
 from __future__ import annotations
-from dataclasses import dataclass
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, Optional, Tuple
 import warnings
-from apis import Model
+from apis import Model, model
 
-@dataclass(frozen=True)
+@model
 class Error(Model):
     """Included in a `Fault` response to indicate what went wrong."""
     code: str                               # The code associated with this error.
@@ -27,7 +26,7 @@ class Error(Model):
     def warn(self):
         warnings.warn(f"[Strava] Error {self.code} from field {self.field}")
 
-@dataclass(frozen=True)
+@model
 class Fault(Model):
     """Encapsulates the errors that may be returned from the API."""
     errors: list[Error]                     # The set of specific errors associated with this fault, if any.
@@ -43,7 +42,7 @@ class Fault(Model):
         warnings.warn(f"[Strava] {self.message}")
         for e in self.errors: e.warn()
 
-@dataclass(frozen=True)
+@model
 class Athlete(Model):
     """A summary of an athlete. Not all of the fields will be available."""
     id: ID                                  # The unique identifier of the athlete
@@ -76,7 +75,7 @@ class Athlete(Model):
     def parse_field(cls, key, value) -> Any:
         return (datetime.fromisoformat(value) if key in ['created_at', 'updated_at'] else value)
 
-@dataclass(frozen=True)
+@model
 class ID(Model):
     """
     Class containing only the ID of the entity it represents. Sometimes returned
@@ -88,7 +87,7 @@ class ID(Model):
     def parse_field(cls, key: str, value: Any) -> Any:
         return value
 
-@dataclass(frozen=True)
+@model
 class ActivityTotal(Model):
     """A roll-up of metrics pertaining to a set of activities. Values are in seconds and meters."""
     count: int             = 0              # The number of activities considered in this total.
@@ -102,7 +101,7 @@ class ActivityTotal(Model):
     def parse_field(cls, key: str, value: Any) -> Any:
         return value
 
-@dataclass(frozen=True)
+@model
 class ActivityStats(Model):
     """A set of rolled-up statistics and totals for an athlete."""
     biggest_ride_distance: float            # The longest distance ridden by the athlete.
@@ -174,7 +173,18 @@ class SportType(StrEnum):
     Workout="Workout"
     Yoga="Yoga"
 
-@dataclass(frozen=True)
+@model
+class PolylineMap(Model):
+    """The route of an activity as encoded polylines"""
+    id: str                                 # The identifier of the map
+    polyline: Optional[str]                 # The polyline of the map, only returned on detailed representation of an object
+    summary_polyline: str                   # The summary polyline of the map
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return value
+
+@model(intern=('sport_type', 'timezone', 'gear_id'))
 class SummaryActivity(Model):
     """A summary of a recorded activity"""
     id: int                                 # The unique identifier of the activity
@@ -200,7 +210,7 @@ class SummaryActivity(Model):
     athlete_count: int                      # The number of athletes for taking part in a group activity
     photo_count: int                        # The number of Instagram photos for this activity
     total_photo_count: int                  # The number of Instagram and Strava photos for this activity
-    # map: PolylineMap                        # An instance of PolylineMap TODO: IMPLEMENT?
+    map: PolylineMap                        # An instance of PolylineMap
     trainer: bool                           # Whether this activity was recorded on a training machine
     commute: bool                           # Whether this activity is a commute
     manual: bool                            # Whether this activity was created manually
@@ -224,8 +234,120 @@ class SummaryActivity(Model):
         if key.startswith('start_date'):
             return datetime.fromisoformat(value)
         elif key.endswith('latlng'):
-            return (value[0], value[1])
+            return (value[0], value[1]) if value else None
         elif key == 'athlete':
-            return ID(value)
+            return ID.fromResponse(value)
+        elif key == 'map':
+            return PolylineMap.fromResponse(value)
         else:
             return value
+
+@model
+class SummaryClub(Model):
+    """A summary of a club"""
+    id: int                                 # The club's unique identifier.
+    name: str                               # The club's name.
+    profile_medium: str                     # URL to a 60x60 pixel profile picture.
+    cover_photo: Optional[str]              # URL to a ~1185x580 pixel cover photo.
+    cover_photo_small: Optional[str]        # URL to a ~360x176 pixel cover photo.
+    sport_type: str                         # May take one of the following values: cycling, running, triathlon, other
+    activity_types: list[str]               # The activity types that count for a club. This takes precedence over sport_type.
+    city: str                               # The club's city.
+    state: str                              # The club's state or geographical region.
+    country: str                            # The club's country.
+    private: bool                           # Whether the club is private.
+    member_count: int                       # The club's member count.
+    featured: bool                          # Whether the club is featured or not.
+    verified: bool                          # Whether the club is verified or not.
+    url: str                                # The club's vanity URL.
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return value
+
+@model
+class ClubAthlete(Model):
+    """A member of a club. Strava only gives the initial of the athlete's last name."""
+    firstname: str                          # The athlete's first name.
+    lastname: str                           # The athlete's last initial.
+    member: str                             # The athlete's member status.
+    admin: bool                             # Whether the athlete is a club admin.
+    owner: bool                             # Whether the athlete is club owner.
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return value
+
+@model
+class ClubActivityAthlete(Model):
+    """The athlete of a club activity, which is only their name"""
+    firstname: str                          # The athlete's first name.
+    lastname: str                           # The athlete's last initial.
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return value
+
+@model(intern=('sport_type',))
+class ClubActivity(Model):
+    """
+    An activity by a member of a club. Strava doesn't give its ID or when it took place,
+    and the athlete is only a name.
+    """
+    athlete: ClubActivityAthlete            # The athlete who recorded the activity
+    name: str                               # The name of the activity
+    distance: float                         # The activity's distance, in meters
+    moving_time: int                        # The activity's moving time, in seconds
+    elapsed_time: int                       # The activity's elapsed time, in seconds
+    total_elevation_gain: float             # The activity's total elevation gain.
+    sport_type: SportType                   # An instance of SportType.
+    workout_type: Optional[int]             # The activity's workout type
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return ClubActivityAthlete.fromResponse(value) if key == 'athlete' else value
+
+class StreamType(StrEnum):
+    """The types of stream that can be requested for an activity"""
+    time="time"
+    distance="distance"
+    latlng="latlng"
+    altitude="altitude"
+    velocity_smooth="velocity_smooth"
+    heartrate="heartrate"
+    cadence="cadence"
+    watts="watts"
+    temp="temp"
+    moving="moving"
+    grade_smooth="grade_smooth"
+
+@model
+class Stream(Model):
+    """A series of samples recorded during an activity"""
+    original_size: int                      # The number of data points in this stream
+    resolution: str                         # The level of detail (sampling) in which this stream was returned. May take one of the following values: low, medium, high
+    series_type: str                        # The base series used in the case the stream was downsampled. May take one of the following values: distance, time
+    data: list[Any]                         # The sequence of values for this stream
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return value
+
+@model
+class StreamSet(Model):
+    """The streams of an activity, any stream that wasn't requested or recorded is `None`"""
+    time: Optional[Stream]                  # Seconds since the start of the activity
+    distance: Optional[Stream]              # Distance travelled, in meters
+    latlng: Optional[Stream]                # Pairs of latitude and longitude
+    altitude: Optional[Stream]              # Altitude, in meters
+    velocity_smooth: Optional[Stream]       # Smoothed speed, in meters per second
+    heartrate: Optional[Stream]             # Heart rate, in beats per minute
+    cadence: Optional[Stream]               # Cadence, in rotations per minute
+    watts: Optional[Stream]                 # Power output, in watts
+    temp: Optional[Stream]                  # Temperature, in degrees celsius
+    moving: Optional[Stream]                # Whether the athlete was moving
+    grade_smooth: Optional[Stream]          # Smoothed grade, as a percentage
+
+    @classmethod
+    def parse_field(cls, key: str, value: Any) -> Any:
+        return Stream.fromResponse(value)
@@ -1,8 +1,10 @@
 from __future__ import annotations
 import os
+import threading
+import time
 from typing import Optional
 import urllib.parse
-import requests
+from apis.transport import Response, transport
 from dataclasses import dataclass
 
 CLIENT_ID = os.environ['CLIENT_ID']
@@ -16,33 +18,44 @@ connect_url = "https://www.strava.com/oauth/authorize?" + urllib.parse.urlencode
     'scope': 'read,profile:read_all,activity:read_all',
 })
 
+# Tokens are exchanged with this endpoint
+TOKEN_URL = "https://www.strava.com/api/v3/oauth/token"
+
+# Access tokens are refreshed this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 300
+
 @dataclass(frozen=True)
 class OAuthTokens:
     """A pair of two tokens for the Strava OAuth2: an access token and a refresh token"""
 
     access: str
     refresh: str
+    expires_at: float = 0 # When the access token expires, in seconds since the epoch
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the access token can still be used"""
+        return self.expires_at - TOKEN_EXPIRY_MARGIN > time.time()
 
     def deauthorize(self) -> None:
         """De-authorize the current user (i.e. log out)"""
-        requests.post("https://www.strava.com/api/v3/oauth/deauthorize", data={
+        transport().post("https://www.strava.com/api/v3/oauth/deauthorize", data={
             'access_token': self.access,
         })
 
+    @classmethod
+    def from_response(cls, req: Response) -> Optional[OAuthTokens]:
+        """Reads the tokens from a response of the token endpoint"""
+        if req.status_code != 200: return
+        res = req.json()
+        return cls(res['access_token'], res['refresh_token'], res.get('expires_at', 0))
+
     @classmethod
     def from_refresh(cls, refresh_token) -> Optional[OAuthTokens]:
         """
         Given a refresh token from the client, we can obtain the new access and refresh tokens.
         """
-        req = requests.post("https://www.strava.com/api/v3/oauth/token", data={
-            'client_id': CLIENT_ID,
-            'client_secret': CLIENT_SECRET,
-            'grant_type': 'refresh_token',
-            'refresh_token': refresh_token,
-        })
-        res = req.json()
-        if req.status_code != 200: return
-        return cls(res['access_token'], res['refresh_token'])
+        return cls.from_response(transport().post(TOKEN_URL, data=refresh_data(refresh_token)))
 
 
     @classmethod
@@ -51,15 +64,49 @@ class OAuthTokens:
         Given an authorization code from Strava, we can obtain the access and refresh tokens
         that allow us to access the user's data.
         """
-        req = requests.post("https://www.strava.com/api/v3/oauth/token", data={
+        return cls.from_response(transport().post(TOKEN_URL, data={
             'client_id': CLIENT_ID,
             'client_secret': CLIENT_SECRET,
             'code': auth_code,
             'grant_type': 'authorization_code',
-        })
-        if req.status_code != 200: return
-        res = req.json()
-        return cls(res['access_token'], res['refresh_token'])
+        }))
+
+
+def refresh_data(refresh_token: str) -> dict[str, str]:
+    """The form data to exchange a refresh token for new tokens"""
+    return {
+        'client_id': CLIENT_ID,
+        'client_secret': CLIENT_SECRET,
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+    }
+
+
+# Tokens by the refresh token they were obtained with, so a user's tokens are only
+# exchanged once per access token rather than on every request
+_token_cache: dict[str, OAuthTokens] = {}
+_token_cache_lock = threading.Lock()
+
+def fresh_cached_tokens(refresh_token: str) -> Optional[OAuthTokens]:
+    """The cached tokens for a refresh token, if their access token can still be used"""
+    with _token_cache_lock:
+        tokens = _token_cache.get(refresh_token)
+    return tokens if tokens and tokens.fresh else None
+
+def cached_tokens(refresh_token: str) -> Optional[OAuthTokens]:
+    """Tokens for a refresh token, exchanging it with Strava unless a fresh access token is cached"""
+    tokens = fresh_cached_tokens(refresh_token)
+    if tokens: return tokens
+    tokens = OAuthTokens.from_refresh(refresh_token)
+    if tokens: cache_tokens(tokens, refresh_token)
+    return tokens
+
+def cache_tokens(tokens: OAuthTokens, *refresh_tokens: str) -> None:
+    """Caches tokens under their own refresh token and any others that lead to them"""
+    with _token_cache_lock:
+        # Drop expired tokens so the cache doesn't grow forever
+        for key in [k for k, t in _token_cache.items() if not t.fresh]: del _token_cache[key]
+        for key in {tokens.refresh, *refresh_tokens}: _token_cache[key] = tokens
 
 
 class Client:
@@ -67,6 +114,7 @@ class Client:
 
     tokens: OAuthTokens
     api_calls: int = 0 # Track total number of API calls for this client
+    athlete_id: Optional[int] = None # The authenticated athlete, once fetched
 
     def __init__(self, tokens: OAuthTokens):
         self.tokens = tokens
@@ -74,7 +122,7 @@ class Client:
     @classmethod
     def from_refresh(cls, refresh_token: Optional[str]) -> Optional[Client]:
         if not refresh_token: return
-        tokens = OAuthTokens.from_refresh(refresh_token)
+        tokens = cached_tokens(refresh_token)
         if not tokens: return
         return Client(tokens)
 
@@ -83,11 +131,14 @@ class Client:
         if not auth_code: return
         tokens = OAuthTokens.from_code(auth_code)
         if not tokens: return
+        cache_tokens(tokens)
         return Client(tokens)
 
     def deauthorize(self):
         if self.tokens:
             self.tokens.deauthorize()
+            with _token_cache_lock:
+                for key in [k for k, t in _token_cache.items() if t == self.tokens]: del _token_cache[key]
 
     # Properties are cached to avoid duplicate API calls
 
@@ -0,0 +1,43 @@
+"""
+Decoding and encoding of the polylines Strava uses for activity routes, see
+https://developers.google.com/maps/documentation/utilities/polylinealgorithm.
+"""
+
+import numpy as np
+
+def decode(encoded: str, precision: int = 5) -> np.ndarray:
+    """Decodes a polyline into an array of `[latitude, longitude]` rows"""
+    if not encoded:
+        return np.empty((0, 2))
+
+    # Each character holds 5 bits of a value, the 0x20 bit is set on every chunk but the last
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    last = (chunks & 0x20) == 0
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # Shift every chunk into place within its value and sum the chunks of each value
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1f) << (5 * position), starts)
+
+    # Undo the zig-zag sign encoding, then the delta encoding
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    if len(values) % 2:
+        values = values[:-1]
+    return np.cumsum(values.reshape(-1, 2), axis=0) / 10**precision
+
+def encode(points: np.ndarray, precision: int = 5) -> str:
+    """Encodes an array of `[latitude, longitude]` rows as a polyline"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    values = np.round(points * 10**precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), np.int64)).ravel()
+    # Zig-zag encode the sign into the lowest bit
+    deltas = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in deltas.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
@@ -0,0 +1,76 @@
+"""
+Measures the activity map's payload, as sent to the browser by its Dash callback, for histories of
+several sizes: the figure as it used to be sent, a `Scattergeo` trace of plain lists of latitudes
+and longitudes with a label for every marker, and the figure from `plotting.figures.activity_map`,
+which goes through `compact_figure`. For each it reports the bytes of the whole figure's JSON and
+of its traces alone, and the milliseconds taken to build and serialise the figure with plotly's
+JSON encoder, as Dash does.
+
+Run with `python -m tests.bench_figures [markers ...]`.
+"""
+
+import os
+import sys
+
+os.environ.setdefault('CLIENT_ID', 'bench')
+os.environ.setdefault('CLIENT_SECRET', 'bench')
+os.environ.setdefault('STRAVACO2_CACHE', 'off')
+
+import json
+import time
+from typing import Any, Callable
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import history
+from plotting.figures import activity_map
+from strava_api.models import SummaryActivity
+from .bench_models import make_history
+
+# Histories measured unless sizes are given on the command line
+MARKERS = (1000, 5000, 20000)
+
+# Times each figure is built, the mean is reported
+REPEATS = 5
+
+
+def labelled_map(activity_history: history.ActivityHistory) -> go.Figure:
+    """The activity map as it was sent before `compact_figure`, with a label for every marker"""
+    activities = [a for a in activity_history.select() if a.start_latlng]
+    fig = go.Figure()
+    fig.add_trace(go.Scattergeo(
+        mode='markers',
+        lon=[a.start_latlng[1] for a in activities],
+        lat=[a.start_latlng[0] for a in activities],
+        text=[a.name + ' ' + a.start_date_local.strftime('%d %b %H:%M') for a in activities],
+    ))
+    fig.update_layout(
+        margin={'l':0,'t':0,'b':0,'r':0},
+        geo=dict(projection_type='orthographic', showland=True),
+    )
+    return fig
+
+
+def measure(build: Callable[[], Any]) -> tuple[int, int, float]:
+    """The bytes of a figure's JSON and of its traces', and the mean milliseconds to build and serialise it"""
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        text = pio.to_json(build(), validate=False)
+    elapsed = (time.perf_counter() - start) / REPEATS * 1000
+    traces = json.dumps(json.loads(text)['data'], separators=(',', ':'))
+    return len(text.encode()), len(traces.encode()), elapsed
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or MARKERS
+    print(f"{'markers':>8}  {'':22}{'figure kB':>10}{'traces kB':>11}{'ms':>8}")
+    for n in sizes:
+        activity_history = history.ActivityHistory(0)
+        # One in twenty activities is manual and has no start location, so make enough that `n` have one
+        responses = make_history(n + n // 10)
+        activity_history.add(a for a in SummaryActivity.fromResponse(responses) if a.start_latlng)
+        activity_history.remove(sorted(activity_history.activities)[n:])
+        for label, build in (('labelled Scattergeo', lambda: labelled_map(activity_history)), ('compact_figure', lambda: activity_map(activity_history))):
+            figure, traces, ms = measure(build)
+            print(f"{n:8}  {label:22}{figure / 1000:10.1f}{traces / 1000:11.1f}{ms:8.1f}")
@@ -0,0 +1,160 @@
+"""
+Measures the memory each activity of a history takes, for `SummaryActivity` as declared with
+`@apis.model` (slots, and interned `sport_type`, `timezone`, and `gear_id`) and for the same
+fields in a plain `@dataclass(frozen=True)` with a `__dict__`, as models were before `@model`.
+The history is synthetic but shaped like a real one: repeated names, a few sports, gear, and
+timezones, and a summary polyline of a random walk for every activity that isn't manual.
+Each history is measured with `tracemalloc` as parsed from the JSON (once the JSON is freed)
+and after a pickle round trip, as when it's loaded from disk.
+
+Run with `python -m tests.bench_models [activities]`.
+"""
+
+import os
+import sys
+
+os.environ.setdefault('CLIENT_ID', 'bench')
+os.environ.setdefault('CLIENT_SECRET', 'bench')
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import gc
+import json
+import pickle
+import random
+import tracemalloc
+from typing import Any, Callable
+
+import numpy as np
+
+from apis import Model
+from strava_api import polyline
+from strava_api.models import ID, PolylineMap, SummaryActivity
+
+# Activities in the history unless given on the command line
+ACTIVITIES = 3000
+
+NAMES = ('Morning Ride', 'Afternoon Ride', 'Evening Ride', 'Lunch Run', 'Morning Run', 'Evening Walk', 'Commute')
+SPORTS = ('Ride', 'Ride', 'Ride', 'Run', 'Run', 'Walk', 'GravelRide', 'VirtualRide', 'Swim', 'Hike')
+TIMEZONES = ('(GMT+00:00) Europe/London', '(GMT+01:00) Europe/Paris', '(GMT-05:00) America/New_York')
+GEAR = ('b1234567', 'b7654321', 'g2468024', None)
+
+
+def plain(cls: type[Model], parse_field: Callable[[str, Any], Any]) -> type[Model]:
+    """A frozen dataclass with the fields of a model, but with a `__dict__` and nothing interned"""
+    name = f'Plain{cls.__name__}'
+    namespace = {
+        '__annotations__': dict(cls.__annotations__),
+        '__module__': __name__,
+        '__qualname__': name,
+        'parse_field': classmethod(lambda _, key, value: parse_field(key, value)),
+    }
+    return dataclass(frozen=True)(type(name, (Model,), namespace))
+
+PlainID = plain(ID, ID.parse_field)
+PlainPolylineMap = plain(PolylineMap, PolylineMap.parse_field)
+
+def parse_plain_activity(key: str, value: Any) -> Any:
+    if key == 'athlete': return PlainID.fromResponse(value)
+    if key == 'map': return PlainPolylineMap.fromResponse(value)
+    return SummaryActivity.parse_field(key, value)
+
+PlainSummaryActivity = plain(SummaryActivity, parse_plain_activity)
+
+
+def make_history(n: int, seed: int = 0) -> list[dict[str, Any]]:
+    """`/athlete/activities` responses of `n` activities, oldest first"""
+    rng = random.Random(seed)
+    start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+    activities = []
+    for id in range(n):
+        start += timedelta(seconds=rng.randrange(3600, 3 * 86400))
+        sport = rng.choice(SPORTS)
+        manual = rng.random() < 0.05
+        distance = rng.uniform(2000, 80000)
+        moving_time = rng.randrange(600, 14400)
+        # A third of activities are renamed to something unique
+        name = f'{rng.choice(NAMES)} #{id}' if rng.random() < 0.3 else rng.choice(NAMES)
+        lat, lng = 51.5 + rng.uniform(-0.2, 0.2), -0.1 + rng.uniform(-0.2, 0.2)
+        route = np.array([lat, lng]) + np.cumsum(np.random.default_rng(id).normal(0, 0.001, (rng.randrange(50, 300), 2)), axis=0)
+        activities.append({
+            'resource_state': 2,
+            'athlete': {'id': 1234, 'resource_state': 1},
+            'id': 10_000_000_000 + id,
+            'external_id': f'garmin_push_{rng.getrandbits(40)}',
+            'upload_id': 11_000_000_000 + id,
+            'upload_id_str': str(11_000_000_000 + id),
+            'name': name,
+            'distance': distance,
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randrange(0, 1800),
+            'total_elevation_gain': rng.uniform(0, 1500),
+            'elev_high': rng.uniform(50, 500),
+            'elev_low': rng.uniform(0, 50),
+            'type': sport,
+            'sport_type': sport,
+            'start_date': start.isoformat().replace('+00:00', 'Z'),
+            'start_date_local': start.replace(tzinfo=None).isoformat() + 'Z',
+            'timezone': rng.choice(TIMEZONES),
+            'utc_offset': 0.0,
+            'start_latlng': None if manual else route[0].round(6).tolist(),
+            'end_latlng': None if manual else route[-1].round(6).tolist(),
+            'achievement_count': rng.randrange(0, 10),
+            'kudos_count': rng.randrange(0, 30),
+            'comment_count': rng.randrange(0, 3),
+            'athlete_count': rng.randrange(1, 5),
+            'photo_count': 0,
+            'total_photo_count': rng.randrange(0, 3),
+            'map': {'id': f'a{10_000_000_000 + id}', 'summary_polyline': '' if manual else polyline.encode(route), 'resource_state': 2},
+            'trainer': sport.startswith('Virtual'),
+            'commute': rng.random() < 0.2,
+            'manual': manual,
+            'private': rng.random() < 0.1,
+            'flagged': False,
+            'workout_type': None,
+            'average_speed': distance / moving_time,
+            'max_speed': distance / moving_time * rng.uniform(1.5, 3),
+            'has_kudoed': False,
+            'hide_from_home': False,
+            'gear_id': rng.choice(GEAR),
+            'kilojoules': rng.uniform(100, 2000) if 'Ride' in sport else None,
+            'average_watts': rng.uniform(80, 250) if 'Ride' in sport else None,
+            'device_watts': 'Ride' in sport and rng.random() < 0.5,
+            'max_watts': rng.randrange(300, 900) if 'Ride' in sport else None,
+            'weighted_average_watts': rng.randrange(80, 300) if 'Ride' in sport else None,
+        })
+    return activities
+
+
+def traced(build: Callable[[], list[Any]]) -> tuple[int, list[Any]]:
+    """The bytes still allocated by `build` once it has returned, and what it returned"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - start, result
+    finally:
+        tracemalloc.stop()
+
+
+def measure(cls: type[Model], text: str) -> tuple[float, float, float]:
+    """Bytes per activity as parsed, as parsed without the polylines' strings, and once unpickled"""
+    parsed, activities = traced(lambda: cls.fromResponse(json.loads(text)))
+    polylines = sum(sys.getsizeof(a.map.summary_polyline) for a in activities)
+    data = pickle.dumps(activities)
+    del activities
+    unpickled, _ = traced(lambda: pickle.loads(data))
+    n = len(json.loads(text))
+    return parsed / n, (parsed - polylines) / n, unpickled / n
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else ACTIVITIES
+    text = json.dumps(make_history(n))
+    print(f"Bytes per activity of a history of {n} activities")
+    print(f"{'':28}{'parsed':>10}{'no polyline':>14}{'unpickled':>12}")
+    for label, cls in (('@dataclass(frozen=True)', PlainSummaryActivity), ('@model (slots, interned)', SummaryActivity)):
+        parsed, bare, unpickled = measure(cls, text)
+        print(f"{label:28}{parsed:10.0f}{bare:14.0f}{unpickled:12.0f}")
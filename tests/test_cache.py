@@ -0,0 +1,195 @@
+"""
+`SQLiteCache` is shared by the server's worker processes. These tests check that entries expire
+after their TTL, that the least recently used entries are the ones evicted once the cache is
+over its size, that a key being computed under a lease isn't computed again by anyone else
+meanwhile, and that Strava responses fetched with different athletes' tokens are kept apart.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from typing import Any
+
+os.environ.setdefault('CLIENT_ID', 'test')
+os.environ.setdefault('CLIENT_SECRET', 'test')
+os.environ.setdefault('STRAVACO2_DATA', tempfile.mkdtemp())
+os.environ.setdefault('STRAVACO2_CACHE', 'off')
+
+import pytest
+
+import apis
+from apis import cache as caching
+from apis.cache import MISSING, SQLiteCache
+from apis.transport import RecordedResponse, Transport
+import strava_api as api
+
+# Each value is a string of this many characters, and takes two more bytes as JSON
+VALUE_LENGTH = 100
+
+
+class Clock:
+    """Stands in for the `time` module in `apis.cache`, with a wall clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.monotonic = time.monotonic
+        self.sleep = time.sleep
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    c = Clock()
+    monkeypatch.setattr(caching, 'time', c)
+    return c
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'cache.sqlite')
+
+
+def test_expires_after_ttl(clock, path):
+    c = SQLiteCache(path)
+    c.set('ns', 'short', 'a', ttl=10)
+    c.set('ns', 'long', 'b', ttl=100)
+    assert c.get('ns', 'short') == 'a'
+
+    clock.now += 9.9
+    assert c.get('ns', 'short') == 'a'
+    clock.now += 0.1
+    assert c.get('ns', 'short') is MISSING
+    assert c.get('ns', 'long') == 'b'
+
+    # Setting it again starts its TTL afresh
+    c.set('ns', 'short', 'c', ttl=10)
+    clock.now += 5
+    assert c.get('ns', 'short') == 'c'
+
+    clock.now += 95
+    assert c.get('ns', 'long') is MISSING
+    stats = c.stats()['ns']
+    assert (stats.hits, stats.misses, stats.sets) == (4, 2, 3)
+
+
+def test_evicts_least_recently_used(clock, path):
+    size = VALUE_LENGTH + 2
+    c = SQLiteCache(path, max_bytes=10 * size)
+    # Ten entries fill the cache exactly, each used later than the one before
+    for i in range(10):
+        c.set('ns', f'k{i}', str(i) * VALUE_LENGTH, ttl=3600)
+        clock.now += caching.TOUCH_SECONDS + 1
+    # Reading the oldest makes it the most recently used
+    assert c.get('ns', 'k0') == '0' * VALUE_LENGTH
+    clock.now += 1
+
+    # One more is over the size, so enough of the least recently used go to get down to `EVICT_TO`
+    c.set('ns', 'k10', 'x' * VALUE_LENGTH, ttl=3600)
+    evicted = {f'k{i}' for i in (1, 2)}
+    for i in range(11):
+        assert (c.get('ns', f'k{i}') is MISSING) == (f'k{i}' in evicted), f'k{i}'
+    stats = c.stats()['ns']
+    assert (stats.evictions, stats.entries, stats.bytes) == (2, 9, 9 * size)
+    assert stats.bytes <= caching.EVICT_TO * c.max_bytes
+
+
+def test_evicts_expired_first(clock, path):
+    size = VALUE_LENGTH + 2
+    c = SQLiteCache(path, max_bytes=3 * size)
+    c.set('ns', 'old', 'a' * VALUE_LENGTH, ttl=3600)
+    clock.now += 1
+    c.set('ns', 'expiring', 'b' * VALUE_LENGTH, ttl=10)
+    c.set('ns', 'new', 'c' * VALUE_LENGTH, ttl=3600)
+    clock.now += 10
+
+    # The expired entry makes enough room, even though it was used more recently than `old`
+    c.set('ns', 'newest', 'd' * VALUE_LENGTH, ttl=3600)
+    assert c.get('ns', 'old') == 'a' * VALUE_LENGTH
+    assert c.get('ns', 'expiring') is MISSING
+    assert c.stats()['ns'].entries == 3
+
+
+def test_lease_blocks_others(monkeypatch, path):
+    monkeypatch.setattr(caching, 'LEASE_POLL_SECONDS', 0.01)
+    # A cache each, as if in two processes with their own connections
+    first, second = SQLiteCache(path), SQLiteCache(path)
+    computing, finish = threading.Event(), threading.Event()
+    computed: list[str] = []
+    results: dict[str, Any] = {}
+
+    def slow() -> str:
+        computed.append('first')
+        computing.set()
+        assert finish.wait(10)
+        return 'value'
+
+    def fast() -> str:
+        computed.append('second')
+        return 'other value'
+
+    holder = threading.Thread(target=lambda: results.update(first=first.get_or_compute('ns', 'key', slow, ttl=60)))
+    holder.start()
+    assert computing.wait(10)
+    waiter = threading.Thread(target=lambda: results.update(second=second.get_or_compute('ns', 'key', fast, ttl=60)))
+    waiter.start()
+
+    # The second waits as long as the first holds the lease
+    waiter.join(0.5)
+    assert waiter.is_alive()
+    assert 'second' not in results
+
+    finish.set()
+    holder.join(10)
+    waiter.join(10)
+    assert results == {'first': 'value', 'second': 'value'}
+    assert computed == ['first']
+    # The lease is given up once the value is stored
+    assert first._db.execute('SELECT COUNT(*) FROM leases').fetchone() == (0,)
+
+
+def test_lease_given_up_if_not_stored(monkeypatch, path):
+    monkeypatch.setattr(caching, 'LEASE_POLL_SECONDS', 0.01)
+    c = SQLiteCache(path)
+
+    def fail() -> str:
+        raise ValueError()
+
+    # A failed computation gives up its lease
+    with pytest.raises(ValueError):
+        c.get_or_compute('ns', 'key', fail, ttl=60)
+    assert c._db.execute('SELECT COUNT(*) FROM leases').fetchone() == (0,)
+    # A value that isn't stored, e.g. an error response, is computed again by the next caller
+    assert c.get_or_compute('ns', 'key', lambda: 'error', ttl=60, store=lambda _: False) == 'error'
+    assert c.get_or_compute('ns', 'key', lambda: 'value', ttl=60) == 'value'
+    assert c.get('ns', 'key') == 'value'
+
+
+class AthleteTransport(Transport):
+    """Responds to `/athlete` with the athlete whose access token the request is sent with"""
+
+    def __init__(self):
+        self.requests: list[str] = []
+
+    def request(self, method, url, params=None, headers=None, stream=False):
+        token = (headers or {})['Authorization'].removeprefix('Bearer ')
+        self.requests.append(token)
+        id = int(token.removeprefix('access-'))
+        return RecordedResponse(200, url, f'{{"id": {id}, "firstname": "Athlete", "lastname": "{id}"}}', 0)
+
+
+def test_tokens_kept_apart(path):
+    transport = AthleteTransport()
+    clients = [api.Client(api.oauth.OAuthTokens(f'access-{id}', f'refresh-{id}')) for id in (1, 2)]
+    with apis.transport.using(transport), caching.using(SQLiteCache(path)) as c:
+        for _ in range(2):
+            assert [api.get_athlete(client).id for client in clients] == [1, 2]
+        # Each athlete's was only fetched once, and the second time came from the cache
+        assert transport.requests == ['access-1', 'access-2']
+        assert [client.api_calls for client in clients] == [1, 1]
+
+        keys = [key for (key,) in c._db.execute('SELECT key FROM entries WHERE namespace = ?', ('strava:athlete',))]
+        assert len(keys) == 2
+        assert not any('access-' in key for key in keys), "Access tokens are kept in the cache"
@@ -0,0 +1,233 @@
+"""
+Pages and plot callbacks read athletes' histories while the background sync adds to them. This
+stress test runs a sync thread filling fresh histories for several athletes at once, with activities
+of one new sport after another at random dates, while each athlete has a thread of their own
+requesting the pages, the figures, and the activity map's and distance map's Dash callbacks.
+It fails if any request errors, e.g. because a view was read while the sync was changing it, or
+if any response holds another athlete's activities, city, or name.
+"""
+
+import base64
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any
+
+os.environ.setdefault('CLIENT_ID', 'test')
+os.environ.setdefault('CLIENT_SECRET', 'test')
+os.environ.setdefault('STRAVACO2_DATA', tempfile.mkdtemp())
+os.environ.setdefault('STRAVACO2_CACHE', 'off')
+
+import numpy as np
+import pytest
+
+import strava_api as api
+import geodb_api as geodb
+import history
+from history.jobs import Job, JobState
+from plotting import figures
+from server import app
+import stravaCO2 # Mounts the Dash app on the server
+
+# Histories filled by the sync for each athlete, each with a page of `PAGE_SIZE` activities of every sport
+HISTORIES = 10
+PAGE_SIZE = 5
+
+# Athletes, each with a thread requesting pages and figures while the sync runs
+ATHLETES = 4
+
+PATHS = ('/', '/activities', '/activities?sport=Ride&commute=yes', '/figures?names=activityclock,activitymap,distancemap')
+
+# Activity IDs start at the athlete's ID times this, so the IDs in a figure say whose they are
+ID_STRIDE = 10**8
+
+# Everything that names an athlete in a response: their activities, home city and its destination, and name
+OWNER = re.compile(r'\b(?:Athlete|Home|Dest) (\d+)\b')
+
+
+def make_activity(athlete_id: int, n: int, sport: str, rng: random.Random) -> api.models.SummaryActivity:
+    start = datetime(2015, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(10 * 365 * 86400))
+    lat, lng = 51.5 + rng.uniform(-1, 1), -0.1 + rng.uniform(-1, 1)
+    id = athlete_id * ID_STRIDE + n
+    return api.models.SummaryActivity.fromResponse({
+        'id': id,
+        'name': f'Athlete {athlete_id} activity {n}',
+        # Each athlete's activities are a different length, so their distance maps differ
+        'distance': 1000 * athlete_id + rng.uniform(0, 100),
+        'moving_time': rng.randrange(600, 10000),
+        'elapsed_time': rng.randrange(600, 10000),
+        'total_elevation_gain': rng.uniform(0, 500),
+        'sport_type': sport,
+        'start_date': start.isoformat(),
+        'start_date_local': start.replace(tzinfo=None).isoformat(),
+        'timezone': '(GMT+00:00) Europe/London',
+        'start_latlng': [lat, lng],
+        'end_latlng': [lat + 0.01, lng + 0.01],
+        'commute': rng.random() < 0.2,
+        'achievement_count': 0,
+    })
+
+
+def make_city(id: int, name: str, distance: float = 0) -> geodb.models.PopulatedPlaceSummary:
+    return geodb.models.PopulatedPlaceSummary(
+        country='United Kingdom', countryCode='GB', id=geodb.models.ID(id), latitude=51.5, longitude=-0.1,
+        name=name, population=1000, region='', regionCode='', regionWdId=None,
+        type=geodb.models.PopulatedPlaceType.CITY, wikiDataId='', distance=distance,
+    )
+
+
+@pytest.fixture
+def histories(monkeypatch) -> dict[int, list[history.ActivityHistory]]:
+    """The histories filled by the sync for each athlete, the last of which is served to the athlete's requests"""
+    athletes = {
+        id: api.models.Athlete.fromResponse({
+            'id': id, 'firstname': 'Athlete', 'lastname': str(id), 'city': f'Home {id}', 'state': '', 'country': '',
+            'measurement_preference': 'meters',
+        })
+        for id in range(1, ATHLETES + 1)
+    }
+    finished = Job('sync', JobState.DONE, 0, None, 0)
+    filled = {id: [history.ActivityHistory(id)] for id in athletes}
+
+    # Each athlete's refresh token is `token-<athlete ID>`
+    monkeypatch.setattr(api.Client, 'from_refresh', staticmethod(lambda token: SimpleNamespace(token=token, api_calls=0) if token else None))
+    monkeypatch.setattr(history, 'athlete_for', lambda client: athletes[int(client.token.removeprefix('token-'))])
+    monkeypatch.setattr(history, 'history_for', lambda athlete_id: filled[athlete_id][-1])
+    monkeypatch.setattr(history, 'sync_in_background', lambda client, athlete_id: finished)
+    # The athlete's home city, and a destination as far away as they've travelled, without GeoDB
+    monkeypatch.setattr(history, 'warm', lambda athlete_id: history.WarmAthlete(
+        athletes[athlete_id], time.time(), home_city=make_city(athlete_id, f'Home {athlete_id}'),
+    ))
+    monkeypatch.setattr(figures, 'destinations', lambda city, radius: [
+        make_city(ATHLETES + city.id, city.name.replace('Home', 'Dest'), radius / 1.5),
+    ])
+    return filled
+
+
+def dash_update(outputs: list[tuple[str, str]], inputs: list[tuple[str, str, Any]]) -> dict[str, Any]:
+    """The body of a request to run the callback of a plot's page, as the browser sends it"""
+    multi = len(outputs) > 1
+    output = '...'.join(f'{id}.{prop}' for id, prop in outputs)
+    specs = [{'id': id, 'property': prop} for id, prop in outputs]
+    return {
+        'output': f'..{output}..' if multi else output,
+        'outputs': specs if multi else specs[0],
+        'inputs': [{'id': id, 'property': prop, 'value': value} for id, prop, value in inputs],
+        'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}'],
+        'state': [],
+    }
+
+
+def activity_ids(value: Any) -> list[int]:
+    """The activity IDs in the `customdata` of the activity map's figure, or of its callback's response"""
+    if isinstance(value, list): return [id for v in value for id in activity_ids(v)]
+    if not isinstance(value, dict): return []
+    data = value.get('customdata')
+    if isinstance(data, dict) and 'bdata' in data:
+        ids = np.frombuffer(base64.b64decode(data['bdata']), np.dtype(data['dtype']).newbyteorder('<'))
+        return ids.astype(np.int64).tolist()
+    if isinstance(data, list): return [int(id) for id in data]
+    return [id for v in value.values() for id in activity_ids(v)]
+
+
+def test_pages_while_syncing(histories):
+    # Switch threads as often as possible, so reads overlap the sync's changes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    errors: list[BaseException] = []
+    # What each athlete was shown of their own, so the test can't pass by showing nothing
+    seen = {id: {'activities': 0, 'labels': 0, 'destinations': 0} for id in histories}
+    done = threading.Event()
+
+    def sync() -> None:
+        rng = random.Random(0)
+        try:
+            for _ in range(HISTORIES):
+                fresh = {}
+                for athlete_id in histories:
+                    activity_history = history.ActivityHistory(athlete_id)
+                    activity_history.synced = datetime.now(timezone.utc)
+                    # Create the views first, so every page reads views being added to
+                    for view in (history.ActivityClock, history.TimeIndex, history.StatsEngine, history.ActivityList, history.CO2Engine):
+                        activity_history.view(view)
+                    histories[athlete_id].append(activity_history)
+                    fresh[athlete_id] = activity_history
+                # A new sport in each page, so the views' dicts of sports keep growing. The
+                # athletes' histories are filled at the same time.
+                for i, sport in enumerate(api.models.SportType):
+                    for athlete_id, activity_history in fresh.items():
+                        activity_history.add(make_activity(athlete_id, i * PAGE_SIZE + j, sport, rng) for j in range(PAGE_SIZE))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def check(athlete_id: int, what: str, text: str) -> None:
+        owners = {int(id) for id in OWNER.findall(text)}
+        assert owners <= {athlete_id}, f"{what} for athlete {athlete_id} shows athletes {owners - {athlete_id}}"
+
+    def read(athlete_id: int) -> None:
+        client = app.test_client()
+        client.set_cookie('refresh-token', f'token-{athlete_id}')
+        other = athlete_id % ATHLETES + 1
+        try:
+            while not done.is_set():
+                for path in PATHS:
+                    res = client.get(path)
+                    assert res.status_code == 200, f'{path} responded {res.status_code}'
+                    check(athlete_id, path, res.get_data(as_text=True))
+                    if path.startswith('/figures'):
+                        ids = activity_ids(res.get_json()['activitymap'])
+                        assert all(id // ID_STRIDE == athlete_id for id in ids), f'{path} for athlete {athlete_id} has activities {[id for id in ids if id // ID_STRIDE != athlete_id][:5]}'
+
+                res = client.post('/plots/_dash-update-component', json=dash_update(
+                    [('activitymap', 'figure'), ('activitymap-sync', 'disabled')],
+                    [('url', 'search', ''), ('activitymap', 'relayoutData', None), ('activitymap-sync', 'n_intervals', None)],
+                ))
+                assert res.status_code == 200, f'The activity map responded {res.status_code}'
+                ids = activity_ids(res.get_json()['response'])
+                assert all(id // ID_STRIDE == athlete_id for id in ids), f'The activity map for athlete {athlete_id} has other activities'
+                seen[athlete_id]['activities'] += len(ids)
+
+                # Hovering over one of their own markers labels it, one of another athlete's doesn't exist for them
+                for id in (ids[-1:] if ids else []) + [other * ID_STRIDE]:
+                    res = client.post('/plots/_dash-update-component', json=dash_update(
+                        [('activitymap-label', 'children')],
+                        [('activitymap', 'hoverData', {'points': [{'customdata': id}]})],
+                    ))
+                    assert res.status_code == 200, f'The activity label responded {res.status_code}'
+                    label = res.get_json()['response']['activitymap-label']['children']
+                    check(athlete_id, 'The activity label', label)
+                    if id // ID_STRIDE == other: assert label == '', f'Athlete {athlete_id} was shown {label!r}'
+                    elif label: seen[athlete_id]['labels'] += 1
+
+                res = client.post('/plots/_dash-update-component', json=dash_update(
+                    [('distancemap', 'figure'), ('travelled-to-place-name', 'children'), ('distancemap-sync', 'disabled')],
+                    [('url', 'search', ''), ('geolocation', 'position', None), ('distancemap-sync', 'n_intervals', None)],
+                ))
+                assert res.status_code == 200, f'The distance map responded {res.status_code}'
+                check(athlete_id, 'The distance map', res.get_data(as_text=True))
+                description = res.get_json()['response'].get('travelled-to-place-name', {}).get('children')
+                if description:
+                    assert f'Home {athlete_id} to Dest {athlete_id}' in description, description
+                    seen[athlete_id]['destinations'] += 1
+        except BaseException as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=sync)] + [threading.Thread(target=read, args=(id,)) for id in histories]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not errors, errors[0]
+    for athlete_id, filled in histories.items():
+        assert len(filled[-1].activities) == PAGE_SIZE * len(api.models.SportType)
+        assert all(seen[athlete_id].values()), f"Athlete {athlete_id} was only shown {seen[athlete_id]}"
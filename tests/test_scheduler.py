@@ -0,0 +1,146 @@
+"""
+The scheduler's order doesn't depend on timing, only on what's queued when a slot comes free. So
+each test here holds the only slot while simulated athletes queue requests one at a time, then
+gives the slot up and checks the order they're served in: interactive requests first, then the
+athletes' bulk requests interleaved by stride scheduling, however many each queued. Athletes
+that have been idle for long enough are forgotten, on a clock the test moves by hand.
+"""
+
+import threading
+import time
+
+import pytest
+
+from apis import scheduler as scheduling
+from apis.scheduler import Priority, Scheduler
+
+BULK, INTERACTIVE = Priority.BULK, Priority.INTERACTIVE
+
+
+class Clock:
+    """Stands in for the `time` module in `apis.scheduler`, with a clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    c = Clock()
+    monkeypatch.setattr(scheduling, 'time', c)
+    return c
+
+
+class Athletes:
+    """Queues requests for simulated athletes on a scheduler with one slot, and records the order they're served in"""
+
+    def __init__(self, scheduler: Scheduler):
+        assert scheduler.max_concurrent == 1
+        self.scheduler = scheduler
+        self.served: list[str] = []
+        self.threads: list[threading.Thread] = []
+
+    def queued(self, key: str, priority: Priority) -> int:
+        with self.scheduler.lock:
+            stats = self.scheduler.stats.get((key, priority))
+            return stats.queued if stats else 0
+
+    def submit(self, key: str, priority: Priority = BULK) -> None:
+        """Queues a request, returning once it's waiting for the slot"""
+        def request() -> None:
+            with self.scheduler.slot(key, priority):
+                self.served.append(key if priority == BULK else f'{key}!')
+
+        before = self.queued(key, priority)
+        thread = threading.Thread(target=request, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        deadline = time.monotonic() + 10
+        while self.queued(key, priority) == before:
+            assert time.monotonic() < deadline, f'The request for {key} was never queued'
+            time.sleep(0.001)
+
+    def drain(self) -> list[str]:
+        """Gives up the slot, letting every queued request through one after another, and returns the order they were served in"""
+        self.scheduler.release()
+        for thread in self.threads: thread.join(10)
+        assert not any(thread.is_alive() for thread in self.threads)
+        served, self.served, self.threads = self.served, [], []
+        return served
+
+
+def hold(scheduler: Scheduler) -> Athletes:
+    scheduler.acquire('holder', BULK)
+    return Athletes(scheduler)
+
+
+def test_interleaves_athletes(clock):
+    athletes = hold(Scheduler('test', 1))
+    # Athlete a syncs a long history, b a shorter one, and c a page now and then, which it's waiting on the last time
+    for tick in range(6):
+        athletes.submit('a')
+        if tick % 2 == 0: athletes.submit('b')
+        if tick % 3 == 0: athletes.submit('c')
+    athletes.submit('c', INTERACTIVE)
+
+    # c's interactive request goes first and counts towards its share, so its bulk requests
+    # are a turn behind. Then each athlete takes a turn until they run out.
+    assert athletes.drain() == ['c!', 'a', 'b', 'a', 'b', 'c', 'a', 'b', 'c', 'a', 'a', 'a']
+
+
+def test_interactive_before_bulk(clock):
+    athletes = hold(Scheduler('test', 1))
+    for key in ('a', 'b'):
+        for _ in range(3): athletes.submit(key)
+    athletes.submit('b', INTERACTIVE)
+    athletes.submit('a', INTERACTIVE)
+    athletes.submit('c', INTERACTIVE)
+    # Every interactive request goes before any bulk one, the athletes taking turns in the order they queued
+    assert athletes.drain() == ['b!', 'a!', 'c!', 'a', 'b', 'a', 'b', 'a', 'b']
+
+
+def test_weights(clock):
+    scheduler = Scheduler('test', 1)
+    scheduler.set_weight('a', 2)
+    athletes = hold(scheduler)
+    for _ in range(6):
+        athletes.submit('a')
+        athletes.submit('b')
+    served = athletes.drain()
+    # Twice as many of a's requests are served, until it runs out
+    assert served == ['a', 'b', 'a', 'a', 'b', 'a', 'a', 'b', 'a', 'b', 'b', 'b']
+
+
+def test_idle_athletes_forgotten(clock):
+    scheduler = Scheduler('test', 1)
+    athletes = hold(scheduler)
+    athletes.submit('a')
+    athletes.submit('b')
+    assert athletes.drain() == ['a', 'b']
+    assert {key for key, _ in scheduler.stats} == {'holder', 'a', 'b'}
+    assert set(scheduler._passes) == {'holder', 'a', 'b'}
+
+    # b comes back just before it would be forgotten, and queues a request that waits behind the slot's holder
+    clock.now += scheduling.IDLE_TIMEOUT - 1
+    athletes = hold(scheduler)
+    athletes.submit('b')
+
+    # By the next check a has been idle too long, while b has a request queued
+    clock.now += scheduling.PRUNE_INTERVAL
+    athletes.submit('c')
+    assert {key for key, _ in scheduler.stats} == {'holder', 'b', 'c'}
+    assert set(scheduler._passes) == {'holder', 'b'}
+
+    assert athletes.drain() == ['b', 'c']
+
+    # Once everyone has been idle long enough they're all forgotten, and come back afresh
+    clock.now += scheduling.IDLE_TIMEOUT + 1
+    athletes = hold(scheduler)
+    assert {key for key, _ in scheduler.stats} == {'holder'}
+    assert set(scheduler._passes) == {'holder'}
+    athletes.submit('a')
+    assert athletes.drain() == ['a']
+    assert scheduler.metrics()['in_use'] == 0
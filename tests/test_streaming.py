@@ -0,0 +1,90 @@
+"""
+`iter_json_array` decodes a response body's array as it arrives, in chunks that can end anywhere:
+inside a string, an escape, a number, or a character of several bytes, or between an item and the
+',' after it. Each document here is fed in every way it can be split into three chunks, some of
+which may be empty, and must give the same items as `json.loads`. A body cut short must raise
+`ValueError` after giving at most the items that were complete.
+"""
+
+import json
+from typing import Iterator
+
+import pytest
+
+from apis.streaming import iter_json_array
+
+DOCUMENTS = {
+    'empty': '[]',
+    'empty with whitespace': ' \n[ \t\r\n ]\n',
+    'numbers': '[0,-1,23,4.5,-6.75e-3,1E+10,12345678901234567890]',
+    'strings': '["", "a", "with, comma", "]", "with \\"quotes\\""]',
+    'escapes': r'["\\", "\n\t\/", "é☃", "😀", "\\u0041"]',
+    'multibyte': '["café", "☃", "😀", "naïve résumé"]',
+    'literals': '[true, false, null]',
+    'nested': '[[], [1, [2, [3]]], {}, {"a": [1, {"b": "]"}]}]',
+    'whitespace between items': '[\n  1 ,\n\t"two"\r\n  ,   {"three" : 3}\n\n]',
+    'objects': '[{"id": 1, "name": "Morning Ride", "distance": 12345.6}, {"id": 22, "name": "Lunch Run", "start_latlng": [51.5, -0.12]}]',
+}
+
+# Bodies that aren't JSON arrays
+INVALID = {
+    'object': '{"a": 1}',
+    'number': '1',
+    'empty body': '',
+    'trailing comma': '[1, 2,]',
+    'leading comma': '[, 1]',
+    'missing comma': '[1 2]',
+    'missing value': '[1,, 2]',
+    'bad literal': '[tru]',
+    'bad escape': r'["\x"]',
+}
+
+
+def splits(body: bytes) -> Iterator[list[bytes]]:
+    """Every way to cut `body` into three chunks"""
+    for i in range(len(body) + 1):
+        for j in range(i, len(body) + 1):
+            yield [body[:i], body[i:j], body[j:]]
+
+
+def decode(chunks: list[bytes]) -> tuple[list, bool]:
+    """The items decoded from the chunks, and whether decoding raised `ValueError`"""
+    items = []
+    try:
+        for item in iter_json_array(chunks): items.append(item)
+    except ValueError:
+        return items, True
+    return items, False
+
+
+@pytest.mark.parametrize('text', DOCUMENTS.values(), ids=DOCUMENTS.keys())
+def test_every_split(text):
+    expected = json.dumps(json.loads(text))
+    body = text.encode()
+    for chunks in splits(body):
+        items, failed = decode(chunks)
+        assert not failed, chunks
+        # Compared as JSON so that e.g. 1 and 1.0 differ
+        assert json.dumps(items) == expected, chunks
+    # One byte at a time
+    assert json.dumps(decode([bytes([b]) for b in body])[0]) == expected
+
+
+@pytest.mark.parametrize('text', DOCUMENTS.values(), ids=DOCUMENTS.keys())
+def test_truncated(text):
+    expected = json.loads(text)
+    body = text.encode()
+    end = len(body.rstrip())
+    for n in range(end):
+        truncated = body[:n]
+        items, failed = decode([truncated[:n // 2], truncated[n // 2:]])
+        assert failed, truncated
+        # Only items that were complete, i.e. followed by their ',', are given
+        assert json.dumps(items) == json.dumps(expected[:len(items)]), truncated
+
+
+@pytest.mark.parametrize('text', INVALID.values(), ids=INVALID.keys())
+def test_invalid(text):
+    body = text.encode()
+    for chunks in splits(body):
+        assert decode(chunks)[1], chunks
@@ -0,0 +1,122 @@
+"""
+`TimeIndex` answers the totals of a date range from prefix sums. These tests compare its totals and
+activities with a brute-force sum over the history, for random ranges, empty and reversed ranges,
+and ranges that start or end exactly on an activity's start time, while activities are added in
+random order, some at the same second, and removed or edited.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+os.environ.setdefault('CLIENT_ID', 'test')
+os.environ.setdefault('CLIENT_SECRET', 'test')
+
+import pytest
+
+import history
+from history.timeindex import TimeIndex
+from strava_api.models import ActivityTotal, SummaryActivity
+
+SPORTS = ('Ride', 'Run', 'Walk')
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# Activities in each history, enough for the index to grow its arrays a few times
+ACTIVITIES = 300
+
+# Random ranges checked after each change
+QUERIES = 50
+
+
+def make_activity(id: int, start: datetime, rng: random.Random) -> SummaryActivity:
+    return SummaryActivity.fromResponse({
+        'id': id,
+        'name': f'Activity {id}',
+        'distance': rng.uniform(0, 50000),
+        'moving_time': rng.randrange(60, 20000),
+        'elapsed_time': rng.randrange(60, 25000),
+        'total_elevation_gain': rng.uniform(0, 1000),
+        'achievement_count': rng.randrange(0, 5),
+        'sport_type': rng.choice(SPORTS),
+        'start_date': start.isoformat(),
+        'start_date_local': start.replace(tzinfo=None).isoformat(),
+    })
+
+
+def brute_force(activities: list[SummaryActivity], start: Optional[datetime], end: Optional[datetime], sport: Optional[str]) -> list[SummaryActivity]:
+    return [
+        a for a in activities
+        if (start is None or a.start_date >= start) and (end is None or a.start_date < end) and (sport is None or a.sport_type == sport)
+    ]
+
+
+def check(activity_history: history.ActivityHistory, rng: random.Random) -> None:
+    index = activity_history.view(TimeIndex)
+    activities = list(activity_history.activities.values())
+    starts = [a.start_date for a in activities]
+    ranges: list[tuple[Optional[datetime], Optional[datetime]]] = [(None, None), (EPOCH - timedelta(days=1), EPOCH)]
+    for _ in range(QUERIES):
+        # Either end can be open, an activity's start time exactly, or any time
+        start, end = (
+            rng.choice([None, rng.choice(starts), EPOCH + timedelta(seconds=rng.randrange(400 * 86400))]) if starts else None
+            for _ in range(2)
+        )
+        ranges.append((start, end))
+        if start is not None:
+            # Empty: starting and ending at the same time
+            ranges.append((start, start))
+            # The second before and after a boundary
+            ranges.append((start - timedelta(seconds=1), start + timedelta(seconds=1)))
+    for start, end in ranges:
+        for sport in (None, *SPORTS, 'Swim'):
+            expected = brute_force(activities, start, end, sport)
+            total = index.total(start, end, sport)
+            assert total == ActivityTotal(
+                count=len(expected),
+                distance=pytest.approx(sum(a.distance for a in expected)),
+                moving_time=sum(a.moving_time for a in expected),
+                elapsed_time=sum(a.elapsed_time for a in expected),
+                elevation_gain=pytest.approx(sum(a.total_elevation_gain for a in expected)),
+                achievement_count=sum(a.achievement_count for a in expected),
+            ), (start, end, sport)
+
+            times, ids, _ = index.slice(start, end, sport)
+            assert sorted(ids.tolist()) == sorted(a.id for a in expected), (start, end, sport)
+            assert (times[1:] >= times[:-1]).all()
+            assert times.tolist() == sorted(int(a.start_date.timestamp()) for a in expected)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    # Random start dates over a year, a few shared by several activities
+    starts = [EPOCH + timedelta(seconds=rng.randrange(365 * 86400)) for _ in range(ACTIVITIES)]
+    starts += rng.sample(starts, ACTIVITIES // 10)
+    activities = [make_activity(id, start, rng) for id, start in enumerate(starts)]
+
+    activity_history = history.ActivityHistory(0)
+    activity_history.view(TimeIndex)
+    check(activity_history, rng)
+
+    # Added in random order, a page at a time
+    rng.shuffle(activities)
+    for i in range(0, len(activities), 100):
+        activity_history.add(activities[i:i + 100])
+        check(activity_history, rng)
+
+    # Some edited to a different date or sport, and some removed
+    edited = [make_activity(a.id, EPOCH + timedelta(seconds=rng.randrange(365 * 86400)), rng) for a in rng.sample(activities, 30)]
+    activity_history.add(edited)
+    check(activity_history, rng)
+    activity_history.remove(a.id for a in rng.sample(activities, 50))
+    check(activity_history, rng)
+
+    # A view created from a history that already has activities matches one that was added to
+    rebuilt = history.ActivityHistory(0)
+    rebuilt.add(activity_history.activities.values())
+    check(rebuilt, rng)
+
+    activity_history.remove(list(activity_history.activities))
+    check(activity_history, rng)
+    assert activity_history.view(TimeIndex).total() == ActivityTotal()